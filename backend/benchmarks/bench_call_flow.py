@@ -0,0 +1,103 @@
+"""End-to-end load test of the call flow against the local simulator.
+
+Replays thousands of simulated callers through the real handlers (sim/)
+and reports time-to-answer percentiles, Firestore operations per call and
+Twilio requests per call, per scenario. With --check, per-call operation
+counts are compared with benchmarks/call_flow_baseline.json and the run
+fails if any grew by more than --tolerance; --save writes a new baseline.
+
+    cd backend && python benchmarks/bench_call_flow.py [--callers 1000] [--check | --save]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "call_flow_baseline.json")
+
+SCENARIOS = {
+    "polling": {"mode": "polling"},
+    "event": {"mode": "event"},
+    "ring_group": {"mode": "event", "group_size": 3},
+    "queue": {"mode": "queue"},
+}
+
+# Per-call counts that must not regress; time-to-answer is reported but
+# depends too much on the machine to gate on.
+CHECKED = (
+    "firestore_reads_per_call",
+    "firestore_writes_per_call",
+    "firestore_queries_per_call",
+    "twilio_requests_per_call",
+)
+
+
+def run_scenario(settings, args):
+    # One process is one warm instance; a fresh interpreter per scenario keeps caches apart
+    code = (
+        "import json, sys; sys.path.insert(0, {backend!r}); from sim.driver import Simulation; "
+        "sim = Simulation(accounts={accounts}, users={users}, seed={seed}, **{settings!r}); "
+        "print(json.dumps(sim.run({callers}, {concurrency}).summary()))"
+    ).format(
+        backend=BACKEND, accounts=args.accounts, users=args.users, seed=args.seed,
+        settings=settings, callers=args.callers, concurrency=args.concurrency,
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=BACKEND)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--callers", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--check", action="store_true", help="fail on a regression against the baseline")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenario or sorted(SCENARIOS):
+        results[name] = run_scenario(SCENARIOS[name], args)
+        summary = results[name]
+        tta = summary["tta_s"]
+        print(f"{name}: {summary['callers']} callers in {summary['elapsed_s']} s, outcomes {summary['outcomes']}")
+        print(f"  time to answer  p50 {tta['p50']} s  p90 {tta['p90']} s  p95 {tta['p95']} s  p99 {tta['p99']} s")
+        print(
+            f"  per call  Firestore reads {summary['firestore_reads_per_call']}"
+            f"  writes {summary['firestore_writes_per_call']}"
+            f"  queries {summary['firestore_queries_per_call']}"
+            f"  listener reads {summary['firestore_listener_reads_per_call']}"
+            f"  Twilio requests {summary['twilio_requests_per_call']}"
+        )
+
+    if args.save:
+        with open(BASELINE, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE}")
+
+    if args.check:
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+        failures = []
+        for name, summary in results.items():
+            for key in CHECKED:
+                expected = baseline.get(name, {}).get(key)
+                if expected is not None and summary[key] > expected * (1 + args.tolerance):
+                    failures.append(f"{name} {key}: {summary[key]} > baseline {expected}")
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
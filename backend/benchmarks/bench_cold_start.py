@@ -0,0 +1,82 @@
+"""Import-time / cold-start comparison of the two deployment modes.
+
+Per-function mode starts a fresh interpreter per handler on one inbound
+call's path (each is its own Cloud Function, so each can cold start).
+Router mode starts one interpreter, imports main.py and loads the same
+handlers through the router in call order. Clients are lazy, so neither
+mode needs credentials; times cover interpreter start plus imports.
+
+    cd backend && python benchmarks/bench_cold_start.py [repeats]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+CALL_PATH = (
+    "join_conference",
+    "conference_callback",
+    "handle_call",
+    "gather_response",
+    "process_response",
+    "caller_status_callback",
+)
+
+PER_FUNCTION = """
+import json, sys, time
+started = time.perf_counter()
+sys.path[:0] = [{source!r}, {backend!r}]
+import main
+print(json.dumps({{"import": time.perf_counter() - started}}))
+"""
+
+ROUTER = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {backend!r})
+import main
+timings = {{"router": time.perf_counter() - started}}
+for name in {handlers!r}:
+    loaded = time.perf_counter()
+    main.load_handler(name)
+    timings[name] = time.perf_counter() - loaded
+print(json.dumps(timings))
+"""
+
+
+def run(code):
+    started = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=BACKEND)
+    wall = time.perf_counter() - started
+    return wall, json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print("per-function mode (one process per handler)")
+    total_wall = 0.0
+    for name in CALL_PATH:
+        code = PER_FUNCTION.format(source=os.path.join(BACKEND, name), backend=BACKEND)
+        samples = [run(code) for _ in range(repeats)]
+        wall = statistics.median(s[0] for s in samples)
+        imports = statistics.median(s[1]["import"] for s in samples)
+        total_wall += wall
+        print(f"  {name:<24} import {imports * 1000:8.1f} ms   process {wall * 1000:8.1f} ms")
+    print(f"  {'call path total':<24} {'':15} process {total_wall * 1000:8.1f} ms")
+
+    print("router mode (one process, handlers loaded on first request)")
+    code = ROUTER.format(backend=BACKEND, handlers=CALL_PATH)
+    samples = [run(code) for _ in range(repeats)]
+    for key in ("router",) + CALL_PATH:
+        value = statistics.median(s[1][key] for s in samples)
+        print(f"  {key:<24} import {value * 1000:8.1f} ms")
+    print(f"  {'call path total':<24} {'':15} process {statistics.median(s[0] for s in samples) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Compare the precompiled TwiML templates with twilio's VoiceResponse builder.
+
+Checks that both produce byte-identical documents (including awkward
+parameter values) and then times each path.
+
+    cd backend && python benchmarks/bench_twiml.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from twilio.twiml.voice_response import VoiceResponse, Gather, Dial
+from common import twiml
+
+ROOM = "conf-CA0123456789abcdef0123456789abcdef"
+USER_ID = "u7Qm2xR4pLk9"
+ACCOUNT_ID = "acct&<\"odd\">\n\tid"
+CALLEE_SID = "CAfedcba9876543210fedcba9876543210"
+
+
+def builder_gather(room, user_id, account_id, retry):
+    retry_url = twiml.function_url("gather_response", room=room, user_id=user_id, account_id=account_id, retry=retry + 1)
+    action = twiml.function_url("process_response", room=room, user_id=user_id, account_id=account_id, retry=retry)
+    response = VoiceResponse()
+    gather = Gather(num_digits=1, action=action, method="POST")
+    gather.say(twiml.ACCEPT_PROMPT)
+    response.append(gather)
+    response.redirect(retry_url)
+    return str(response)
+
+
+def template_gather(room, user_id, account_id, retry):
+    retry_url = twiml.function_url("gather_response", room=room, user_id=user_id, account_id=account_id, retry=retry + 1)
+    action = twiml.function_url("process_response", room=room, user_id=user_id, account_id=account_id, retry=retry)
+    return twiml.gather_accept(action, retry_url)
+
+
+def builder_join(room, user_id, account_id, callee_sid):
+    dial = Dial()
+    dial.conference(
+        room,
+        participant_label=user_id,
+        start_conference_on_enter=True,
+        end_conference_on_exit=True,
+        status_callback=twiml.function_url("conference_callback", account_id=account_id, call_sid=callee_sid),
+        status_callback_event="start end join leave",
+        status_callback_method="POST",
+        wait_url=twiml.CALLEE_HOLD_MUSIC
+    )
+    response = VoiceResponse()
+    response.say("Connecting you now.")
+    response.append(dial)
+    return str(response)
+
+
+def template_join(room, user_id, account_id, callee_sid):
+    status_callback = twiml.function_url("conference_callback", account_id=account_id, call_sid=callee_sid)
+    return twiml.join_conference("Connecting you now.", room, user_id, status_callback)
+
+
+def builder_say_redirect(message, url):
+    response = VoiceResponse()
+    response.say(message)
+    response.redirect(url)
+    return str(response)
+
+
+def builder_say(message):
+    response = VoiceResponse()
+    response.say(message)
+    return str(response)
+
+
+def check_identical():
+    odd = "x&y<z>\"q\"\r\n\t'"
+    cases = [
+        (builder_gather(ROOM, USER_ID, ACCOUNT_ID, 0), template_gather(ROOM, USER_ID, ACCOUNT_ID, 0)),
+        (builder_gather(odd, odd, odd, 1), template_gather(odd, odd, odd, 1)),
+        (builder_join(ROOM, USER_ID, ACCOUNT_ID, CALLEE_SID), template_join(ROOM, USER_ID, ACCOUNT_ID, CALLEE_SID)),
+        (builder_join(odd, odd, odd, odd), template_join(odd, odd, odd, odd)),
+        (builder_say(odd), twiml.say(odd)),
+        (builder_say_redirect("Invalid input.", odd), twiml.say_redirect("Invalid input.", odd)),
+    ]
+    for expected, actual in cases:
+        if expected != actual:
+            raise SystemExit(f"Template output differs from builder:\n  builder:  {expected}\n  template: {actual}")
+    print(f"byte-identical: {len(cases)} cases")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    check_identical()
+
+    benches = [
+        ("gather builder", lambda: builder_gather(ROOM, USER_ID, ACCOUNT_ID, 0)),
+        ("gather template", lambda: template_gather(ROOM, USER_ID, ACCOUNT_ID, 0)),
+        ("join builder", lambda: builder_join(ROOM, USER_ID, ACCOUNT_ID, CALLEE_SID)),
+        ("join template", lambda: template_join(ROOM, USER_ID, ACCOUNT_ID, CALLEE_SID)),
+    ]
+    for name, fn in benches:
+        seconds = min(timeit.repeat(fn, number=iterations, repeat=3))
+        print(f"{name:<16} {seconds / iterations * 1e6:8.2f} us/op")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+from flask import jsonify, make_response
+from common import accounts, admin_auth, analytics, call_queue, log, metrics
+from common.clients import db
+
+# Dashboard read API over the sharded counters in common/analytics.py:
+#
+#   GET ?account_id=...&granularity=day|hour[&start=...&end=...]
+#
+# In queue mode (common/call_queue.py) the response also carries the live
+# queue: depth, users ringing and talking, and the oldest caller's wait.
+#
+# start and end are bucket ids (YYYY-MM-DD or YYYY-MM-DDTHH, UTC). Costs
+# ANALYTICS_SHARDS reads per bucket, independent of call volume.
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, OPTIONS",
+    "Access-Control-Allow-Headers": "Authorization, Content-Type",
+    "Access-Control-Max-Age": "3600",
+}
+
+
+def _respond(body, status):
+    response = make_response(jsonify(body), status)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@metrics.instrumented("call_analytics")
+def call_analytics(request):
+    if request.method == "OPTIONS":
+        return make_response("", 204, CORS_HEADERS)
+
+    account_id = request.args.get("account_id")
+    granularity = request.args.get("granularity", "day")
+    metrics.annotate(account_id=account_id)
+
+    if admin_auth.account_admin(request, db, account_id) is None:
+        return _respond({"error": "Not authorized for this account"}, 403)
+
+    try:
+        bucket_ids = analytics.bucket_range(granularity, request.args.get("start"), request.args.get("end"))
+    except ValueError as e:
+        return _respond({"error": str(e)}, 400)
+
+    try:
+        account_ref = db.collection("accounts").document(account_id)
+        counters = analytics.read_buckets(db, account_ref, bucket_ids)
+        total = {}
+        for bucket_counters in counters.values():
+            analytics.add_counters(total, bucket_counters)
+        account_doc = accounts.get_by_id(db, account_id)
+        queue = None
+        if account_doc is not None and call_queue.is_queue_mode(account_doc.to_dict()):
+            queue = call_queue.snapshot(db, account_ref)
+    except Exception as e:
+        log.error("ANALYTICS", "call_analytics failed", exc_info=e)
+        return _respond({"error": "Failed to read analytics"}, 500)
+
+    return _respond({
+        "account_id": account_id,
+        "granularity": granularity,
+        "buckets": [{"bucket": bucket, **analytics.summarize(counters[bucket])} for bucket in bucket_ids],
+        "total": analytics.summarize(total),
+        "queue": queue,
+    }, 200)
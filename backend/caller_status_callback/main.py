@@ -1,16 +1,13 @@
 from flask import request, Response
 from google.cloud import firestore
-from twilio.rest import Client
-import os
+from common import accounts, analytics, call_queue, dedupe, log, metrics, outbound, round_robin, store, user_stats
+from common import roster as rosters
+from common.clients import db, twilio as client
 
-db = firestore.Client()
-client = Client(
-    os.getenv("TWILIO_ACCOUNT_SID"),
-    os.getenv("TWILIO_AUTH_TOKEN")
-)
-
-FINAL_USER_STATUSES = {"completed", "no-answer", "busy", "failed", "canceled"}
+# Leg statuses that need work: the early caller-left check and the final status
+EARLY_LEG_STATUSES = {"initiated", "ringing"}
 
+@metrics.instrumented("caller_status_callback")
 def caller_status_callback(request):
     form = request.form.to_dict()
     call_sid = form.get("CallSid")
@@ -18,67 +15,118 @@ def caller_status_callback(request):
     user_id = request.args.get("user_id")
     account_id = request.args.get("account_id")
     parent_call_sid = request.args.get("call_sid")  # from handle_call callback URL
+    rr_round = request.args.get("rr_round")  # only present in event mode
+    rr_index = request.args.get("rr_index")
+    queued = request.args.get("queue") == "1"  # a leg offered by the caller queue
 
-    print("========== Twilio Callback ==========")
-    for key, value in form.items():
-        print(f"{key}: {value}")
-    print(f"user_id: {user_id}")
-    print(f"account_id: {account_id}")
-    print(f"parent_call_sid: {parent_call_sid}")
-    print("=====================================")
+    log.info(
+        "CALLBACK", "Twilio status callback",
+        sample=log.CHATTY if call_status in EARLY_LEG_STATUSES else None,
+        call_status=call_status, user_id=user_id, rr_round=rr_round, rr_index=rr_index
+    )
+    log.debug("CALLBACK", "Callback form", form=form)
 
     if not account_id or not call_sid:
-        print("[CALLBACK] Missing account_id or call_sid")
+        log.warning("CALLBACK", "Missing account_id or call_sid")
         return Response("Missing account_id or call_sid", status=400)
 
+    # 🔁 Drop events that need no work, and Twilio retries, before any Firestore or Twilio I/O
+    if user_id and call_status not in EARLY_LEG_STATUSES | outbound.FINAL_LEG_STATUSES:
+        return Response("OK", status=200)
+    if not user_id and call_status != "completed":
+        return Response("OK", status=200)
+    if user_id and call_status in EARLY_LEG_STATUSES and dedupe.is_duplicate(f"early-check:{call_sid}"):
+        return Response("OK", status=200)  # initiated and ringing both only need one caller-left check
+    event_key = dedupe.status_callback_key(form)
+    if dedupe.is_duplicate(event_key, db):
+        log.info("CALLBACK", "Duplicate event, skipping", event_key=event_key)
+        return Response("OK", status=200)
+
     try:
         account_ref = db.collection("accounts").document(account_id)
 
         # 🛑 Early check: if call is still ringing but caller has already left
+        main_call_data = {}
         if parent_call_sid and user_id:
             main_call_ref = account_ref.collection("calls").document(parent_call_sid)
             main_call_doc = main_call_ref.get()
+            metrics.count("firestore_reads")
+            main_call_data = main_call_doc.to_dict() if main_call_doc.exists else {}
             if main_call_doc.exists and main_call_doc.to_dict().get("status") == "caller_left":
                 try:
-                    print(f"[CALLBACK] Caller already left. Canceling ringing call: {call_sid}")
-                    client.calls(call_sid).update(status="canceled")
+                    log.info("CALLBACK", "Caller already left. Canceling ringing call")
+                    client.update_call(call_sid, status="canceled")
                 except Exception as ce:
-                    print(f"[CALLBACK] Error canceling early call {call_sid}: {ce}")
+                    log.error("CALLBACK", "Error canceling early call", error=str(ce))
                 return Response("Caller already left; call canceled.", status=200)
 
         # 🧑‍💼 User leg handling
         if user_id:
-            if call_status in FINAL_USER_STATUSES:
-                print(f"[CALLBACK] Final status for user leg: {call_status}. Marking user available.")
-                account_ref.collection("users").document(user_id).update({
-                    "status": "available"
-                })
-
-                if parent_call_sid:
-                    outbound_ref = account_ref.collection("calls").document(parent_call_sid).collection("outbound").document(call_sid)
-                    if outbound_ref.get().exists:
-                        outbound_ref.update({"status": call_status})
-                        print(f"[CALLBACK] Updated outbound {call_sid} with status: {call_status}")
+            if call_status in outbound.FINAL_LEG_STATUSES:
+                log.info("CALLBACK", "Final status for user leg. Marking user available.", call_status=call_status)
+                user_update = {"status": "available"}
+
+                # 📈 Fold this leg into the user's ring timeout statistics
+                user = rosters.get(account_ref).user(user_id)
+                delay = user_stats.answer_delay(request.args.get("dialed_at"), form.get("CallDuration"))
+                accepted = bool(parent_call_sid) and main_call_data.get("answered_sid") == call_sid
+                pressed = call_sid in main_call_data.get("pressed_sids", [])  # picked up, didn't take it
+                if user is not None and parent_call_sid:
+                    stats = user_stats.record_leg(user.get("stats"), call_status, delay, accepted, pressed)
+                    if stats != (user.get("stats") or {}):
+                        user_update["stats"] = stats
+
+                # 📦 User, call cursor and outbound leg go out in one commit
+                with store.Batch(db) as batch:
+                    user_ref = account_ref.collection("users").document(user_id)
+                    if user is not None:
+                        batch.update(user_ref, user_update)
+                    else:
+                        store.update_if_exists(user_ref, user_update)
+
+                    if parent_call_sid:
+                        # ⏩ Lets a polling handle_call move on without waiting out the ring timeout
+                        if main_call_data.get("cursor"):
+                            batch.update(main_call_ref, {"cursor.finished_sids": firestore.ArrayUnion([call_sid])})
+
+                        outbound_ref = main_call_ref.collection("outbound").document(call_sid)
+                        batch.set(outbound_ref, {"status": call_status}, merge=True)
+
+                    # 📊 Answer, hold and pickup counters for the dashboard
+                    analytics.record(db, account_ref, analytics.leg_counters(
+                        user_id, call_status, accepted, delay, main_call_data, form.get("CallDuration"), pressed
+                    ), batch)
+                rosters.note_status(account_id, user_id, "available")
+
+                if parent_call_sid and queued:
+                    # 📥 Queue mode: the user is free again (or busy, if they took it); offer the next caller
+                    with metrics.phase("queue"):
+                        call_queue.leg_finished(
+                            db, client, account_ref, accounts.data_by_id(db, account_id),
+                            user_id, parent_call_sid, accepted
+                        )
+                elif parent_call_sid:
+                    # ⚡ Event mode: this leg is over, dial the next user straight away
+                    if rr_round is not None and rr_index is not None:
+                        with metrics.phase("advance"):
+                            round_robin.advance(db, client, account_ref, parent_call_sid, int(rr_round), int(rr_index))
 
         # ☎️ Caller leg ends
         if not user_id and call_status == "completed":
             main_call_ref = account_ref.collection("calls").document(call_sid)
-            if main_call_ref.get().exists:
-                print(f"[CALLBACK] Caller hung up. Updating status and canceling outbound.")
-                main_call_ref.update({"status": "caller_left"})
-
-                outbound_calls = main_call_ref.collection("outbound").stream()
-                for doc in outbound_calls:
-                    outbound_sid = doc.id
-                    try:
-                        print(f"[CALLBACK] Canceling outbound call: {outbound_sid}")
-                        client.calls(outbound_sid).update(status="canceled")
-                    except Exception as ce:
-                        print(f"[CALLBACK] Error canceling {outbound_sid}: {ce}")
+            if store.update_if_exists(main_call_ref, {"status": "caller_left"}):
+                with metrics.phase("cancel_legs"):
+                    results = outbound.cancel_legs(client, main_call_ref)
+                log.info("CALLBACK", "Caller hung up. Updated status and canceled outbound.", legs=results)
+                account_data = accounts.data_by_id(db, account_id)
+                if call_queue.is_queue_mode(account_data):
+                    with metrics.phase("queue"):
+                        call_queue.remove(db, client, account_ref, account_data, call_sid)
             else:
-                print(f"[CALLBACK] Caller call SID not found: {call_sid}")
+                log.warning("CALLBACK", "Caller call SID not found")
 
     except Exception as e:
-        print(f"[CALLBACK ERROR] {e}")
+        log.error("CALLBACK", "caller_status_callback failed", exc_info=e)
+        dedupe.forget(event_key, db)
 
     return Response("OK", status=200)
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from common import log, metrics
+import threading
+import time
+
+# Per-instance cache of account snapshots keyed by Twilio number. Each cached
+# account's document has a snapshot listener that replaces the entry as soon
+# as the account changes, so an instance only ever listens to the accounts it
+# serves (one read each, plus one per change). The TTL bounds staleness if a
+# listener is paused between requests or disconnected.
+CACHE_TTL = 300  # Seconds
+CACHE_SIZE = 256  # Accounts kept per warm instance
+
+_cache = OrderedDict()  # twilio_number -> (expires_at, snapshot)
+_numbers_by_id = {}     # account_id -> twilio_number
+_watches = {}           # account_id -> listener on the cached account document
+_lock = threading.Lock()
+
+
+def _on_account_snapshot(docs, changes, read_time):
+    for doc in docs:
+        if not doc.exists:
+            invalidate(doc.id)
+            continue
+        with _lock:
+            twilio_number = _numbers_by_id.get(doc.id)
+            if twilio_number is None or twilio_number != doc.to_dict().get("twilio_number"):
+                changed = twilio_number is not None
+            else:
+                _cache[twilio_number] = (time.monotonic() + CACHE_TTL, doc)
+                changed = False
+        if changed:
+            invalidate(doc.id)  # Number moved; the next lookup queries for it
+
+
+def _unwatch(watch):
+    # unsubscribe joins the listener's thread, which may be the one calling us
+    if watch:
+        threading.Thread(target=watch.unsubscribe, daemon=True).start()
+
+
+def _watch(snapshot):
+    try:
+        watch = snapshot.reference.on_snapshot(_on_account_snapshot)
+        metrics.count("firestore_reads")  # The listener's first snapshot
+    except Exception as e:
+        log.warning("ACCOUNTS", "Failed to start account listener, relying on TTL", account_id=snapshot.id, error=str(e))
+        watch = False
+    with _lock:
+        if _numbers_by_id.get(snapshot.id) is not None and snapshot.id not in _watches:
+            _watches[snapshot.id] = watch
+            return
+    _unwatch(watch)  # Evicted meanwhile, or another request got there first
+
+
+def _store(twilio_number, snapshot):
+    evicted_watches = []
+    with _lock:
+        _cache[twilio_number] = (time.monotonic() + CACHE_TTL, snapshot)
+        _cache.move_to_end(twilio_number)
+        _numbers_by_id[snapshot.id] = twilio_number
+        watched = snapshot.id in _watches
+        while len(_cache) > CACHE_SIZE:
+            _, (_, evicted) = _cache.popitem(last=False)
+            _numbers_by_id.pop(evicted.id, None)
+            evicted_watches.append(_watches.pop(evicted.id, None))
+    for watch in evicted_watches:
+        _unwatch(watch)
+    if not watched:
+        _watch(snapshot)
+
+
+def _lookup(twilio_number):
+    with _lock:
+        entry = _cache.get(twilio_number)
+        if entry is None:
+            return None
+        expires_at, snapshot = entry
+        if expires_at >= time.monotonic():
+            _cache.move_to_end(twilio_number)
+            return snapshot
+        del _cache[twilio_number]
+        _numbers_by_id.pop(snapshot.id, None)
+        watch = _watches.pop(snapshot.id, None)
+    _unwatch(watch)
+    return None
+
+
+def invalidate(account_id):
+    with _lock:
+        twilio_number = _numbers_by_id.pop(account_id, None)
+        if twilio_number is not None:
+            _cache.pop(twilio_number, None)
+        watch = _watches.pop(account_id, None)
+    _unwatch(watch)
+
+
+def get_by_number(db, twilio_number):
+    """Return the account snapshot for a Twilio number, or None if no account uses it."""
+    snapshot = _lookup(twilio_number)
+    if snapshot is not None:
+        return snapshot
+
+    accounts = db.collection("accounts").where("twilio_number", "==", twilio_number).get()
+    metrics.count("firestore_queries")
+    metrics.count("firestore_reads", max(len(accounts), 1))
+    if not accounts:
+        return None
+    _store(twilio_number, accounts[0])
+    return accounts[0]
+
+
+def get_by_id(db, account_id):
+    """Return the account snapshot for an account id, or None if it does not exist."""
+    twilio_number = _numbers_by_id.get(account_id)
+    if twilio_number is not None:
+        snapshot = _lookup(twilio_number)
+        if snapshot is not None:
+            return snapshot
+
+    snapshot = db.collection("accounts").document(account_id).get()
+    metrics.count("firestore_reads")
+    if not snapshot.exists:
+        return None
+    twilio_number = snapshot.to_dict().get("twilio_number")
+    if twilio_number:
+        _store(twilio_number, snapshot)
+    return snapshot
+
+
+def data_by_id(db, account_id):
+    """The account's data for an account id, or {} if it does not exist."""
+    snapshot = get_by_id(db, account_id)
+    return snapshot.to_dict() if snapshot is not None else {}
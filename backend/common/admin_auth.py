@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+from common import log, metrics
+import hashlib
+import secrets
+import threading
+import time
+
+# Who may read an account's dashboard data. The admin panel sends the
+# signed-in user's Firebase ID token as "Authorization: Bearer <token>";
+# the token's uid must have a users/{uid} document (written by
+# AccountCreationPage) with role "admin" and the requested accountId.
+# Memberships are cached for CACHE_TTL seconds, so a dashboard polling or
+# reconnecting costs no extra read.
+#
+# Browsers' EventSource cannot set headers, and an ID token in a URL ends up
+# in request logs while still good for an hour. Streams therefore trade the
+# header for a ticket (issue_ticket) and put that in the URL instead. It
+# lasts TICKET_TTL seconds and is used up by redeem_ticket. It is stored as
+# stream_tickets/{sha256(ticket)}, with a TTL policy on expires_at to clear
+# tickets nobody redeemed.
+
+CACHE_TTL = 60
+CACHE_SIZE = 1024
+TICKET_TTL = 30  # Seconds to open the stream after asking for a ticket
+
+_members = OrderedDict()  # uid -> (account_id, role, cached_at)
+_lock = threading.Lock()
+_app = None
+
+
+def _verify_token(token):
+    global _app
+    import firebase_admin
+    from firebase_admin import auth
+
+    if _app is None:
+        with _lock:
+            if _app is None:
+                try:
+                    _app = firebase_admin.get_app()
+                except ValueError:
+                    _app = firebase_admin.initialize_app()
+    return auth.verify_id_token(token, app=_app)["uid"]
+
+
+def _membership(db, uid):
+    now = time.monotonic()
+    with _lock:
+        cached = _members.get(uid)
+        if cached and now - cached[2] < CACHE_TTL:
+            return cached[0], cached[1]
+    doc = db.collection("users").document(uid).get()
+    metrics.count("firestore_reads")
+    data = doc.to_dict() if doc.exists else {}
+    with _lock:
+        _members[uid] = (data.get("accountId"), data.get("role"), now)
+        _members.move_to_end(uid)
+        while len(_members) > CACHE_SIZE:
+            _members.popitem(last=False)
+    return data.get("accountId"), data.get("role")
+
+
+def account_admin(request, db, account_id):
+    """The caller's uid if they are an admin of account_id, else None."""
+    header = request.headers.get("Authorization", "")
+    if not account_id or not header.startswith("Bearer "):
+        return None
+    try:
+        uid = _verify_token(header[len("Bearer "):])
+    except Exception as e:
+        log.info("AUTH", "Rejected ID token", error=str(e))
+        return None
+    member_of, role = _membership(db, uid)
+    if member_of != account_id or role != "admin":
+        log.info("AUTH", "Not an admin of this account", uid=uid, account_id=account_id)
+        return None
+    return uid
+
+
+def _ticket_ref(db, ticket):
+    return db.collection("stream_tickets").document(hashlib.sha256(ticket.encode()).hexdigest())
+
+
+def issue_ticket(db, uid, account_id):
+    """A single-use ticket that lets uid open account_id's stream in the next TICKET_TTL seconds."""
+    ticket = secrets.token_urlsafe(24)
+    _ticket_ref(db, ticket).set({
+        "uid": uid,
+        "account_id": account_id,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=TICKET_TTL),
+    })
+    metrics.count("firestore_writes")
+    return ticket
+
+
+def redeem_ticket(db, ticket, account_id):
+    """The uid the ticket was issued to if it is for account_id and still valid, else None.
+
+    A ticket is deleted on first use, whatever the outcome.
+    """
+    if not ticket or not account_id:
+        return None
+    ticket_ref = _ticket_ref(db, ticket)
+
+    @firestore.transactional
+    def take(transaction):
+        snapshot = ticket_ref.get(transaction=transaction)
+        metrics.count("firestore_reads")
+        if not snapshot.exists:
+            return None
+        transaction.delete(ticket_ref)
+        metrics.count("firestore_writes")
+        return snapshot.to_dict()
+
+    data = take(db.transaction())
+    if not data:
+        log.info("AUTH", "Unknown or used stream ticket", account_id=account_id)
+        return None
+    if data.get("account_id") != account_id or data["expires_at"] <= datetime.now(timezone.utc):
+        log.info("AUTH", "Stream ticket expired or for another account", account_id=account_id)
+        return None
+    return data["uid"]
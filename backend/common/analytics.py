@@ -0,0 +1,217 @@
+from datetime import datetime, timedelta, timezone
+from common import history, log, metrics, store
+import os
+import random
+
+# Live call analytics, maintained as events arrive instead of by scanning
+# calls/ and outbound/. Each event adds Increment transforms to one random
+# shard of its hour and of its day (UTC):
+#
+#   accounts/{account_id}/analytics/{YYYY-MM-DD}/shards/{n}
+#   accounts/{account_id}/analytics/{YYYY-MM-DDTHH}/shards/{n}
+#
+# so concurrent calls on a busy account spread their writes over SHARDS
+# documents instead of contending on one (Firestore sustains about one
+# write per second per document). Reading a bucket is SHARDS document reads
+# whatever the call volume (read_buckets). Counters:
+#
+#   calls          callers that reached the queue (conference_callback)
+#   legs           outbound legs placed (handle_call, round_robin.advance)
+#   exhausted      calls that ran out of users and got the goodbye
+#   answered       calls a user accepted (caller_status_callback, final leg)
+#   tta_sum, tta_histogram.{bound}
+#                  caller join to key press, seconds (history.TTA_BUCKETS)
+#   talk_seconds   time accepted legs spent connected
+#   users.{user_id}.dialed / answered / missed / canceled / voicemail
+#   users.{user_id}.picked_up
+#                  answered the prompt but did not take the call (another
+#                  user was first, a wrong key, the caller had left)
+#   users.{user_id}.pickup_sum, pickup_count
+#                  ring time before the user answered, seconds
+#   queued, queue_wait_sum, queue_wait_count
+#                  queue mode: callers enqueued, and their wait until answered
+#   queue_abandoned, queue_abandoned_wait_sum
+#                  queue mode: callers who hung up while queued
+
+SHARDS = int(os.getenv("ANALYTICS_SHARDS", "8"))
+COUNTERS = (
+    "calls", "legs", "exhausted", "answered", "tta_sum", "talk_seconds",
+    "queued", "queue_wait_sum", "queue_wait_count", "queue_abandoned", "queue_abandoned_wait_sum",
+)
+MAX_BUCKETS = 62  # Two months of days or about two and a half days of hours per request
+GRANULARITIES = {
+    "day": ("%Y-%m-%d", timedelta(days=1), 7),
+    "hour": ("%Y-%m-%dT%H", timedelta(hours=1), 24),
+}
+
+
+def buckets(now=None):
+    """The day and hour bucket ids an event at now (UTC) counts towards."""
+    now = now or datetime.now(timezone.utc)
+    return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%dT%H")
+
+
+def bucket_range(granularity, start=None, end=None, now=None):
+    """Bucket ids from start to end inclusive (ids in the granularity's format).
+
+    Defaults to the last 7 days or 24 hours up to now. Raises ValueError on
+    an unknown granularity, a malformed id or more than MAX_BUCKETS buckets.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    fmt, step, default_count = GRANULARITIES[granularity]
+    now = now or datetime.now(timezone.utc)
+    last = datetime.strptime(end, fmt) if end else datetime.strptime(now.strftime(fmt), fmt)
+    first = datetime.strptime(start, fmt) if start else last - step * (default_count - 1)
+    if first > last:
+        raise ValueError("start is after end")
+    count = int((last - first) / step) + 1
+    if count > MAX_BUCKETS:
+        raise ValueError(f"At most {MAX_BUCKETS} buckets per request")
+    return [(first + step * i).strftime(fmt) for i in range(count)]
+
+
+def _nested_increments(counters):
+    from google.cloud import firestore
+
+    data = {}
+    for path, amount in counters.items():
+        if not amount:
+            continue
+        parts = path.split(".")
+        target = data
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = firestore.Increment(amount)
+    return data
+
+
+def record(db, account_ref, counters, batch=None):
+    """Add counters ({"users.<uid>.dialed": 1, ...}) to this hour's and day's buckets.
+
+    With a store.Batch the two shard writes ride along with the handler's
+    commit; without one they are committed on their own, and a failure is
+    logged rather than raised, since analytics must never break a call.
+    """
+    data = _nested_increments(counters)
+    if not data:
+        return
+    shard = str(random.randrange(SHARDS))
+    refs = [
+        account_ref.collection("analytics").document(bucket).collection("shards").document(shard)
+        for bucket in buckets()
+    ]
+    if batch is not None:
+        for ref in refs:
+            batch.set(ref, data, merge=True)
+        return
+    try:
+        with store.Batch(db) as own_batch:
+            for ref in refs:
+                own_batch.set(ref, data, merge=True)
+    except Exception as e:
+        log.warning("ANALYTICS", "Failed to record counters", account_id=account_ref.id, error=str(e))
+
+
+def dial_counters(user_ids):
+    """Counters for the legs of one dialed wave."""
+    counters = {"legs": len(user_ids)}
+    for user_id in user_ids:
+        key = f"users.{user_id}.dialed"
+        counters[key] = counters.get(key, 0) + 1
+    return counters
+
+
+def leg_counters(user_id, call_status, accepted, pickup_delay=None, call_data=None, duration=None, pressed=False):
+    """Counters for one outbound leg's final status; pressed as in user_stats.record_leg."""
+    prefix = f"users.{user_id}."
+    if accepted:
+        counters = {prefix + "answered": 1, "answered": 1}
+        started, answered_at = (call_data or {}).get("timestamp"), (call_data or {}).get("answered_at")
+        if started and answered_at:
+            seconds = max((answered_at - started).total_seconds(), 0.0)
+            counters["tta_sum"] = seconds
+            counters[f"tta_histogram.{history.tta_bucket(seconds)}"] = 1
+        if duration:
+            counters["talk_seconds"] = int(duration)
+    elif pressed:
+        counters = {prefix + "picked_up": 1}
+    elif call_status == "completed":
+        counters = {prefix + "voicemail": 1}
+    elif call_status == "canceled":
+        counters = {prefix + "canceled": 1}
+    else:
+        counters = {prefix + "missed": 1}
+    if pickup_delay is not None and call_status == "completed":
+        counters[prefix + "pickup_sum"] = round(pickup_delay, 2)
+        counters[prefix + "pickup_count"] = 1
+    return counters
+
+
+def add_counters(total, data):
+    """Add one counters dict (as stored, nested) into another."""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            add_counters(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)):
+            total[key] = total.get(key, 0) + value
+
+
+def read_buckets(db, account_ref, bucket_ids):
+    """Sum each bucket's shards: {bucket_id: counters}, in one round trip of len(bucket_ids) * SHARDS reads."""
+    refs = [
+        account_ref.collection("analytics").document(bucket).collection("shards").document(str(shard))
+        for bucket in bucket_ids
+        for shard in range(SHARDS)
+    ]
+    totals = {bucket: {} for bucket in bucket_ids}
+    for doc in db.get_all(refs):
+        if doc.exists:
+            add_counters(totals[doc.reference.parent.parent.id], doc.to_dict())
+    metrics.count("firestore_reads", len(refs))
+    return totals
+
+
+def summarize(counters):
+    """Derived rates and means for one bucket (or a sum of buckets)."""
+    calls = counters.get("calls", 0)
+    answered = counters.get("answered", 0)
+    histogram = counters.get("tta_histogram", {})
+    users = {}
+    for user_id, user in (counters.get("users") or {}).items():
+        offered = user.get("dialed", 0)
+        users[user_id] = {
+            **user,
+            "pickup_rate": round(user.get("answered", 0) / offered, 3) if offered else None,
+            "mean_pickup_s": round(user["pickup_sum"] / user["pickup_count"], 2) if user.get("pickup_count") else None,
+        }
+    return {
+        **{name: counters.get(name, 0) for name in COUNTERS},
+        "unanswered": max(calls - answered, 0),
+        "answer_rate": round(answered / calls, 3) if calls else None,
+        "mean_tta_s": round(counters.get("tta_sum", 0) / answered, 2) if answered else None,
+        "tta_p50_s": _histogram_percentile(histogram, 50),
+        "tta_p90_s": _histogram_percentile(histogram, 90),
+        "mean_talk_s": round(counters.get("talk_seconds", 0) / answered, 1) if answered else None,
+        "mean_queue_wait_s": _mean(counters, "queue_wait_sum", "queue_wait_count"),
+        "mean_abandoned_wait_s": _mean(counters, "queue_abandoned_wait_sum", "queue_abandoned"),
+        "tta_histogram": histogram,
+        "users": users,
+    }
+
+
+def _mean(counters, total, count):
+    return round(counters[total] / counters[count], 2) if counters.get(count) else None
+
+
+def _histogram_percentile(histogram, p):
+    """Upper bound of the bucket holding the p-th percentile (None past the last bound)."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for bound in history.TTA_BUCKETS:
+        seen += histogram.get(str(bound), 0)
+        if seen * 100 >= total * p:
+            return bound
+    return None
@@ -0,0 +1,315 @@
+from google.cloud import firestore
+from common import analytics, history, log, metrics, round_robin, routing, store
+from common import roster as rosters
+import time
+
+# ACD mode (round_robin_mode "queue"): one ordered queue of waiting callers
+# per account instead of one dialing loop per call. The queue lives in a
+# single document, changed only inside transactions:
+#
+#   accounts/{account_id}/queue/state
+#       waiting  {call_sid: {seq, from, enqueued_at, offered_to, tried, rounds}}
+#       offers   {user_id: {call_sid, at}}   user's phone is ringing for call_sid
+#       busy     {user_id: call_sid}         user is talking to call_sid
+#       seq      next arrival number (FIFO order)
+#
+# assign() pairs the longest-waiting callers that have no offer out with
+# free users (on the roster, not in a conference, not ringing, not busy), in
+# the account's routing order, and rings each pair. A user is offered to
+# exactly one caller at a time and a caller to one user, so concurrent
+# callers never ring the same phone and throughput is bounded by the staff
+# on shift. assign() runs whenever that can change:
+#
+#   handle_call               a caller is enqueued
+#   caller_status_callback    an offered leg ended without an answer
+#   process_response          a user took the call (offer -> busy)
+#   conference_callback       a user left their call (busy -> free), or the
+#                             caller's conference ended (caller dequeued)
+#
+# A caller who has been offered to every user and missed max_retries times
+# over is told nobody is available, as in the other modes.
+
+OFFER_STALE = 120  # Seconds; an offer whose leg never reported back is reclaimed
+MAX_ASSIGN_PASSES = 3  # Re-plans after legs that could not be placed
+
+
+def is_queue_mode(account_data):
+    return round_robin.get_mode(account_data or {}) == round_robin.QUEUE_MODE
+
+
+def _queue_ref(account_ref):
+    return account_ref.collection("queue").document("state")
+
+
+def _read(transaction, queue_ref):
+    snapshot = queue_ref.get(transaction=transaction)
+    metrics.count("firestore_reads")
+    state = snapshot.to_dict() if snapshot.exists else {}
+    return {
+        "waiting": state.get("waiting") or {},
+        "offers": state.get("offers") or {},
+        "busy": state.get("busy") or {},
+        "seq": state.get("seq", 0),
+    }
+
+
+def _write(transaction, queue_ref, state):
+    transaction.set(queue_ref, state)
+    metrics.count("firestore_writes")
+
+
+def _report(account_id, state, event, **fields):
+    log.info(
+        "QUEUE", event, account_id=account_id, queue_depth=len(state["waiting"]),
+        ringing=len(state["offers"]), talking=len(state["busy"]), **fields
+    )
+
+
+def enqueue(db, account_ref, call_sid, from_number):
+    """Add a caller to the back of the account's queue. False if already queued."""
+    queue_ref = _queue_ref(account_ref)
+
+    @firestore.transactional
+    def add(transaction):
+        state = _read(transaction, queue_ref)
+        if call_sid in state["waiting"]:
+            return None
+        state["waiting"][call_sid] = {
+            "seq": state["seq"],
+            "from": from_number,
+            "enqueued_at": time.time(),
+            "offered_to": None,
+            "tried": [],
+            "rounds": 0,
+        }
+        state["seq"] += 1
+        _write(transaction, queue_ref, state)
+        return state
+
+    state = add(db.transaction())
+    if state is None:
+        log.info("QUEUE", "Caller already queued", account_id=account_ref.id)
+        return False
+    analytics.record(db, account_ref, {"queued": 1})
+    _report(account_ref.id, state, "Caller queued")
+    return True
+
+
+def _plan(state, free_users, max_retries, now):
+    """Pair waiting callers with free users, changing state in place.
+
+    Returns (pairs, exhausted call sids, whether state changed).
+    """
+    offers, busy = state["offers"], state["busy"]
+    reclaimed = False
+    for user_id, offer in list(offers.items()):
+        if now - offer.get("at", now) > OFFER_STALE:
+            reclaimed = True
+            log.warning("QUEUE", "Reclaiming stale offer", user_id=user_id, call_sid=offer.get("call_sid"))
+            del offers[user_id]
+            entry = state["waiting"].get(offer.get("call_sid"))
+            if entry and entry.get("offered_to") == user_id:
+                entry["offered_to"] = None
+
+    free = [user for user in free_users if user["id"] not in offers and user["id"] not in busy]
+    roster_ids = {user["id"] for user in free_users} | set(offers) | set(busy)
+    pairs, exhausted = [], []
+    for call_sid, entry in sorted(state["waiting"].items(), key=lambda item: item[1]["seq"]):
+        if not free:
+            break
+        if entry.get("offered_to"):
+            continue
+        user = next((user for user in free if user["id"] not in entry["tried"]), None)
+        if user is None and roster_ids.issubset(entry["tried"]):
+            # Every user has had a go at this caller: start another round, or give up
+            entry["rounds"] += 1
+            entry["tried"] = []
+            if entry["rounds"] >= max_retries:
+                exhausted.append(call_sid)
+                continue
+            user = free[0]
+        if user is None:
+            continue  # The users this caller has not tried yet are all busy; keep waiting
+        free.remove(user)
+        entry["offered_to"] = user["id"]
+        offers[user["id"]] = {"call_sid": call_sid, "at": now}
+        pairs.append((call_sid, entry["from"], user))
+    for call_sid in exhausted:
+        del state["waiting"][call_sid]
+    return pairs, exhausted, bool(pairs or exhausted or reclaimed)
+
+
+def assign(db, client, account_ref, account_data):
+    """Offer every free user to one waiting caller and ring them. Returns the legs placed."""
+    queue_ref = _queue_ref(account_ref)
+    roster = rosters.get(account_ref)
+    max_retries = account_data.get("max_retries", 3)
+    placed = []
+
+    for _ in range(MAX_ASSIGN_PASSES):
+        free_users = routing.order_users(roster.available(), account_data)
+
+        @firestore.transactional
+        def plan(transaction):
+            state = _read(transaction, queue_ref)
+            pairs, exhausted, changed = _plan(state, free_users, max_retries, time.time())
+            if changed:
+                _write(transaction, queue_ref, state)
+            return pairs, exhausted, state
+
+        pairs, exhausted, state = plan(db.transaction())
+        for call_sid in exhausted:
+            log.info("QUEUE", "Caller tried every user; giving up", call_sid=call_sid)
+            analytics.record(db, account_ref, {"exhausted": 1})
+            round_robin.say_goodbye(client, call_sid)
+        if not pairs:
+            return placed
+        _report(account_ref.id, state, "Offering users", offers=len(pairs))
+
+        failed = []
+        dialed_users = []
+        with store.Batch(db) as batch:
+            for call_sid, from_number, user in pairs:
+                try:
+                    leg = round_robin.dial_user(client, account_ref.id, call_sid, from_number, user, queued=True)
+                except Exception as e:
+                    log.error("QUEUE", "Failed to call user", user_id=user["id"], call_sid=call_sid, error=str(e))
+                    failed.append((call_sid, user["id"]))
+                    continue
+                placed.append(leg.sid)
+                dialed_users.append(user["id"])
+                call_ref = account_ref.collection("calls").document(call_sid)
+                batch.set(call_ref.collection("outbound").document(leg.sid), {
+                    "to": user["phone_number"],
+                    "user_id": user["id"],
+                    "status": "initiated",
+                    "expire_at": history.expire_at()
+                }, merge=True)
+            analytics.record(db, account_ref, analytics.dial_counters(dialed_users), batch)
+
+        if not failed:
+            return placed
+        for call_sid, user_id in failed:
+            _release(db, account_ref, user_id, call_sid, answered=False)
+    return placed
+
+
+def _release(db, account_ref, user_id, call_sid, answered):
+    queue_ref = _queue_ref(account_ref)
+
+    @firestore.transactional
+    def release(transaction):
+        state = _read(transaction, queue_ref)
+        changed = False
+        offer = state["offers"].get(user_id)
+        if offer and offer.get("call_sid") == call_sid:
+            del state["offers"][user_id]
+            changed = True
+        entry = state["waiting"].get(call_sid)
+        if entry and entry.get("offered_to") == user_id:
+            entry["offered_to"] = None
+            if not answered and user_id not in entry["tried"]:
+                entry["tried"].append(user_id)
+            changed = True
+        if answered and state["busy"].get(user_id) == call_sid:
+            del state["busy"][user_id]
+            changed = True
+        if changed:
+            _write(transaction, queue_ref, state)
+        return changed
+
+    return release(db.transaction())
+
+
+def leg_finished(db, client, account_ref, account_data, user_id, call_sid, accepted):
+    """An offered leg reached a final status: free the user (and the caller, if unanswered) and re-assign."""
+    if _release(db, account_ref, user_id, call_sid, answered=accepted):
+        assign(db, client, account_ref, account_data)
+
+
+def answered(db, account_ref, user_id, call_sid):
+    """The user took the call: the caller leaves the queue and the user is busy until they hang up."""
+    queue_ref = _queue_ref(account_ref)
+
+    @firestore.transactional
+    def take(transaction):
+        state = _read(transaction, queue_ref)
+        entry = state["waiting"].pop(call_sid, None)
+        offer = state["offers"].get(user_id)
+        if offer and offer.get("call_sid") == call_sid:
+            del state["offers"][user_id]
+        state["busy"][user_id] = call_sid
+        _write(transaction, queue_ref, state)
+        return entry, state
+
+    entry, state = take(db.transaction())
+    if entry is None:
+        return None
+    wait = max(time.time() - entry["enqueued_at"], 0.0)
+    analytics.record(db, account_ref, {"queue_wait_sum": round(wait, 2), "queue_wait_count": 1})
+    _report(account_ref.id, state, "Caller answered", wait_s=round(wait, 2))
+    return wait
+
+
+def user_free(db, client, account_ref, account_data, user_id):
+    """The user left their call: offer them to the next caller."""
+    queue_ref = _queue_ref(account_ref)
+
+    @firestore.transactional
+    def free(transaction):
+        state = _read(transaction, queue_ref)
+        if user_id not in state["busy"]:
+            return False
+        del state["busy"][user_id]
+        _write(transaction, queue_ref, state)
+        return True
+
+    free(db.transaction())
+    # The roster may not have seen the status change yet; assign reads it live
+    rosters.note_status(account_ref.id, user_id, "available")
+    assign(db, client, account_ref, account_data)
+
+
+def remove(db, client, account_ref, account_data, call_sid):
+    """The caller hung up: drop them from the queue and re-offer any user they held."""
+    queue_ref = _queue_ref(account_ref)
+
+    @firestore.transactional
+    def drop(transaction):
+        state = _read(transaction, queue_ref)
+        entry = state["waiting"].pop(call_sid, None)
+        if entry is None:
+            return None, state
+        user_id = entry.get("offered_to")
+        offer = state["offers"].get(user_id) if user_id else None
+        if offer and offer.get("call_sid") == call_sid:
+            del state["offers"][user_id]
+        _write(transaction, queue_ref, state)
+        return entry, state
+
+    entry, state = drop(db.transaction())
+    if entry is None:
+        return False
+    wait = max(time.time() - entry["enqueued_at"], 0.0)
+    analytics.record(db, account_ref, {"queue_abandoned": 1, "queue_abandoned_wait_sum": round(wait, 2)})
+    _report(account_ref.id, state, "Caller left the queue", wait_s=round(wait, 2))
+    if entry.get("offered_to"):
+        assign(db, client, account_ref, account_data)
+    return True
+
+
+def snapshot(db, account_ref, now=None):
+    """Live queue figures for dashboards: depth, ringing and talking users, oldest wait."""
+    doc = _queue_ref(account_ref).get()
+    metrics.count("firestore_reads")
+    state = doc.to_dict() if doc.exists else {}
+    waiting = state.get("waiting") or {}
+    now = now or time.time()
+    oldest = min((entry["enqueued_at"] for entry in waiting.values()), default=None)
+    return {
+        "depth": len(waiting),
+        "ringing": len(state.get("offers") or {}),
+        "talking": len(state.get("busy") or {}),
+        "oldest_wait_s": round(now - oldest, 1) if oldest is not None else None,
+    }
+
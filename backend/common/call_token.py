@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+# Signed call context carried in the gather_response / process_response
+# URLs of an outbound leg. handle_call already knows the account, user,
+# conference room, the number the leg is placed from and whether it is part
+# of a ring group or offered by the caller queue, so it signs them once; the callee's key press is then
+# checked without reading the user or the account. Only the call document
+# (caller still there, nobody else answered) is read live.
+#
+# Token: base64url(compact JSON) "." base64url(HMAC-SHA256, truncated). The
+# key is CALL_TOKEN_SECRET, shared by every function through .env.yaml.
+# Without it no token is issued and the handlers use the plain parameters.
+
+TOKEN_TTL = 60 * 60  # Seconds; far longer than any leg rings or prompts
+SIGNATURE_BYTES = 16
+
+
+def _secret():
+    secret = os.getenv("CALL_TOKEN_SECRET")
+    return secret.encode() if secret else None
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(secret, body):
+    return hmac.new(secret, body.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+
+def issue(account_id, user_id, room, expected_number, ring_group=False, queued=False, now=None):
+    """Token for one outbound leg, or None when CALL_TOKEN_SECRET is not set."""
+    secret = _secret()
+    if secret is None:
+        return None
+    claims = {
+        "a": account_id,
+        "u": user_id,
+        "r": room,
+        "n": expected_number,
+        "e": int(now if now is not None else time.time()) + TOKEN_TTL,
+    }
+    if ring_group:
+        claims["g"] = 1
+    if queued:
+        claims["q"] = 1
+    body = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{body}.{_b64encode(_sign(secret, body))}"
+
+
+def verify(token, now=None):
+    """The context in a valid, unexpired token, else None.
+
+    Returns {"account_id", "user_id", "room", "expected_number", "ring_group", "queued"}.
+    """
+    secret = _secret()
+    if secret is None or not token or "." not in token:
+        return None
+    body, signature = token.rsplit(".", 1)
+    try:
+        if not hmac.compare_digest(_b64decode(signature), _sign(secret, body)):
+            return None
+        claims = json.loads(_b64decode(body))
+    except (ValueError, TypeError):
+        return None
+    if claims.get("e", 0) < (now if now is not None else time.time()):
+        return None
+    return {
+        "account_id": claims["a"],
+        "user_id": claims["u"],
+        "room": claims["r"],
+        "expected_number": claims["n"],
+        "ring_group": bool(claims.get("g")),
+        "queued": bool(claims.get("q")),
+    }
@@ -0,0 +1,45 @@
+import os
+import threading
+
+# Firestore and Twilio clients shared by every handler in the process. They
+# are built on first use rather than at import, so a cold start only pays for
+# the clients (and the heavy client libraries) the first request needs.
+# twilio is a common.twilio_gateway.Gateway, not a bare twilio.rest.Client.
+
+
+class LazyClient:
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def set(self, instance):
+        """Use instance instead of building one (the local simulator, sim/driver.py)."""
+        with self._lock:
+            self._instance = instance
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def _make_firestore():
+    from google.cloud import firestore
+
+    return firestore.Client()
+
+
+def _make_twilio():
+    from common.twilio_gateway import Gateway
+
+    return Gateway(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
+
+
+db = LazyClient(_make_firestore)
+twilio = LazyClient(_make_twilio)
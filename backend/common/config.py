@@ -0,0 +1,9 @@
+import os
+
+# Base URL the backend functions call each other (and Twilio) on. Set
+# FUNCTIONS_BASE_URL to the router URL (e.g. .../cloudfunctions.net/webhooks)
+# when everything is deployed as the single consolidated function.
+FUNCTIONS_BASE_URL = os.getenv(
+    "FUNCTIONS_BASE_URL",
+    "https://us-central1-roundrobin-clean.cloudfunctions.net"
+).rstrip("/")
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from common import log, metrics
+from datetime import datetime, timedelta, timezone
+import hashlib
+import os
+import threading
+
+# Drops repeated Twilio webhooks before they cost any Firestore or Twilio
+# I/O. Every event key is remembered in a bounded per-instance LRU. With
+# WEBHOOK_DEDUPE_FIRESTORE=1 a marker document is also created in
+# webhook_events/, so a retry that lands on another instance is caught too
+# (one precondition write instead of the handler's reads and writes).
+
+CACHE_SIZE = 4096
+MARKER_COLLECTION = "webhook_events"
+MARKER_TTL = 24 * 60 * 60  # Seconds; expires_at is set for a Firestore TTL policy
+
+_seen = OrderedDict()
+_lock = threading.Lock()
+
+
+def status_callback_key(form):
+    """Call status callbacks: each status is reported once per leg, retries repeat it."""
+    return f"status:{form.get('CallSid')}:{form.get('CallStatus')}"
+
+
+def conference_event_key(form):
+    """Conference callbacks: one key per event per participant, ordered by SequenceNumber."""
+    conference = form.get("ConferenceSid") or form.get("FriendlyName")
+    return (
+        f"conference:{conference}:{form.get('StatusCallbackEvent')}:"
+        f"{form.get('CallSid')}:{form.get('SequenceNumber')}"
+    )
+
+
+def _use_firestore():
+    return os.getenv("WEBHOOK_DEDUPE_FIRESTORE") == "1"
+
+
+def _marker_ref(db, key):
+    return db.collection(MARKER_COLLECTION).document(hashlib.sha1(key.encode()).hexdigest())
+
+
+def _remember(key):
+    """Record key in the LRU; False if it was already there."""
+    with _lock:
+        if key in _seen:
+            _seen.move_to_end(key)
+            return False
+        _seen[key] = True
+        while len(_seen) > CACHE_SIZE:
+            _seen.popitem(last=False)
+        return True
+
+
+def is_duplicate(key, db=None):
+    """True if this event was already handled; otherwise records it and returns False."""
+    if not _remember(key):
+        return True
+    if db is None or not _use_firestore():
+        return False
+
+    from google.api_core import exceptions
+    from google.cloud import firestore
+
+    metrics.count("firestore_writes")
+    try:
+        _marker_ref(db, key).create({
+            "key": key,
+            "at": firestore.SERVER_TIMESTAMP,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=MARKER_TTL),
+        })
+        return False
+    except exceptions.Conflict:
+        return True
+    except Exception as e:
+        log.warning("DEDUPE", "Marker write failed, processing anyway", event_key=key, error=str(e))
+        return False
+
+
+def forget(key, db=None):
+    """Undo is_duplicate's record (after a failure) so a retry of the event is processed."""
+    with _lock:
+        _seen.pop(key, None)
+    if db is not None and _use_firestore():
+        metrics.count("firestore_writes")
+        try:
+            _marker_ref(db, key).delete()
+        except Exception as e:
+            log.warning("DEDUPE", "Failed to clear marker", event_key=key, error=str(e))
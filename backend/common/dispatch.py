@@ -0,0 +1,230 @@
+from collections import OrderedDict
+from common import log
+from common.config import FUNCTIONS_BASE_URL
+import hashlib
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+# Fire-and-forget hand-off of work to another backend function, so webhooks
+# can answer Twilio immediately. DISPATCH_BACKEND picks the transport:
+#
+#   cloud_tasks  Named Cloud Tasks in DISPATCH_QUEUE
+#                (projects/<p>/locations/<l>/queues/<q>); the task name is
+#                derived from the idempotency key, so Cloud Tasks itself drops
+#                duplicates. Needs google-cloud-tasks.
+#   http         POST straight to the function URL and stop listening once
+#                the request is sent. Duplicates are dropped per instance.
+#   local        In-process queue and worker threads calling handlers added
+#                with register(); a stand-in for tests and local runs.
+#
+# A delay defers the task: Cloud Tasks schedules it and local runs it from a
+# timer. http cannot defer, so a delayed dispatch fails there; check
+# can_defer() first.
+#
+# The default is cloud_tasks when DISPATCH_QUEUE is set, http otherwise.
+
+MAX_ATTEMPTS = 3         # Tries to hand a task off before giving up
+RETRY_BASE_DELAY = 0.05  # Seconds, doubled per attempt, with jitter
+HTTP_CONNECT_TIMEOUT = 2
+HTTP_SEND_TIMEOUT = 0.2  # Only long enough for the request to be accepted
+SEEN_KEYS = 1024         # Idempotency keys remembered per instance
+
+_seen = OrderedDict()
+_seen_lock = threading.Lock()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _first_dispatch(key):
+    """Record key; False if this instance already dispatched it."""
+    with _seen_lock:
+        if key in _seen:
+            return False
+        _seen[key] = True
+        while len(_seen) > SEEN_KEYS:
+            _seen.popitem(last=False)
+        return True
+
+
+def _forget(key):
+    with _seen_lock:
+        _seen.pop(key, None)
+
+
+class HttpDispatcher:
+    defers = False
+
+    def send(self, function_name, payload, key, delay=0):
+        import requests
+
+        try:
+            requests.post(
+                f"{FUNCTIONS_BASE_URL}/{function_name}",
+                data=payload,
+                timeout=(HTTP_CONNECT_TIMEOUT, HTTP_SEND_TIMEOUT)
+            )
+        except requests.exceptions.ReadTimeout:
+            pass  # Sent; the function keeps running without us waiting on it
+
+
+class CloudTasksDispatcher:
+    defers = True
+
+    def __init__(self, queue_path):
+        try:
+            from google.cloud import tasks_v2
+        except ImportError:
+            raise RuntimeError("DISPATCH_BACKEND=cloud_tasks needs the google-cloud-tasks package")
+        self._tasks_v2 = tasks_v2
+        self._client = tasks_v2.CloudTasksClient()
+        self._queue_path = queue_path
+
+    def send(self, function_name, payload, key, delay=0):
+        from google.api_core import exceptions
+        from google.protobuf import timestamp_pb2
+        from urllib.parse import urlencode
+
+        # Task names allow [A-Za-z0-9_-]; the digest keeps distinct keys distinct after cleaning
+        digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+        name = f"{self._queue_path}/tasks/{re.sub(r'[^A-Za-z0-9_-]', '_', key)[:400]}-{digest}"
+        task = {
+            "name": name,
+            "http_request": {
+                "http_method": self._tasks_v2.HttpMethod.POST,
+                "url": f"{FUNCTIONS_BASE_URL}/{function_name}",
+                "headers": {"Content-Type": "application/x-www-form-urlencoded"},
+                "body": urlencode(payload).encode(),
+            },
+        }
+        if delay:
+            schedule_time = timestamp_pb2.Timestamp()
+            schedule_time.FromSeconds(int(time.time() + delay))
+            task["schedule_time"] = schedule_time
+        try:
+            self._client.create_task(parent=self._queue_path, task=task)
+        except exceptions.AlreadyExists:
+            pass  # Another instance already queued this key
+
+
+class LocalDispatcher:
+    defers = True
+
+    def __init__(self, workers=4, time_scale=1.0):
+        """time_scale multiplies delays (the simulator runs faster than real time)."""
+        self.handlers = {}
+        self.time_scale = time_scale
+        self._queue = queue.Queue()
+        self._timers = set()
+        self._timers_lock = threading.Lock()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"dispatch-{i}", daemon=True).start()
+
+    def register(self, function_name, handler):
+        """handler(payload) runs on a worker thread for every task sent to function_name."""
+        self.handlers[function_name] = handler
+
+    def send(self, function_name, payload, key, delay=0):
+        if function_name not in self.handlers:
+            raise RuntimeError(f"No local handler registered for {function_name}")
+        if not delay:
+            self._queue.put((function_name, payload))
+            return
+
+        def due():
+            self._queue.put((function_name, payload))
+            with self._timers_lock:
+                self._timers.discard(timer)
+
+        timer = threading.Timer(delay * self.time_scale, due)
+        timer.daemon = True
+        with self._timers_lock:
+            self._timers.add(timer)
+        timer.start()
+
+    def join(self):
+        """Block until every queued and delayed task has run."""
+        while True:
+            with self._timers_lock:
+                timers = list(self._timers)
+            for timer in timers:
+                timer.join()
+            self._queue.join()
+            with self._timers_lock:
+                if not self._timers:
+                    return
+
+    def _work(self):
+        while True:
+            function_name, payload = self._queue.get()
+            try:
+                self.handlers[function_name](payload)
+            except Exception as e:
+                log.error("DISPATCH", "Local task failed", function=function_name, exc_info=e)
+            finally:
+                self._queue.task_done()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                queue_path = os.getenv("DISPATCH_QUEUE")
+                name = os.getenv("DISPATCH_BACKEND", "cloud_tasks" if queue_path else "http")
+                if name == "cloud_tasks":
+                    _backend = CloudTasksDispatcher(queue_path)
+                elif name == "local":
+                    _backend = LocalDispatcher()
+                else:
+                    _backend = HttpDispatcher()
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the transport (e.g. a LocalDispatcher in tests). Returns the previous one."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    with _seen_lock:
+        _seen.clear()
+    return previous
+
+
+def can_defer():
+    """True if the transport can hold a task back for a delay (http cannot)."""
+    return get_backend().defers
+
+
+def dispatch(function_name, payload, key, delay=0):
+    """Hand payload to function_name without waiting for it to run.
+
+    key identifies the unit of work (e.g. the CallSid); a key is dispatched
+    at most once. delay (seconds) defers the run, where the transport can.
+    Failed hand-offs are retried with jittered backoff.
+    Returns True once the task is handed off (or was already), False if every
+    attempt failed or the delay cannot be honoured.
+    """
+    backend = get_backend()
+    if delay and not backend.defers:
+        log.error("DISPATCH", "Transport cannot defer a task", key=key, delay=delay)
+        return False
+
+    if not _first_dispatch(key):
+        log.debug("DISPATCH", "Already dispatched, skipping", key=key)
+        return True
+
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            backend.send(function_name, payload, key, delay)
+            return True
+        except Exception as e:
+            log.warning("DISPATCH", "Dispatch attempt failed", key=key, attempt=attempt + 1, error=str(e))
+            if attempt + 1 < MAX_ATTEMPTS:
+                time.sleep(RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random()))
+
+    _forget(key)
+    return False
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta, timezone
+from common import metrics, store
+import os
+
+# Call history retention. Raw call documents and their outbound legs are
+# written with an expire_at timestamp and deleted by a Firestore TTL policy
+# on that field (frontend/firestore.indexes.json) once CALL_RETENTION_DAYS
+# have passed. Before that happens, compact_calls folds each day's calls
+# into daily rollups that history and reporting read instead:
+#
+#   accounts/{account_id}/daily_stats/{YYYY-MM-DD}
+#       calls, answered, unanswered, legs, tta_sum, tta_histogram
+#   accounts/{account_id}/users/{user_id}/daily_stats/{YYYY-MM-DD}
+#       dialed, answered, missed, canceled, tta_sum, tta_histogram
+#
+# tta_histogram counts answered calls by seconds from the caller joining to
+# the key press, keyed by the bucket's upper bound ("5", "10", ... "inf").
+# A day is recomputed from scratch on every run, so reruns are harmless.
+
+RETENTION_DAYS = int(os.getenv("CALL_RETENTION_DAYS", "30"))
+TTA_BUCKETS = (5, 10, 15, 20, 30, 45, 60, 90, 120)
+MISSED_STATUSES = {"no-answer", "busy", "failed"}
+
+
+def expire_at(start=None):
+    """When a call (or leg) that started at start should be deleted by the TTL policy."""
+    return (start or datetime.now(timezone.utc)) + timedelta(days=RETENTION_DAYS)
+
+
+def tta_bucket(seconds):
+    for bound in TTA_BUCKETS:
+        if seconds <= bound:
+            return str(bound)
+    return "inf"
+
+
+def day_bounds(day):
+    """UTC [start, end) of a YYYY-MM-DD day."""
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def yesterday():
+    return (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def _account_rollup(day):
+    return {"date": day, "calls": 0, "answered": 0, "unanswered": 0, "legs": 0, "tta_sum": 0.0, "tta_histogram": {}}
+
+
+def _user_rollup(day):
+    return {"date": day, "dialed": 0, "answered": 0, "missed": 0, "canceled": 0, "tta_sum": 0.0, "tta_histogram": {}}
+
+
+def _add_tta(rollup, seconds):
+    bucket = tta_bucket(seconds)
+    rollup["tta_sum"] += seconds
+    rollup["tta_histogram"][bucket] = rollup["tta_histogram"].get(bucket, 0) + 1
+
+
+def compact_account(db, account_ref, day):
+    """Write the day's rollups for one account and backfill expire_at on its raw docs.
+
+    Returns the account rollup. Costs one query over the day's calls, one
+    query per call over its legs, and one write per rollup plus one per raw
+    document that predates expire_at.
+    """
+    from google.cloud import firestore
+
+    start, end = day_bounds(day)
+    account = _account_rollup(day)
+    users = {}
+
+    def user(user_id):
+        if user_id not in users:
+            users[user_id] = _user_rollup(day)
+        return users[user_id]
+
+    calls = (
+        account_ref.collection("calls")
+        .where("timestamp", ">=", start)
+        .where("timestamp", "<", end)
+    )
+    metrics.count("firestore_queries")
+    with store.Batch(db) as batch:
+        for call in calls.stream():
+            metrics.count("firestore_reads")
+            data = call.to_dict()
+            started = data.get("timestamp")
+            expires = data.get("expire_at") or expire_at(started)
+            account["calls"] += 1
+
+            answered_by = data.get("answered_by")
+            answered_at = data.get("answered_at")
+            if answered_by:
+                account["answered"] += 1
+                user(answered_by)["answered"] += 1
+                if started and answered_at:
+                    seconds = max((answered_at - started).total_seconds(), 0.0)
+                    _add_tta(account, seconds)
+                    _add_tta(user(answered_by), seconds)
+            else:
+                account["unanswered"] += 1
+
+            metrics.count("firestore_queries")
+            for leg in call.reference.collection("outbound").stream():
+                metrics.count("firestore_reads")
+                leg_data = leg.to_dict()
+                account["legs"] += 1
+                if leg_data.get("user_id"):
+                    rollup = user(leg_data["user_id"])
+                    rollup["dialed"] += 1
+                    if leg_data.get("status") in MISSED_STATUSES:
+                        rollup["missed"] += 1
+                    elif leg_data.get("status") == "canceled":
+                        rollup["canceled"] += 1
+                if "expire_at" not in leg_data:
+                    batch.update(leg.reference, {"expire_at": expires})
+
+            if "expire_at" not in data:
+                batch.update(call.reference, {"expire_at": expires})
+
+        compacted_at = firestore.SERVER_TIMESTAMP
+        batch.set(account_ref.collection("daily_stats").document(day), {**account, "compacted_at": compacted_at})
+        for user_id, rollup in users.items():
+            ref = account_ref.collection("users").document(user_id).collection("daily_stats").document(day)
+            batch.set(ref, {**rollup, "compacted_at": compacted_at})
+
+    return account
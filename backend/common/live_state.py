@@ -0,0 +1,280 @@
+from common import log, metrics
+import json
+import os
+import queue
+import threading
+import time
+
+# Live call and user state for admin dashboards, fanned out from one set of
+# Firestore listeners per account per instance (a Hub) to any number of
+# Server-Sent Events clients (live_calls/main.py):
+#
+#   accounts/{id}/users                      every user (name, status, order)
+#   accounts/{id}/calls where status active  calls still in progress
+#   accounts/{id}/queue/state                queue figures, in queue mode
+#
+# Listener changes are diffed field by field against the last state sent
+# and coalesced: however many writes land in between, clients get at most
+# one "delta" event per UPDATE_INTERVAL, holding only the fields that
+# changed (null for a removed document). Each event is serialized once and
+# shared by every client. A client's queue holds MAX_CLIENT_BACKLOG events;
+# a client that falls further behind has its backlog dropped and receives
+# one fresh "snapshot" instead, so a slow browser costs neither memory nor
+# time on the others. Firestore reads therefore grow with the account's
+# activity, not with the number of dashboards open.
+
+UPDATE_INTERVAL = float(os.getenv("LIVE_UPDATE_INTERVAL", "1.0"))  # Seconds between deltas, per account
+MAX_CLIENT_BACKLOG = 32  # Events queued per client before it is resynced with a snapshot
+MAX_CLIENTS = 200        # Clients per account per instance; keep below deployLiveCalls.sh's --concurrency
+IDLE_CLOSE = 60          # Seconds a hub keeps its listeners after its last client leaves
+
+ACTIVE_CALL_STATUSES = ["initiated", "waiting", "connected"]
+USER_FIELDS = ("name", "status", "order")
+CALL_FIELDS = ("status", "answered_by", "callee_joined")
+
+_hubs = {}  # account_id -> Hub
+_lock = threading.Lock()
+
+
+class TooManyClients(Exception):
+    pass
+
+
+def _user_view(data):
+    return {field: data.get(field) for field in USER_FIELDS}
+
+
+def _call_view(data):
+    view = {field: data.get(field) for field in CALL_FIELDS}
+    started = data.get("timestamp")
+    view["started_at"] = started.timestamp() if hasattr(started, "timestamp") else None
+    return view
+
+
+def _queue_view(data):
+    waiting = (data or {}).get("waiting") or {}
+    oldest = min((entry.get("enqueued_at", 0) for entry in waiting.values()), default=None)
+    return {
+        "depth": len(waiting),
+        "ringing": len((data or {}).get("offers") or {}),
+        "talking": len((data or {}).get("busy") or {}),
+        "oldest_enqueued_at": oldest,
+    }
+
+
+def _diff(old, new):
+    """Field-level changes from old to new ({id: {field: value}}, None for a removed id)."""
+    changes = {}
+    for key, view in new.items():
+        before = old.get(key)
+        if before is None:
+            changes[key] = view
+        else:
+            fields = {field: value for field, value in view.items() if before.get(field) != value}
+            if fields:
+                changes[key] = fields
+    for key in old:
+        if key not in new:
+            changes[key] = None
+    return changes
+
+
+def _merge_pending(pending, changes):
+    for key, fields in changes.items():
+        if fields is None or pending.get(key) is None:
+            # A removal, or the first change since the last flush (or since a removal)
+            pending[key] = dict(fields) if fields is not None else None
+        else:
+            pending[key].update(fields)
+
+
+def _event(name, seq, data):
+    return f"id: {seq}\nevent: {name}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+
+class Client:
+    def __init__(self, hub):
+        self._hub = hub
+        self._events = queue.Queue(MAX_CLIENT_BACKLOG)
+        self._resync = threading.Event()
+
+    def offer(self, event):
+        """Queue an event without blocking; a full queue turns into a resync."""
+        try:
+            self._events.put_nowait(event)
+        except queue.Full:
+            self._resync.set()
+
+    def next(self, timeout):
+        """The next SSE event to write, or None if nothing arrived within timeout."""
+        if self._resync.is_set():
+            return self._take_snapshot()
+        try:
+            event = self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if self._resync.is_set():
+            return self._take_snapshot()
+        return event
+
+    def _take_snapshot(self):
+        while True:
+            try:
+                self._events.get_nowait()
+            except queue.Empty:
+                break
+        self._resync.clear()
+        return self._hub.snapshot_event()
+
+
+class Hub:
+    def __init__(self, account_ref):
+        self.account_id = account_ref.id
+        self._account_ref = account_ref
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._state = {"users": {}, "calls": {}, "queue": None}
+        self._pending = {"users": {}, "calls": {}, "queue": None}
+        self._seq = 0
+        self._clients = set()
+        self._idle_since = time.monotonic()
+        self._watches = []
+        self._closed = False
+
+    # -- listeners --
+
+    def open(self):
+        users_ref = self._account_ref.collection("users")
+        calls_query = self._account_ref.collection("calls").where("status", "in", ACTIVE_CALL_STATUSES)
+        queue_ref = self._account_ref.collection("queue").document("state")
+        try:
+            self._watches.append(users_ref.on_snapshot(self._on_users))
+            self._watches.append(calls_query.on_snapshot(self._on_calls))
+            self._watches.append(queue_ref.on_snapshot(self._on_queue))
+        except Exception as e:
+            log.error("LIVE", "Failed to start listeners", account_id=self.account_id, exc_info=e)
+            self.close()
+            raise
+        threading.Thread(target=self._flush_loop, name=f"live-{self.account_id}", daemon=True).start()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            watches, self._watches = self._watches, []
+            self._wake.notify_all()
+        for watch in watches:
+            watch.unsubscribe()
+
+    def _apply(self, section, new):
+        with self._lock:
+            changes = _diff(self._state[section], new)
+            if not changes:
+                return
+            self._state[section] = new
+            _merge_pending(self._pending[section], changes)
+            self._wake.notify_all()
+
+    def _on_users(self, docs, changes, read_time):
+        self._apply("users", {doc.id: _user_view(doc.to_dict() or {}) for doc in docs})
+
+    def _on_calls(self, docs, changes, read_time):
+        self._apply("calls", {doc.id: _call_view(doc.to_dict() or {}) for doc in docs})
+
+    def _on_queue(self, docs, changes, read_time):
+        doc = docs[0] if docs else None
+        view = _queue_view(doc.to_dict() if doc is not None and doc.exists else None)
+        with self._lock:
+            if view == self._state["queue"]:
+                return
+            self._state["queue"] = view
+            self._pending["queue"] = view
+            self._wake.notify_all()
+
+    # -- fan-out --
+
+    def _idle(self):
+        return not self._clients and time.monotonic() - self._idle_since > IDLE_CLOSE
+
+    def _flush_loop(self):
+        last = 0.0
+        while True:
+            with self._lock:
+                while not self._closed and not self._has_pending() and not self._idle():
+                    self._wake.wait(IDLE_CLOSE)
+                if self._closed or self._idle():
+                    self._closed = True  # subscribe() now refuses this hub
+                    break
+            # Rate cap: at most one delta per UPDATE_INTERVAL, everything since coalesced into it
+            delay = last + UPDATE_INTERVAL - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                delta = {section: value for section, value in self._pending.items() if value}
+                self._pending = {"users": {}, "calls": {}, "queue": None}
+                self._seq += 1
+                event = _event("delta", self._seq, delta)
+                clients = list(self._clients)
+            last = time.monotonic()
+            for client in clients:
+                client.offer(event)
+        _drop(self)
+
+    def _has_pending(self):
+        return any(self._pending.values())
+
+    def snapshot_event(self):
+        with self._lock:
+            return _event("snapshot", self._seq, self._state)
+
+    def subscribe(self):
+        """A new Client, or None if this hub is closing."""
+        with self._lock:
+            if self._closed:
+                return None
+            if len(self._clients) >= MAX_CLIENTS:
+                raise TooManyClients(self.account_id)
+            client = Client(self)
+            self._clients.add(client)
+            count = len(self._clients)
+        log.info("LIVE", "Client subscribed", account_id=self.account_id, clients=count)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+            if not self._clients:
+                self._idle_since = time.monotonic()
+            count = len(self._clients)
+        log.info("LIVE", "Client left", account_id=self.account_id, clients=count)
+
+
+def _drop(hub):
+    with _lock:
+        if _hubs.get(hub.account_id) is hub:
+            del _hubs[hub.account_id]
+    hub.close()
+    log.info("LIVE", "Closed idle hub", account_id=hub.account_id)
+
+
+def subscribe(account_ref):
+    """(hub, client) for a new client of the account's stream, opening its listeners on first use.
+
+    Raises TooManyClients when the account already has MAX_CLIENTS on this instance.
+    """
+    while True:
+        with _lock:
+            hub = _hubs.get(account_ref.id)
+            created = hub is None
+            if created:
+                hub = _hubs[account_ref.id] = Hub(account_ref)
+        if created:
+            metrics.count("firestore_queries", 2)  # users and active calls; the queue doc is a document listener
+            try:
+                hub.open()
+            except Exception:
+                _drop(hub)
+                raise
+        client = hub.subscribe()
+        if client is not None:
+            return hub, client
+        _drop(hub)  # Closed between the lookup and the subscribe; open a fresh one
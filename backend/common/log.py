@@ -0,0 +1,116 @@
+from common import metrics
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+# Structured logging for the backend. Each event is one JSON line on stdout
+# with "severity" and "message" (the keys Cloud Logging reads), the
+# component tag the old print lines used ("HANDLE CALL", "CALLBACK", ...),
+# the call_sid/account_id of the request being handled and any extra fields:
+#
+#   log.info("CALLBACK", "Final status for user leg", status=call_status)
+#
+#   LOG_LEVEL        DEBUG | INFO (default) | WARNING | ERROR. Events below
+#                    it are dropped before anything is formatted.
+#   LOG_SAMPLE_RATE  Share of chatty events (sample=log.CHATTY, e.g. the
+#                    initiated / ringing callbacks) that are kept; default 0.1.
+#
+# Records go through a bounded queue to a writer thread, so a handler never
+# waits on stdout; when the queue is full the event is dropped and counted.
+
+QUEUE_SIZE = 10000
+CHATTY = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+_logger = logging.getLogger("roundrobin")
+_listener = None
+_setup_lock = threading.Lock()
+dropped = 0
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "severity": record.levelname,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "component": getattr(record, "component", record.name),
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record  # Formatting happens on the writer thread
+
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+def _setup():
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter())
+        records = queue.Queue(QUEUE_SIZE)
+        _logger.addHandler(DroppingQueueHandler(records))
+        _logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        _logger.propagate = False
+        _listener = logging.handlers.QueueListener(records, stream)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def flush():
+    """Write out every queued event (e.g. before a process exits)."""
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
+
+
+def _log(level, component, message, sample, exc_info, fields):
+    if _listener is None:
+        _setup()
+    if not _logger.isEnabledFor(level):
+        return
+    if sample is not None:
+        if random.random() >= sample:
+            return
+        fields["sample_rate"] = sample
+    fields = {key: value for key, value in fields.items() if value is not None}
+    record = metrics.current()
+    if record is not None:
+        fields = {**record.ids, **fields}
+    _logger.log(level, message, exc_info=exc_info, extra={"component": component, "fields": fields})
+
+
+def debug(component, message, sample=None, **fields):
+    _log(logging.DEBUG, component, message, sample, None, fields)
+
+
+def info(component, message, sample=None, **fields):
+    _log(logging.INFO, component, message, sample, None, fields)
+
+
+def warning(component, message, sample=None, **fields):
+    _log(logging.WARNING, component, message, sample, None, fields)
+
+
+def error(component, message, exc_info=None, **fields):
+    _log(logging.ERROR, component, message, None, exc_info, fields)
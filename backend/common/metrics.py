@@ -0,0 +1,212 @@
+from collections import defaultdict
+from common import log
+from contextlib import contextmanager
+import contextvars
+import functools
+import os
+import threading
+import time
+
+# Per-request accounting. Every handler is wrapped with @instrumented, which
+# opens a Record for the request; the shared modules add to whatever record
+# is current:
+#
+#   count("firestore_reads")         Firestore documents read
+#   count("firestore_queries")       Firestore queries run
+#   count("firestore_writes")        Firestore documents written
+#   count("twilio_requests")         Twilio REST requests (every attempt)
+#   with phase("dial"): ...          Time spent in a named phase
+#
+# When the handler returns, the record is logged as one JSON line
+# (kind "request_metrics", with call_sid/account_id for correlation) and
+# added to process-wide totals. render() formats the totals in the
+# Prometheus text format; with METRICS_PORT set, a local thread serves them
+# at http://localhost:<port>/metrics.
+
+OPERATIONS = ("firestore_reads", "firestore_queries", "firestore_writes", "twilio_requests")
+
+_current = contextvars.ContextVar("metrics_record", default=None)
+
+_totals_lock = threading.Lock()
+_requests = defaultdict(int)          # (handler, status) -> requests
+_request_seconds = defaultdict(float)  # handler -> seconds
+_operations = defaultdict(int)        # (handler, operation) -> count
+_phase_seconds = defaultdict(float)   # (handler, phase) -> seconds
+_phase_count = defaultdict(int)       # (handler, phase) -> times entered
+
+_server = None
+_server_lock = threading.Lock()
+
+
+class Record:
+    def __init__(self, handler, **ids):
+        self.handler = handler
+        self.ids = {key: value for key, value in ids.items() if value}
+        self.counts = dict.fromkeys(OPERATIONS, 0)
+        self.phases = {}
+        self.started = time.perf_counter()
+
+    def as_dict(self, status, duration):
+        return {
+            "kind": "request_metrics",
+            "handler": self.handler,
+            **self.ids,
+            "status": status,
+            "duration_ms": round(duration * 1000, 1),
+            **self.counts,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+        }
+
+
+def current():
+    return _current.get()
+
+
+def count(operation, n=1):
+    """Add n to an operation counter of the current request (no-op outside one)."""
+    record = _current.get()
+    if record is not None:
+        record.counts[operation] = record.counts.get(operation, 0) + n
+
+
+def annotate(**ids):
+    """Attach correlation ids learned mid-request (e.g. account_id after the lookup)."""
+    record = _current.get()
+    if record is not None:
+        record.ids.update({key: value for key, value in ids.items() if value})
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = _current.get()
+        if record is not None:
+            record.phases[name] = record.phases.get(name, 0.0) + time.perf_counter() - started
+
+
+def submit(executor, fn, *args):
+    """executor.submit that keeps counting against the submitting request."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _ids_from(request):
+    args = getattr(request, "args", None) or {}
+    form = getattr(request, "form", None) or {}
+    call_sid = args.get("call_sid") or form.get("CallSid")
+    return {
+        "call_sid": call_sid,
+        "leg_sid": form.get("CallSid") if form.get("CallSid") != call_sid else None,
+        "account_id": args.get("account_id"),
+    }
+
+
+def _status_of(response):
+    if isinstance(response, tuple) and len(response) > 1:
+        return response[1]
+    return getattr(response, "status_code", 200)
+
+
+def instrumented(handler_name):
+    """Decorator for a handler(request): one Record per request, emitted when it returns."""
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(request):
+            _maybe_serve()
+            record = Record(handler_name, **_ids_from(request))
+            token = _current.set(record)
+            status = 500
+            try:
+                response = handler(request)
+                status = _status_of(response)
+                return response
+            finally:
+                _current.reset(token)
+                emit(record, status, time.perf_counter() - record.started)
+        return wrapper
+    return decorate
+
+
+def emit(record, status, duration):
+    log.info("METRICS", "request_metrics", **record.as_dict(status, duration))
+    handler = record.handler
+    with _totals_lock:
+        _requests[(handler, status)] += 1
+        _request_seconds[handler] += duration
+        for operation, n in record.counts.items():
+            _operations[(handler, operation)] += n
+        for name, seconds in record.phases.items():
+            _phase_seconds[(handler, name)] += seconds
+            _phase_count[(handler, name)] += 1
+
+
+def render():
+    """Process totals in the Prometheus text exposition format."""
+    with _totals_lock:
+        lines = ["# TYPE roundrobin_requests_total counter"]
+        lines += [
+            f'roundrobin_requests_total{{handler="{h}",status="{s}"}} {n}'
+            for (h, s), n in sorted(_requests.items(), key=str)
+        ]
+        lines.append("# TYPE roundrobin_request_seconds_sum counter")
+        lines += [f'roundrobin_request_seconds_sum{{handler="{h}"}} {s:.6f}' for h, s in sorted(_request_seconds.items())]
+        lines.append("# TYPE roundrobin_operations_total counter")
+        lines += [
+            f'roundrobin_operations_total{{handler="{h}",operation="{o}"}} {n}'
+            for (h, o), n in sorted(_operations.items())
+        ]
+        lines.append("# TYPE roundrobin_phase_seconds summary")
+        for (h, p), seconds in sorted(_phase_seconds.items()):
+            lines.append(f'roundrobin_phase_seconds_sum{{handler="{h}",phase="{p}"}} {seconds:.6f}')
+            lines.append(f'roundrobin_phase_seconds_count{{handler="{h}",phase="{p}"}} {_phase_count[(h, p)]}')
+    return "\n".join(lines) + "\n"
+
+
+def totals():
+    """Process totals per handler: requests, seconds, operation counts and phase seconds."""
+    with _totals_lock:
+        handlers = {}
+        for (h, _), n in _requests.items():
+            handlers.setdefault(h, {"requests": 0, "seconds": _request_seconds[h], "operations": {}, "phases": {}})
+            handlers[h]["requests"] += n
+        for (h, o), n in _operations.items():
+            handlers[h]["operations"][o] = n
+        for (h, p), seconds in _phase_seconds.items():
+            handlers[h]["phases"][p] = seconds
+    return handlers
+
+
+def reset():
+    """Clear the process totals (benchmarks and load tests)."""
+    with _totals_lock:
+        for totals in (_requests, _request_seconds, _operations, _phase_seconds, _phase_count):
+            totals.clear()
+
+
+def _maybe_serve():
+    global _server
+    port = os.getenv("METRICS_PORT")
+    if not port or _server is not None:
+        return
+    with _server_lock:
+        if _server is not None:
+            return
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = render().encode()
+                self.send_response(200 if self.path == "/metrics" else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.end_headers()
+                if self.path == "/metrics":
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        _server = ThreadingHTTPServer(("127.0.0.1", int(port)), MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        log.info("METRICS", "Serving Prometheus metrics", url=f"http://127.0.0.1:{port}/metrics")
@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+from common import log, metrics
+
+FINAL_LEG_STATUSES = {"completed", "no-answer", "busy", "failed", "canceled"}
+
+CANCEL_WORKERS = 8  # Concurrent Twilio cancel requests per instance
+
+_executor = ThreadPoolExecutor(max_workers=CANCEL_WORKERS, thread_name_prefix="cancel-leg")
+
+
+def _cancel_one(client, sid):
+    try:
+        client.update_call(sid, status="canceled")
+        return "canceled"
+    except Exception as ce:
+        log.warning("OUTBOUND", "Failed to cancel leg", leg_sid=sid, error=str(ce))
+        return f"error: {ce}"
+
+
+def cancel_legs(client, call_ref, exclude=()):
+    """Stop every outbound leg of a call that is still ringing.
+
+    Legs whose outbound doc already has a final status (or whose sid is in
+    exclude) are skipped without a Twilio request; the rest are cancelled
+    concurrently. Returns {outbound_sid: "canceled" | "skipped:<status>" | "error: ..."}.
+    """
+    results = {}
+    pending = []
+    metrics.count("firestore_queries")
+    for doc in call_ref.collection("outbound").stream():
+        metrics.count("firestore_reads")
+        status = (doc.to_dict() or {}).get("status")
+        if doc.id in exclude:
+            results[doc.id] = "skipped:excluded"
+        elif status in FINAL_LEG_STATUSES:
+            results[doc.id] = f"skipped:{status}"
+        else:
+            pending.append(doc.id)
+
+    futures = {sid: metrics.submit(_executor, _cancel_one, client, sid) for sid in pending}
+    for sid, future in futures.items():
+        results[sid] = future.result()
+
+    if pending:
+        log.info("OUTBOUND", "Cancelled ringing legs", cancelled=len(pending), skipped=len(results) - len(pending))
+    return results
@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from common import log, metrics
+import threading
+
+# Per-instance cache of each account's users, kept current by a snapshot
+# listener on accounts/{id}/users. Dialing code reads the ordered roster and
+# the live availability index from memory instead of querying Firestore.
+MAX_ROSTERS = 64  # Accounts with a live listener per warm instance
+READY_TIMEOUT = 5  # Seconds to wait for the first listener snapshot
+
+_rosters = OrderedDict()  # account_id -> Roster
+_lock = threading.Lock()
+
+
+class Roster:
+    def __init__(self, account_ref):
+        self.account_id = account_ref.id
+        self._users_ref = account_ref.collection("users")
+        self._ordered = []
+        self._in_conference = set()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+
+    def _apply(self, docs):
+        users = sorted(
+            ({"id": doc.id, **(doc.to_dict() or {})} for doc in docs),
+            key=lambda user: user.get("order", 0)
+        )
+        with self._lock:
+            self._ordered = users
+            self._in_conference = {user["id"] for user in users if user.get("status") == "in_conference"}
+        self._ready.set()
+
+    def _on_snapshot(self, docs, changes, read_time):
+        self._apply(docs)
+
+    def open(self):
+        try:
+            self._watch = self._users_ref.on_snapshot(self._on_snapshot)
+        except Exception as e:
+            log.warning("ROSTER", "Failed to start users listener", account_id=self.account_id, error=str(e))
+        if not self._ready.wait(READY_TIMEOUT if self._watch else 0):
+            log.warning("ROSTER", "Listener not ready, loading users directly", account_id=self.account_id)
+            metrics.count("firestore_queries")
+            docs = list(self._users_ref.order_by("order").stream())
+            metrics.count("firestore_reads", max(len(docs), 1))
+            self._apply(docs)
+
+    def close(self):
+        if self._watch:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def users(self):
+        """Ordered list of user dicts (a copy, safe to keep across listener updates)."""
+        with self._lock:
+            return list(self._ordered)
+
+    def user(self, user_id):
+        with self._lock:
+            for user in self._ordered:
+                if user["id"] == user_id:
+                    return user
+        return None
+
+    def can_dial(self, user_id):
+        """True if the user is still on the roster and not in a conference."""
+        with self._lock:
+            return user_id not in self._in_conference and any(user["id"] == user_id for user in self._ordered)
+
+    def by_ids(self, user_ids):
+        """Users in the given order; ids no longer on the roster come back as {"id": id}."""
+        with self._lock:
+            known = {user["id"]: user for user in self._ordered}
+        return [known.get(user_id, {"id": user_id}) for user_id in user_ids]
+
+    def is_in_conference(self, user_id):
+        with self._lock:
+            return user_id in self._in_conference
+
+    def available(self):
+        """Ordered list of users not currently in a conference."""
+        with self._lock:
+            return [user for user in self._ordered if user["id"] not in self._in_conference]
+
+    def set_status(self, user_id, status):
+        """Record a status this instance just wrote, ahead of the listener echo."""
+        with self._lock:
+            if status == "in_conference":
+                self._in_conference.add(user_id)
+            else:
+                self._in_conference.discard(user_id)
+
+
+def get(account_ref):
+    """Return the live roster for an account, opening its listener on first use."""
+    evicted = []
+    with _lock:
+        roster = _rosters.get(account_ref.id)
+        created = roster is None
+        if created:
+            roster = _rosters[account_ref.id] = Roster(account_ref)
+            while len(_rosters) > MAX_ROSTERS:
+                evicted.append(_rosters.popitem(last=False)[1])
+        else:
+            _rosters.move_to_end(account_ref.id)
+
+    for old in evicted:
+        old.close()
+    if created:
+        roster.open()
+    else:
+        roster._ready.wait(READY_TIMEOUT)
+    return roster
+
+
+def note_status(account_id, user_id, status):
+    """Apply a user status write to this instance's roster, if it tracks the account."""
+    with _lock:
+        roster = _rosters.get(account_id)
+    if roster is not None:
+        roster.set_status(user_id, status)
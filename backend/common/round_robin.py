@@ -0,0 +1,451 @@
+from google.cloud import firestore
+from common import roster as rosters
+from common import analytics, call_token, dispatch, history, log, metrics, store, twilio_gateway, twiml, user_stats
+import threading
+import time
+
+POLLING_MODE = "polling"  # handle_call dials and waits in a loop (original behaviour)
+EVENT_MODE = "event"      # next user is dialed from caller_status_callback events
+QUEUE_MODE = "queue"      # callers wait in one queue per account (common/call_queue.py)
+
+# handle_call is deployed with --timeout=60s; a polling chunk stops dialing new
+# users once it can no longer finish a full ring wait inside this budget.
+CHUNK_BUDGET = 45
+CHUNK_DEADLINE = 55  # Seconds into a chunk by which a wave's creates and ring wait must be done
+MAX_REDIALS = 3      # Times a user whose create placed no call leads the next wave before being skipped
+# (polling); in event mode, creates in a row that placed no call before advance()
+# leaves the rest of the roster to resume_wave
+RESUME_DELAY = 5     # Seconds before resume_wave runs, where the dispatch transport can defer
+
+# An event-mode wave moves on when the final status callback of its last leg
+# is processed. In case one never arrives, or its handler fails, every wave
+# also dispatches a delayed check (check_wave) for when each of its legs must
+# be over: the longest ring timeout, the press-1 prompt and some grace. Only
+# transports that can defer a task (Cloud Tasks, local) get the check; http
+# would have to hold an instance open for the whole wait.
+WAVE_PROMPT_WINDOW = 30  # Seconds a callee who picked up may spend at the prompt
+WAVE_GRACE = 15          # Extra seconds for Twilio's final callbacks
+
+def get_mode(account_data):
+    return account_data.get("round_robin_mode", POLLING_MODE)
+
+
+def wait_for_call(call_ref, predicate, timeout):
+    """Block until the call document matches predicate, using a snapshot listener.
+
+    Returns the matching call data, or None if the timeout expires first.
+    """
+    matched = threading.Event()
+    result = {}
+
+    def on_snapshot(docs, changes, read_time):
+        for doc in docs:
+            data = doc.to_dict() or {}
+            if predicate(data):
+                result["data"] = data
+                matched.set()
+
+    watch = call_ref.on_snapshot(on_snapshot)
+    metrics.count("firestore_reads")  # The listener's first snapshot
+    try:
+        matched.wait(timeout)
+    finally:
+        watch.unsubscribe()
+    return result.get("data")
+
+
+def next_wave(users, rr_round, rr_index, max_retries, can_dial, size=1):
+    """Return the (round, index) positions of the next wave of up to size dialable users.
+
+    The wave starts after the given cursor, skips users the live roster
+    (can_dial) reports as busy or removed, and never rings the same user twice.
+    Returns an empty list when every round is exhausted.
+    """
+    total = len(users)
+    position = rr_round * total + rr_index + 1
+    wave = []
+    seen = set()
+    while position < max_retries * total and len(wave) < size:
+        user = users[position % total]
+        if user["id"] in seen:
+            break
+        seen.add(user["id"])
+        if can_dial(user["id"]):
+            wave.append((position // total, position % total))
+        else:
+            log.debug("ROUND ROBIN", "Skipping user: in a conference or no longer on the roster", user_id=user["id"])
+        position += 1
+    return wave
+
+
+def dial_user(client, account_id, call_sid, from_number, user, rr_round=None, rr_index=None, ring_group=False, queued=False, deadline=None):
+    """Place the outbound leg to one user. Cursor params are only set in event mode,
+    and queue=1 marks a leg offered by the caller queue (common/call_queue.py).
+    deadline bounds the create (twilio_gateway.Gateway.create_call).
+
+    Twilio gives up after the user's adaptive ring timeout and reports
+    no-answer; dialed_at lets the final callback work out the answer delay.
+    The prompt URL carries a signed call context (common/call_token.py) when
+    a secret is configured, so the key press needs no user or account read.
+    """
+    room_name = f"conf-{call_sid}"
+    user_id = user["id"]
+    callback_params = {
+        "user_id": user_id,
+        "account_id": account_id,
+        "call_sid": call_sid,
+        "dialed_at": int(time.time()),
+    }
+    if rr_round is not None:
+        callback_params.update(rr_round=rr_round, rr_index=rr_index)
+    if queued:
+        callback_params["queue"] = 1
+    token = call_token.issue(account_id, user_id, room_name, from_number, ring_group, queued)
+    if token:
+        prompt_params = {"ctx": token}
+    else:
+        prompt_params = {"room": room_name, "user_id": user_id, "account_id": account_id}
+
+    return client.create_call(
+        to=user["phone_number"],
+        from_=from_number,
+        url=twiml.function_url("gather_response", **prompt_params),
+        status_callback=twiml.function_url("caller_status_callback", **callback_params),
+        status_callback_event=["initiated", "ringing", "answered", "completed"],
+        status_callback_method="POST",
+        timeout=user_stats.ring_timeout(user),
+        deadline=deadline
+    )
+
+
+def say_goodbye(client, call_sid):
+    try:
+        client.update_call(call_sid, twiml=twiml.say("Sorry, no one was available to take your call. Goodbye."))
+        log.info("ROUND ROBIN", "Sent goodbye message to caller")
+    except Exception as final_err:
+        log.error("ROUND ROBIN", "Failed to update caller TwiML", error=str(final_err))
+
+
+def call_users(roster, cursor):
+    """The users of this call in the dialing order frozen on its cursor."""
+    if cursor.get("user_ids"):
+        return roster.by_ids(cursor["user_ids"])
+    return roster.users()
+
+
+def claim_chunk(db, call_ref, chunk, from_number, max_retries, group_size=1, user_ids=None):
+    """Take ownership of one chunk of the round robin.
+
+    Chunk 0 creates the cursor, freezing the dialing order (user_ids) for the
+    call so routing stats changing mid-call cannot shift the cursor. Chunk N
+    may only follow chunk N - 1, so a duplicated trigger or dispatch never
+    runs two dialing loops for one call.
+    Returns the cursor, or None if the chunk is not ours to run.
+    """
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = call_ref.get(transaction=transaction)
+        metrics.count("firestore_reads")
+        data = snapshot.to_dict() if snapshot.exists else {}
+        cursor = data.get("cursor")
+        if chunk == 0:
+            if cursor:
+                return None
+            cursor = {
+                "round": 0,
+                "index": -1,
+                "pending": 1,
+                "active_sids": [],
+                "outbound_sids": [],
+                "max_retries": max_retries,
+                "group_size": group_size,
+                "user_ids": list(user_ids or []),
+                "from": from_number,
+                "chunk": 0,
+                "done": False,
+            }
+            transaction.set(call_ref, {"cursor": cursor}, merge=True)
+            metrics.count("firestore_writes")
+            return cursor
+        if not cursor or cursor.get("done") or cursor.get("chunk") != chunk - 1:
+            return None
+        transaction.update(call_ref, {"cursor.chunk": chunk})
+        metrics.count("firestore_writes")
+        cursor["chunk"] = chunk
+        return cursor
+
+    return claim(db.transaction())
+
+
+def checkpoint(call_ref, rr_round, rr_index, outbound_sids=(), batch=None, redials=0):
+    """Persist the position of the last user dialed and the legs of its wave on the cursor.
+
+    redials counts the failed creates of the user after that position.
+    Pass the store.Batch holding the wave's outbound docs to commit them together.
+    """
+    outbound_sids = list(outbound_sids)
+    update = {
+        "cursor.round": rr_round,
+        "cursor.index": rr_index,
+        "cursor.active_sids": outbound_sids,
+        "cursor.redials": redials,
+    }
+    if outbound_sids:
+        update["cursor.outbound_sids"] = firestore.ArrayUnion(outbound_sids)
+    if batch is not None:
+        batch.update(call_ref, update)
+    else:
+        metrics.count("firestore_writes")
+        call_ref.update(update)
+
+
+def get_group_size(account_data):
+    """Users rung at once per wave; 1 is the classic sequential round robin."""
+    return max(1, int(account_data.get("ring_group_size", 1)))
+
+
+def dispatch_chunk(call_sid, twilio_number, chunk):
+    """Start the next polling chunk in a new handle_call invocation without waiting for it."""
+    if not dispatch.dispatch(
+        "handle_call",
+        {"CallSid": call_sid, "To": twilio_number, "Chunk": chunk},
+        key=f"handle_call-{call_sid}-{chunk}"
+    ):
+        log.error("ROUND ROBIN", "Failed to dispatch chunk", chunk=chunk)
+
+
+def watch_wave(call_sid, twilio_number, rr_round, rr_index, delay):
+    """Have handle_call check on the wave ending at (rr_round, rr_index) in delay seconds.
+
+    Skipped when the dispatch transport cannot defer the check.
+    """
+    if not dispatch.can_defer():
+        log.debug("ROUND ROBIN", "Dispatch transport cannot defer; no wave check", rr_round=rr_round, rr_index=rr_index)
+        return
+    if not dispatch.dispatch(
+        "handle_call",
+        {"CallSid": call_sid, "To": twilio_number, "Wave": f"{rr_round}:{rr_index}"},
+        key=f"handle_call-{call_sid}-wave-{rr_round}-{rr_index}",
+        delay=delay
+    ):
+        log.error("ROUND ROBIN", "Failed to dispatch wave check", rr_round=rr_round, rr_index=rr_index)
+
+
+def resume_wave(call_sid, twilio_number, rr_round, rr_index):
+    """Have handle_call move on from the wave ending at (rr_round, rr_index), none of
+    whose calls were placed, in a fresh invocation (check_wave)."""
+    if not dispatch.dispatch(
+        "handle_call",
+        {"CallSid": call_sid, "To": twilio_number, "Wave": f"{rr_round}:{rr_index}"},
+        key=f"handle_call-{call_sid}-resume-{rr_round}-{rr_index}",
+        delay=RESUME_DELAY if dispatch.can_defer() else 0
+    ):
+        log.error("ROUND ROBIN", "Failed to dispatch wave resume", rr_round=rr_round, rr_index=rr_index)
+
+
+def check_wave(db, client, account_ref, call_sid, rr_round, rr_index, deadline=None):
+    """Move on from a wave whose legs went quiet or were never placed. True if the
+    wave was still waiting on them."""
+    call_ref = account_ref.collection("calls").document(call_sid)
+
+    @firestore.transactional
+    def stall(transaction):
+        snapshot = call_ref.get(transaction=transaction)
+        metrics.count("firestore_reads")
+        cursor = (snapshot.to_dict() or {}).get("cursor") or {} if snapshot.exists else {}
+        if (
+            cursor.get("done")
+            or cursor.get("round") != rr_round
+            or cursor.get("index") != rr_index
+            or cursor.get("pending", 0) <= 0
+        ):
+            return 0
+        # Leave one leg pending, so advance() below finishes the wave
+        transaction.update(call_ref, {"cursor.pending": 1})
+        metrics.count("firestore_writes")
+        return cursor["pending"]
+
+    unreported = stall(db.transaction())
+    if not unreported:
+        return False
+    log.warning("ROUND ROBIN", "Wave still pending. Moving on.", rr_round=rr_round, rr_index=rr_index, unreported=unreported)
+    advance(db, client, account_ref, call_sid, rr_round, rr_index, deadline)
+    return True
+
+
+def mark_pressed(call_ref, callee_sid):
+    """Note that a person on this leg reached the key press, so its final status
+    is not taken for a voicemail pickup (user_stats.record_leg)."""
+    if not store.update_if_exists(call_ref, {"pressed_sids": firestore.ArrayUnion([callee_sid])}):
+        log.warning("ROUND ROBIN", "Call document missing; key press not recorded")
+
+
+def claim_answer(db, call_ref, user_id, callee_sid):
+    """Atomically make this callee the one who takes the call.
+
+    Returns "claimed", "taken" (another user pressed 1 first), "caller_left"
+    or "missing". A leg that cannot take the call is added to pressed_sids
+    (see mark_pressed).
+    """
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = call_ref.get(transaction=transaction)
+        metrics.count("firestore_reads")
+        if not snapshot.exists:
+            return "missing"
+        data = snapshot.to_dict()
+        if data.get("status") == "caller_left" or (data.get("answered_by") and data.get("answered_by") != user_id):
+            transaction.update(call_ref, {"pressed_sids": firestore.ArrayUnion([callee_sid])})
+            metrics.count("firestore_writes")
+            return "caller_left" if data.get("status") == "caller_left" else "taken"
+        metrics.count("firestore_writes")
+        transaction.update(call_ref, {
+            "answered_by": user_id,
+            "answered_sid": callee_sid,
+            "answered_at": firestore.SERVER_TIMESTAMP,
+        })
+        return "claimed"
+
+    return claim(db.transaction())
+
+
+def start(db, client, account_ref, call_sid, from_number, max_retries, group_size=1, user_ids=None, deadline=None):
+    """Initialise the event-driven cursor on the call document and dial the first wave.
+
+    Returns False if the round robin was already started for this call.
+    """
+    call_ref = account_ref.collection("calls").document(call_sid)
+    if claim_chunk(db, call_ref, 0, from_number, max_retries, group_size, user_ids) is None:
+        log.info("ROUND ROBIN", "Cursor already exists, not restarting")
+        return False
+
+    # The fresh cursor has one pending "leg" at (0, -1); finishing it dials wave one
+    advance(db, client, account_ref, call_sid, 0, -1, deadline)
+    return True
+
+
+def advance(db, client, account_ref, call_sid, rr_round, rr_index, deadline=None):
+    """Record that one leg of the wave ending at (rr_round, rr_index) is over.
+
+    When the last leg of the wave finishes, the next wave is claimed and
+    dialed. Only legs of the wave the cursor currently points at count, so
+    duplicate or late callbacks for older legs are ignored. Legs whose create
+    failed are settled together in the next claim, which dials the wave
+    after when none of the wave's calls were placed. After MAX_REDIALS creates
+    in a row that placed no call (Twilio throttling or down, or out of time)
+    the rest is left to resume_wave. deadline (a time.monotonic() value,
+    CHUNK_DEADLINE from now by default) bounds the creates.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + CHUNK_DEADLINE
+    account_id = account_ref.id
+    call_ref = account_ref.collection("calls").document(call_sid)
+    roster = rosters.get(account_ref)
+
+    @firestore.transactional
+    def claim_next(transaction, rr_round, rr_index, finished):
+        snapshot = call_ref.get(transaction=transaction)
+        metrics.count("firestore_reads")
+        if not snapshot.exists:
+            return None, None, None
+        data = snapshot.to_dict()
+        cursor = data.get("cursor") or {}
+        if (
+            cursor.get("done")
+            or cursor.get("round") != rr_round
+            or cursor.get("index") != rr_index
+        ):
+            return None, None, None
+        if data.get("status") == "caller_left" or data.get("callee_joined") or data.get("answered_by"):
+            transaction.update(call_ref, {"cursor.done": True})
+            metrics.count("firestore_writes")
+            return None, None, None
+
+        pending = cursor.get("pending", 1) - finished
+        if pending > 0:
+            transaction.update(call_ref, {"cursor.pending": pending})
+            metrics.count("firestore_writes")
+            return None, None, None
+
+        users = call_users(roster, cursor)
+        wave = next_wave(
+            users, rr_round, rr_index, cursor.get("max_retries", 3),
+            roster.can_dial, cursor.get("group_size", 1)
+        ) if users else []
+        if not wave:
+            transaction.update(call_ref, {"cursor.done": True})
+            metrics.count("firestore_writes")
+            return "exhausted", cursor, None
+        metrics.count("firestore_writes")
+        transaction.update(call_ref, {
+            "cursor.round": wave[-1][0],
+            "cursor.index": wave[-1][1],
+            "cursor.pending": len(wave),
+            "cursor.active_sids": [],
+        })
+        return wave, cursor, users
+
+    dialed = []
+    finished = 1
+    redials = 0
+    while True:
+        wave, cursor, users = claim_next(db.transaction(), rr_round, rr_index, finished)
+        if wave is None:
+            return dialed
+        if wave == "exhausted":
+            log.info("COMPLETE", "No users connected after max retries")
+            analytics.record(db, account_ref, {"exhausted": 1})
+            say_goodbye(client, call_sid)
+            return dialed
+
+        # Every leg of the wave reports back against the wave's last position
+        rr_round, rr_index = wave[-1]
+        wave_wait = max(user_stats.ring_timeout(users[index]) for _, index in wave)
+        watch_wave(call_sid, cursor["from"], rr_round, rr_index, wave_wait + WAVE_PROMPT_WINDOW + WAVE_GRACE)
+        wave_dialed = []
+        dialed_users = []
+        failed = 0
+        with store.Batch(db) as batch:
+            for position in wave:
+                user = users[position[1]]
+                log.info("CALLING", "Trying user", user_id=user["id"], rr_round=position[0], rr_index=position[1])
+                try:
+                    call = dial_user(
+                        client, account_id, call_sid, cursor["from"], user, rr_round, rr_index,
+                        ring_group=cursor.get("group_size", 1) > 1, deadline=deadline
+                    )
+                except Exception as call_error:
+                    if twilio_gateway.is_transient(call_error):
+                        redials += 1
+                    log.error("CALLING", "Failed to call user", user_id=user["id"], redials=redials, error=str(call_error))
+                    failed += 1
+                    continue
+                redials = 0
+                wave_dialed.append(call.sid)
+                dialed_users.append(user["id"])
+                batch.set(call_ref.collection("outbound").document(call.sid), {
+                    "to": user["phone_number"],
+                    "user_id": user["id"],
+                    "status": "initiated",
+                    "expire_at": history.expire_at()
+                }, merge=True)
+
+            if wave_dialed:
+                batch.update(call_ref, {
+                    "cursor.active_sids": firestore.ArrayUnion(wave_dialed),
+                    "cursor.outbound_sids": firestore.ArrayUnion(wave_dialed),
+                    "cursor.redials": redials,
+                })
+                analytics.record(db, account_ref, analytics.dial_counters(dialed_users), batch)
+            elif redials:
+                batch.update(call_ref, {"cursor.redials": redials})
+        dialed += wave_dialed
+        if not failed:
+            return dialed
+        if not wave_dialed and redials >= MAX_REDIALS:
+            # ⏸️ Twilio keeps refusing; finish the roster in another invocation instead of this one
+            log.warning("ROUND ROBIN", "Calls keep failing. Resuming in a new invocation.", redials=redials)
+            resume_wave(call_sid, cursor["from"], rr_round, rr_index)
+            return dialed
+        # A leg that could not be placed is finished as far as the wave is concerned
+        finished = failed
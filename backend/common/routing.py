@@ -0,0 +1,63 @@
+from common import log
+from common.user_stats import NEUTRAL_ANSWER_RATE
+import time
+
+# Per-account dialing order. The account's "routing_strategy" picks how the
+# roster is sorted, and "skip_after_misses" (K) rests users who missed their
+# last K calls: they are skipped until "skip_cooldown" seconds have passed
+# since they were last rung, then rung again (one more miss rests them
+# again, an answer resets the streak). Everything is computed from the live
+# roster and the stats caller_status_callback keeps on each user, so
+# ordering costs no reads.
+
+STATIC = "static"              # The drag-and-drop "order" field
+LEAST_RECENT = "least_recent"  # Longest since last rung first
+ANSWER_RATE = "answer_rate"    # Highest recent answer rate first
+
+SKIP_COOLDOWN = 15 * 60  # Seconds a skipped user rests, unless the account sets skip_cooldown
+
+
+def _static_key(user):
+    return user.get("order", 0)
+
+
+def _least_recent_key(user):
+    stats = user.get("stats") or {}
+    return (stats.get("last_called_at", 0), _static_key(user))
+
+
+def _answer_rate_key(user):
+    stats = user.get("stats") or {}
+    return (-stats.get("answer_rate", NEUTRAL_ANSWER_RATE), _static_key(user))
+
+
+STRATEGIES = {
+    STATIC: _static_key,
+    LEAST_RECENT: _least_recent_key,
+    ANSWER_RATE: _answer_rate_key,
+}
+
+
+def _resting(user, skip_after, cooldown, now):
+    stats = user.get("stats") or {}
+    return stats.get("missed_streak", 0) >= skip_after and now - stats.get("last_called_at", 0) < cooldown
+
+
+def order_users(users, account_data, now=None):
+    """Return the users in the order this account wants them dialed."""
+    strategy = account_data.get("routing_strategy", STATIC)
+    key = STRATEGIES.get(strategy)
+    if key is None:
+        log.warning("ROUTING", "Unknown routing strategy, using static order", strategy=strategy)
+        key = _static_key
+    ordered = sorted(users, key=key)
+
+    skip_after = account_data.get("skip_after_misses")
+    if skip_after:
+        cooldown = account_data.get("skip_cooldown", SKIP_COOLDOWN)
+        now = time.time() if now is None else now
+        kept = [user for user in ordered if not _resting(user, skip_after, cooldown, now)]
+        # Never skip everyone: a caller with a roster of chronic missers still gets rung through
+        if kept:
+            ordered = kept
+    return ordered
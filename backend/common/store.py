@@ -0,0 +1,81 @@
+from google.api_core import exceptions
+from common import metrics
+
+# Write helpers that let Firestore check preconditions instead of reading a
+# document first, and that group a handler's writes into one commit. Per
+# handler read/write counts are listed in backend/README.md.
+
+MAX_BATCH_WRITES = 500  # Firestore's limit per commit
+
+
+def update_if_exists(ref, data):
+    """Update ref without reading it first. Returns False if the document does not exist.
+
+    update() already carries an exists=True precondition, so a missing
+    document costs one failed write instead of a read plus a write.
+    """
+    metrics.count("firestore_writes")
+    try:
+        ref.update(data)
+        return True
+    except exceptions.NotFound:
+        return False
+
+
+def create_if_missing(ref, data):
+    """Create ref unless it exists. Returns False (and writes nothing) if it already does."""
+    metrics.count("firestore_writes")
+    try:
+        ref.create(data)
+        return True
+    except exceptions.Conflict:
+        return False
+
+
+def merge(ref, data):
+    """Set only the given fields, creating the document if needed."""
+    metrics.count("firestore_writes")
+    ref.set(data, merge=True)
+
+
+class Batch:
+    """Collects a handler's writes and commits them in one round trip.
+
+    Use as a context manager; nothing is sent if no write was queued. Like
+    update_if_exists, a batch update on a missing document fails the whole
+    commit, so only queue updates for documents known to exist. Batches
+    that grow past MAX_BATCH_WRITES (backfills, compaction) are committed
+    in chunks, which are not atomic with each other.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._batch = db.batch()
+        self.writes = 0
+
+    def set(self, ref, data, merge=False):
+        self._batch.set(ref, data, merge=merge)
+        self._added()
+
+    def update(self, ref, data):
+        self._batch.update(ref, data)
+        self._added()
+
+    def _added(self):
+        self.writes += 1
+        if self.writes >= MAX_BATCH_WRITES:
+            self.commit()
+
+    def commit(self):
+        if self.writes:
+            metrics.count("firestore_writes", self.writes)
+            self._batch.commit()
+            self._batch = self._db.batch()
+            self.writes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
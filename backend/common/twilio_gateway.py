@@ -0,0 +1,197 @@
+from common import log, metrics
+import os
+import random
+import threading
+import time
+
+# Every Twilio REST request the backend makes goes through one Gateway per
+# process (common.clients.twilio). It keeps a pool of keep-alive HTTPS
+# connections, paces call creation with a token bucket per Twilio account
+# SID, retries throttled or failed requests with jittered backoff and counts
+# requests, retries, errors and latency per operation.
+#
+#   TWILIO_CALLS_PER_SECOND  Outbound calls.create rate per account SID and
+#                            instance (Twilio's CPS limit is per account)
+#   TWILIO_CALLS_BURST       Creates allowed back to back before pacing starts
+
+POOL_SIZE = 16              # Keep-alive connections to api.twilio.com
+REQUEST_TIMEOUT = 10        # Seconds per HTTP request
+MAX_ATTEMPTS = 4            # Tries per request before the error is raised
+RETRY_BASE_DELAY = 0.25     # Seconds, doubled per attempt, with jitter
+MAX_THROTTLE_WAIT = 5       # Seconds a create may wait for a token
+DEFAULT_CALLS_PER_SECOND = 5
+
+# Twilio statuses worth retrying. calls.create is only retried when Twilio
+# cannot have placed the call (rate limited or unavailable); updates are
+# idempotent, so any server error is retried.
+CREATE_RETRY_STATUSES = {429, 503}
+UPDATE_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Throttled(Exception):
+    """No call-creation token became free within MAX_THROTTLE_WAIT."""
+
+
+class DeadlineExceeded(Exception):
+    """Not enough time left before the caller's deadline to send another create."""
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait):
+        """Take one token, sleeping until one is free. Returns the seconds waited."""
+        deadline = time.monotonic() + max_wait
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            if now + delay > deadline:
+                raise Throttled(f"No Twilio call slot free within {max_wait}s")
+            time.sleep(delay)
+            waited += delay
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket_for(account_sid):
+    """The call-creation bucket shared by every gateway for account_sid in this process."""
+    with _buckets_lock:
+        bucket = _buckets.get(account_sid)
+        if bucket is None:
+            rate = float(os.getenv("TWILIO_CALLS_PER_SECOND", DEFAULT_CALLS_PER_SECOND))
+            burst = float(os.getenv("TWILIO_CALLS_BURST", rate))
+            bucket = _buckets[account_sid] = TokenBucket(rate, max(burst, 1))
+        return bucket
+
+
+def _status(error):
+    return getattr(error, "status", None)
+
+
+def is_transient(error):
+    """True if a failed create certainly placed no call, so dialing the same user again is safe.
+
+    That is throttling, an out-of-time create, 429/503 or a failed
+    connection. A 500, 502, 504 or a read timeout may have placed the call.
+    """
+    if isinstance(error, (Throttled, DeadlineExceeded)):
+        return True
+    status = _status(error)
+    if status is not None:
+        return status in CREATE_RETRY_STATUSES
+    import requests
+
+    return isinstance(error, requests.exceptions.ConnectionError)
+
+
+def _retryable(error, operation):
+    import requests
+
+    status = _status(error)
+    if status is not None:
+        return status in (CREATE_RETRY_STATUSES if operation == "create" else UPDATE_RETRY_STATUSES)
+    if operation == "create":
+        # A read timeout may mean the call was placed; only connection failures are retried
+        return isinstance(error, requests.exceptions.ConnectionError)
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class Gateway:
+    def __init__(self, account_sid, auth_token, client=None):
+        """client replaces the pooled twilio.rest.Client (e.g. the simulator's fake)."""
+        if client is None:
+            from requests.adapters import HTTPAdapter
+            from twilio.http.http_client import TwilioHttpClient
+            from twilio.rest import Client
+
+            http_client = TwilioHttpClient(pool_connections=True, timeout=REQUEST_TIMEOUT)
+            http_client.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+            client = Client(account_sid, auth_token, http_client=http_client)
+        self.client = client
+        self.account_sid = account_sid
+        self._bucket = bucket_for(account_sid)
+        self._counters = {}
+        self._counters_lock = threading.Lock()
+
+    def create_call(self, deadline=None, **kwargs):
+        """calls.create, paced by the account's call-creation bucket.
+
+        deadline (a time.monotonic() value) bounds the token wait and the
+        retries: no request is started that could still be running past it.
+        """
+        max_wait = MAX_THROTTLE_WAIT
+        if deadline is not None:
+            max_wait = min(max_wait, deadline - time.monotonic() - REQUEST_TIMEOUT)
+            if max_wait < 0:
+                self._count("create", errors=1)
+                raise DeadlineExceeded("No time left to place the call")
+        try:
+            waited = self._bucket.acquire(max_wait)
+        except Throttled:
+            self._count("create", errors=1)
+            raise
+        if waited:
+            self._count("create", throttled_seconds=waited)
+        return self._request("create", lambda: self.client.calls.create(**kwargs), deadline)
+
+    def update_call(self, call_sid, **kwargs):
+        """calls(call_sid).update, e.g. status="canceled" or new twiml."""
+        return self._request("update", lambda: self.client.calls(call_sid).update(**kwargs))
+
+    def stats(self):
+        """Counters per operation: requests, retries, errors, throttled_seconds, latency (total, max, mean)."""
+        with self._counters_lock:
+            snapshot = {op: dict(values) for op, values in self._counters.items()}
+        for values in snapshot.values():
+            values["latency_mean"] = values["latency_total"] / values["requests"] if values["requests"] else 0.0
+        return snapshot
+
+    def _count(self, operation, **increments):
+        with self._counters_lock:
+            values = self._counters.setdefault(operation, {
+                "requests": 0, "retries": 0, "errors": 0,
+                "throttled_seconds": 0.0, "latency_total": 0.0, "latency_max": 0.0,
+            })
+            for name, amount in increments.items():
+                if name == "latency_max":
+                    values[name] = max(values[name], amount)
+                else:
+                    values[name] += amount
+
+    def _request(self, operation, send, deadline=None):
+        for attempt in range(MAX_ATTEMPTS):
+            started = time.perf_counter()
+            metrics.count("twilio_requests")
+            try:
+                result = send()
+            except Exception as e:
+                self._timed(operation, started)
+                backoff = RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random())
+                out_of_time = deadline is not None and time.monotonic() + backoff + REQUEST_TIMEOUT > deadline
+                if attempt + 1 == MAX_ATTEMPTS or not _retryable(e, operation) or out_of_time:
+                    self._count(operation, errors=1)
+                    raise
+                self._count(operation, retries=1)
+                log.warning("TWILIO", "Request failed, retrying", operation=operation, attempt=attempt + 1, error=str(e))
+                time.sleep(backoff)
+            else:
+                self._timed(operation, started)
+                return result
+
+    def _timed(self, operation, started):
+        elapsed = time.perf_counter() - started
+        self._count(operation, requests=1, latency_total=elapsed, latency_max=elapsed)
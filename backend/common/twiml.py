@@ -0,0 +1,80 @@
+from urllib.parse import urlencode
+from common.config import FUNCTIONS_BASE_URL
+
+# Precompiled TwiML for the callee prompt path. Each template is the exact
+# output of twilio's VoiceResponse builder for the same verbs and attributes
+# (attributes sorted, same escaping as ElementTree), so only the escaped
+# parameters are substituted per request. benchmarks/bench_twiml.py checks the
+# output stays byte-identical to the builder.
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+ACCEPT_PROMPT = "Press 1 to accept the call."
+CALLEE_HOLD_MUSIC = "http://twimlets.com/holdmusic?Bucket=com.twilio.music.ambient"
+
+
+def escape_text(value):
+    return str(value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def escape_attr(value):
+    return (
+        str(value)
+        .replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+        .replace("\r", "&#13;")
+        .replace("\n", "&#10;")
+        .replace("\t", "&#09;")
+    )
+
+
+def function_url(name, **params):
+    """URL of another backend function with its query parameters encoded."""
+    return f"{FUNCTIONS_BASE_URL}/{name}?{urlencode(params)}"
+
+
+_SAY = XML_DECLARATION + "<Response><Say>{message}</Say></Response>"
+
+_SAY_REDIRECT = XML_DECLARATION + "<Response><Say>{message}</Say><Redirect>{url}</Redirect></Response>"
+
+_GATHER = (
+    XML_DECLARATION
+    + '<Response><Gather action="{action}" method="POST" numDigits="1">'
+    + "<Say>" + escape_text(ACCEPT_PROMPT) + "</Say>"
+    + "</Gather><Redirect>{redirect}</Redirect></Response>"
+)
+
+_JOIN_CONFERENCE = (
+    XML_DECLARATION
+    + "<Response><Say>{message}</Say><Dial>"
+    + '<Conference endConferenceOnExit="true" participantLabel="{label}" startConferenceOnEnter="true"'
+    + ' statusCallback="{status_callback}" statusCallbackEvent="start end join leave"'
+    + ' statusCallbackMethod="POST" waitUrl="' + escape_attr(CALLEE_HOLD_MUSIC) + '">'
+    + "{room}</Conference></Dial></Response>"
+)
+
+
+def say(message):
+    """<Say> then hang up. message must be non-empty (the builder renders <Say /> otherwise)."""
+    return _SAY.format(message=escape_text(message))
+
+
+def say_redirect(message, url):
+    return _SAY_REDIRECT.format(message=escape_text(message), url=escape_text(url))
+
+
+def gather_accept(action, redirect):
+    """Ask the callee to press 1; on no input, redirect (the next gather retry)."""
+    return _GATHER.format(action=escape_attr(action), redirect=escape_text(redirect))
+
+
+def join_conference(message, room, label, status_callback):
+    """<Say> then place the callee in the conference room, labelled with their user id."""
+    return _JOIN_CONFERENCE.format(
+        message=escape_text(message),
+        label=escape_attr(label),
+        status_callback=escape_attr(status_callback),
+        room=escape_text(room),
+    )
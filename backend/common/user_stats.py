@@ -0,0 +1,68 @@
+import time
+
+# Per-user pickup statistics, stored on accounts/{id}/users/{uid} under
+# "stats" and folded in one final leg status at a time by
+# caller_status_callback (no call history scans).
+
+DEFAULT_RING_TIMEOUT = 10  # Seconds, until we have seen the user answer
+MIN_RING_TIMEOUT = 5       # Twilio's minimum dial timeout
+MAX_RING_TIMEOUT = 30
+ANSWER_HEADROOM = 1.5      # Ring this many times the user's usual answer delay...
+ANSWER_PADDING = 3         # ...plus a few seconds
+VOICEMAIL_MARGIN = 1       # Hang up this long before voicemail usually picks up
+EWMA_WEIGHT = 0.3          # Weight of the newest sample
+NEUTRAL_ANSWER_RATE = 0.5  # Answer rate assumed before a user's first call
+
+
+def _ewma(previous, sample):
+    if previous is None:
+        return sample
+    return previous + EWMA_WEIGHT * (sample - previous)
+
+
+def ring_timeout(user):
+    """Seconds to ring this user, adapted to their past answer and voicemail delays."""
+    stats = user.get("stats") or {}
+    timeout = DEFAULT_RING_TIMEOUT
+    if stats.get("answer_ewma") is not None:
+        timeout = stats["answer_ewma"] * ANSWER_HEADROOM + ANSWER_PADDING
+    if stats.get("voicemail_ewma") is not None:
+        timeout = min(timeout, stats["voicemail_ewma"] - VOICEMAIL_MARGIN)
+    return int(round(min(max(timeout, MIN_RING_TIMEOUT), MAX_RING_TIMEOUT)))
+
+
+def answer_delay(dialed_at, call_duration, now=None):
+    """Seconds between placing a leg and it being answered, from its final callback.
+
+    Twilio reports CallDuration (seconds in progress) on the final status, so
+    the delay is the leg's lifetime minus that. Returns None if unknown.
+    """
+    if dialed_at is None or not call_duration:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, now - float(dialed_at) - float(call_duration))
+
+
+def record_leg(stats, call_status, delay, accepted, pressed=False, now=None):
+    """Return the user's stats with one finished leg folded in.
+
+    accepted is True when this leg pressed 1 and took the call; pressed when
+    it reached the key press without taking it (another user was first, a
+    wrong key, the caller had left). Either way a person picked up. A leg
+    that was answered but never pressed a key is counted as a voicemail
+    pickup. Legs we cancelled ourselves (caller left, ring group won
+    elsewhere) are not held against the user's answer rate or miss streak.
+    """
+    stats = dict(stats or {})
+    stats["last_called_at"] = int(time.time() if now is None else now)
+    picked_up = accepted or pressed
+    if delay is not None and call_status == "completed":
+        if picked_up:
+            stats["answer_ewma"] = round(_ewma(stats.get("answer_ewma"), delay), 2)
+        else:
+            stats["voicemail_ewma"] = round(_ewma(stats.get("voicemail_ewma"), delay), 2)
+
+    if call_status != "canceled" or picked_up:
+        stats["answer_rate"] = round(_ewma(stats.get("answer_rate", NEUTRAL_ANSWER_RATE), 1.0 if picked_up else 0.0), 3)
+        stats["missed_streak"] = 0 if picked_up else stats.get("missed_streak", 0) + 1
+    return stats
@@ -0,0 +1,41 @@
+from flask import jsonify
+from common import history, log, metrics
+from common.clients import db
+
+# Nightly job (Cloud Scheduler, see deployCompactCalls.sh): folds the
+# previous UTC day's calls into daily rollups before the TTL policy on
+# expire_at deletes the raw documents. ?date=YYYY-MM-DD recompacts another
+# day and ?account_id= limits the run to one account.
+
+@metrics.instrumented("compact_calls")
+def compact_calls(request):
+    day = request.args.get("date") or history.yesterday()
+    account_id = request.args.get("account_id")
+    try:
+        history.day_bounds(day)
+    except ValueError:
+        return jsonify({"error": f"Invalid date: {day}"}), 400
+
+    if account_id:
+        account_refs = [db.collection("accounts").document(account_id)]
+    else:
+        metrics.count("firestore_queries")
+        account_refs = [doc.reference for doc in db.collection("accounts").stream()]
+        metrics.count("firestore_reads", len(account_refs))
+
+    totals = {"accounts": 0, "calls": 0, "answered": 0, "failed": 0}
+    for account_ref in account_refs:
+        try:
+            rollup = history.compact_account(db, account_ref, day)
+        except Exception as e:
+            # One bad account must not stop the rest; its day is redone on a rerun
+            log.error("COMPACT", "Failed to compact account", account_id=account_ref.id, date=day, exc_info=e)
+            totals["failed"] += 1
+            continue
+        totals["accounts"] += 1
+        totals["calls"] += rollup["calls"]
+        totals["answered"] += rollup["answered"]
+        log.debug("COMPACT", "Account compacted", account_id=account_ref.id, date=day, calls=rollup["calls"])
+
+    log.info("COMPACT", "Daily rollups written", date=day, **totals)
+    return jsonify({"date": day, **totals}), 500 if totals["failed"] else 200
@@ -1,10 +1,11 @@
 from flask import request, Response
-from google.cloud import firestore
-import requests
-import os
+from common import accounts, analytics, call_queue, dedupe, dispatch, log, metrics, store
+from common import roster as rosters
+from common.clients import db, twilio as client
 
-db = firestore.Client()
+ACTIONABLE_EVENTS = {"participant-join", "participant-leave", "conference-end"}
 
+@metrics.instrumented("conference_callback")
 def conference_callback(request):
     event = request.form.get("StatusCallbackEvent")
     room = request.form.get("FriendlyName")  # e.g., conf-CAxxxx
@@ -13,62 +14,74 @@ def conference_callback(request):
     participant_label = request.form.get("ParticipantLabel") or request.form.get("Label")
     user_id = request.args.get("user_id")  # fallback (usually not available in callback)
 
-    print(f"[CONF-CALLBACK] Event: {event}")
-    print(f"[CONF-CALLBACK] Room: {room}")
-    print(f"[CONF-CALLBACK] call_sid: {call_sid}")
-    print(f"[CONF-CALLBACK] account_id: {account_id}")
-    print(f"[CONF-CALLBACK] participant_label (user_id): {participant_label}")
-    print(f"[CONF-CALLBACK] fallback user_id: {user_id}")
+    log.info(
+        "CONF-CALLBACK", "Conference event",
+        event=event, room=room, participant_label=participant_label, user_id=user_id
+    )
 
     if not account_id or not call_sid:
-        print("[CONF-CALLBACK] Missing account_id or call_sid")
+        log.warning("CONF-CALLBACK", "Missing account_id or call_sid")
         return Response("Missing account_id or call_sid", status=400)
 
+    # 🔁 Drop events that need no work, and Twilio retries, before any Firestore I/O
+    if event not in ACTIONABLE_EVENTS or (event == "participant-leave" and not participant_label):
+        log.debug("CONF-CALLBACK", "Ignored event", event=event)
+        return Response("OK", status=200)
+    event_key = dedupe.conference_event_key(request.form)
+    if dedupe.is_duplicate(event_key, db):
+        log.info("CONF-CALLBACK", "Duplicate event, skipping", event_key=event_key)
+        return Response("OK", status=200)
+
     try:
         account_ref = db.collection("accounts").document(account_id)
         call_ref = account_ref.collection("calls").document(call_sid)
 
         if event == "participant-join":
             if participant_label:
-                print(f"[CONF-CALLBACK] Callee {participant_label} joined. Setting callee_joined = True")
-                if call_ref.get().exists:
-                    call_ref.update({"callee_joined": True})
+                log.info("CONF-CALLBACK", "Callee joined. Setting callee_joined = True", user_id=participant_label)
+                store.update_if_exists(call_ref, {"callee_joined": True})
             else:
-                print(f"[CONF-CALLBACK] Caller joined. Marking call {call_sid} as connected.")
-                if call_ref.get().exists:
-                    call_ref.update({"status": "connected"})
-
+                log.info("CONF-CALLBACK", "Caller joined. Marking call as connected.")
+                if store.update_if_exists(call_ref, {"status": "connected"}):
+                    analytics.record(db, account_ref, {"calls": 1})
                     try:
-                        print("[CONF-CALLBACK] Triggering handle_call function")
-                        requests.post(
-                            "https://us-central1-roundrobin-clean.cloudfunctions.net/handle_call",
-                            data={
+                        dispatched = dispatch.dispatch(
+                            "handle_call",
+                            {
                                 "CallSid": call_sid,
-                                "To": account_ref.get().to_dict().get("twilio_number")
+                                "To": accounts.get_by_id(db, account_id).get("twilio_number")
                             },
-                            timeout=10
+                            key=f"handle_call-{call_sid}"
                         )
+                        if not dispatched:
+                            log.error("CONF-CALLBACK", "Failed to dispatch handle_call")
                     except Exception as trigger_err:
-                        print(f"[CONF-CALLBACK] Failed to trigger handle_call: {trigger_err}")
+                        log.error("CONF-CALLBACK", "Failed to trigger handle_call", error=str(trigger_err))
 
         elif event == "participant-leave" and participant_label:
             user_ref = account_ref.collection("users").document(participant_label)
-            if user_ref.get().exists:
-                print(f"[CONF-CALLBACK] User {participant_label} left. Marking available.")
-                user_ref.update({"status": "available"})
+            if store.update_if_exists(user_ref, {"status": "available"}):
+                log.info("CONF-CALLBACK", "User left. Marked available.", user_id=participant_label)
+                rosters.note_status(account_id, participant_label, "available")
+                account_data = accounts.data_by_id(db, account_id)
+                if call_queue.is_queue_mode(account_data):
+                    # 📥 The user is free: offer them to the next waiting caller
+                    with metrics.phase("queue"):
+                        call_queue.user_free(db, client, account_ref, account_data, participant_label)
             else:
-                print(f"[CONF-CALLBACK] User {participant_label} not found.")
+                log.warning("CONF-CALLBACK", "User not found", user_id=participant_label)
 
         elif event == "conference-end":
-            print(f"[CONF-CALLBACK] Conference ended. Marking call {call_sid} as caller_left.")
-            if call_ref.get().exists:
-                call_ref.update({"status": "caller_left"})
-
-        else:
-            print(f"[CONF-CALLBACK] Ignored event: {event}")
+            log.info("CONF-CALLBACK", "Conference ended. Marking call as caller_left.")
+            store.update_if_exists(call_ref, {"status": "caller_left"})
+            account_data = accounts.data_by_id(db, account_id)
+            if call_queue.is_queue_mode(account_data):
+                with metrics.phase("queue"):
+                    call_queue.remove(db, client, account_ref, account_data, call_sid)
 
     except Exception as e:
-        print(f"[CONF-CALLBACK ERROR] {e}")
+        log.error("CONF-CALLBACK", "conference_callback failed", exc_info=e)
+        dedupe.forget(event_key, db)
 
     return Response("OK", status=200)
 
@@ -0,0 +1,20 @@
+#!/bin/bash
+
+# Optional: Set project (only if you need to switch projects)
+# gcloud config set project roundrobin-clean
+
+# Bundle shared backend code into the function source
+rm -rf call_analytics/common && cp -r common call_analytics/common
+
+# Deploy call_analytics (public URL; callers must send an account admin's Firebase ID token)
+gcloud functions deploy call_analytics \
+  --project="roundrobin-clean" \
+  --region="us-central1" \
+  --runtime python310 \
+  --trigger-http \
+  --entry-point call_analytics \
+  --source=call_analytics \
+  --allow-unauthenticated \
+  --timeout=60s \
+  --memory=256MB \
+  --env-vars-file .env.yaml
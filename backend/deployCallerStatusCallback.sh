@@ -0,0 +1,22 @@
+#!/bin/bash
+
+# Optional: Set project (only if you need to switch projects)
+# gcloud config set project roundrobin-clean
+
+# Bundle shared backend code into the function source
+rm -rf caller_status_callback/common && cp -r common caller_status_callback/common
+
+# Deploy caller_status_callback
+gcloud functions deploy caller_status_callback \
+  --project="roundrobin-clean" \
+  --region="us-central1" \
+  --runtime python310 \
+  --trigger-http \
+  --entry-point caller_status_callback \
+  --source=caller_status_callback \
+  --allow-unauthenticated \
+  --timeout=60s \
+  --memory=256MB \
+  --env-vars-file .env.yaml
+
+
@@ -0,0 +1,31 @@
+#!/bin/bash
+
+# Optional: Set project (only if you need to switch projects)
+# gcloud config set project roundrobin-clean
+
+# Bundle shared backend code into the function source
+rm -rf compact_calls/common && cp -r common compact_calls/common
+
+# Deploy compact_calls (not public: only the scheduler job below may invoke it)
+gcloud functions deploy compact_calls \
+  --project="roundrobin-clean" \
+  --region="us-central1" \
+  --runtime python310 \
+  --trigger-http \
+  --entry-point compact_calls \
+  --source=compact_calls \
+  --no-allow-unauthenticated \
+  --timeout=540s \
+  --memory=256MB \
+  --env-vars-file .env.yaml
+
+# Run it every night at 02:00 UTC. Create the job once; the service account
+# needs roles/cloudfunctions.invoker on compact_calls.
+# gcloud scheduler jobs create http compact-calls-nightly \
+#   --project="roundrobin-clean" \
+#   --location="us-central1" \
+#   --schedule="0 2 * * *" \
+#   --time-zone="Etc/UTC" \
+#   --uri="https://us-central1-roundrobin-clean.cloudfunctions.net/compact_calls" \
+#   --http-method=POST \
+#   --oidc-service-account-email="roundrobin-clean@appspot.gserviceaccount.com"
@@ -0,0 +1,22 @@
+#!/bin/bash
+
+# Optional: Set project (only if you need to switch projects)
+# gcloud config set project roundrobin-clean
+
+# Bundle shared backend code into the function source
+rm -rf conference_callback/common && cp -r common conference_callback/common
+
+# Deploy conference_callback
+gcloud functions deploy conference_callback \
+  --project="roundrobin-clean" \
+  --region="us-central1" \
+  --runtime python310 \
+  --trigger-http \
+  --entry-point conference_callback \
+  --source=conference_callback \
+  --allow-unauthenticated \
+  --timeout=60s \
+  --memory=256MB \
+  --env-vars-file .env.yaml
+
+
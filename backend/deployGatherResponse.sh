@@ -0,0 +1,22 @@
+#!/bin/bash
+
+# Optional: Set project (only if you need to switch projects)
+# gcloud config set project roundrobin-clean
+
+# Bundle shared backend code into the function source
+rm -rf gather_response/common && cp -r common gather_response/common
+
+# Deploy gather_response
+gcloud functions deploy gather_response \
+  --project="roundrobin-clean" \
+  --region="us-central1" \
+  --runtime python310 \
+  --trigger-http \
+  --entry-point gather_response \
+  --source=gather_response \
+  --allow-unauthenticated \
+  --timeout=60s \
+  --memory=256MB \
+  --env-vars-file .env.yaml
+
+
@@ -3,6 +3,9 @@
 # Optional: Set project (only if you need to switch projects)
 # gcloud config set project roundrobin-clean
 
+# Bundle shared backend code into the function source
+rm -rf handle_call/common && cp -r common handle_call/common
+
 # Deploy handle_call
 gcloud functions deploy handle_call \
   --project="roundrobin-clean" \
@@ -0,0 +1,22 @@
+#!/bin/bash
+
+# Optional: Set project (only if you need to switch projects)
+# gcloud config set project roundrobin-clean
+
+# Bundle shared backend code into the function source
+rm -rf join_conference/common && cp -r common join_conference/common
+
+# Deploy join_conference
+gcloud functions deploy join_conference \
+  --project="roundrobin-clean" \
+  --region="us-central1" \
+  --runtime python310 \
+  --trigger-http \
+  --entry-point join_conference \
+  --source=join_conference \
+  --allow-unauthenticated \
+  --timeout=60s \
+  --memory=256MB \
+  --env-vars-file .env.yaml
+
+
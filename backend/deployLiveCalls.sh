@@ -0,0 +1,26 @@
+#!/bin/bash
+
+# Optional: Set project (only if you need to switch projects)
+# gcloud config set project roundrobin-clean
+
+# Bundle shared backend code into the function source
+rm -rf live_calls/common && cp -r common live_calls/common
+
+# Deploy live_calls (public URL; callers must pass an account admin's Firebase ID token).
+# Streams are long-lived: gen2 with high concurrency keeps an account's dashboards
+# on one instance, sharing its listeners; the timeout caps a stream's length.
+# Keep --concurrency above live_state.MAX_CLIENTS (one account's streams per instance).
+gcloud functions deploy live_calls \
+  --project="roundrobin-clean" \
+  --region="us-central1" \
+  --runtime python310 \
+  --gen2 \
+  --concurrency=250 \
+  --cpu=1 \
+  --trigger-http \
+  --entry-point live_calls \
+  --source=live_calls \
+  --allow-unauthenticated \
+  --timeout=3600s \
+  --memory=512MB \
+  --env-vars-file .env.yaml
@@ -3,6 +3,9 @@
 # Optional: Set project (only if you need to switch projects)
 # gcloud config set project roundrobin-clean
 
+# Bundle shared backend code into the function source
+rm -rf process_response/common && cp -r common process_response/common
+
 # Deploy process_response
 gcloud functions deploy process_response \
   --project="roundrobin-clean" \
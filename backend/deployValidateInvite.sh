@@ -0,0 +1,20 @@
+#!/bin/bash
+
+# Optional: Set project (only if you need to switch projects)
+# gcloud config set project roundrobin-clean
+
+# Bundle shared backend code into the function source
+rm -rf validate_invite/common && cp -r common validate_invite/common
+
+# Deploy validate_invite (public URL; the invite page posts the token)
+gcloud functions deploy validate_invite \
+  --project="roundrobin-clean" \
+  --region="us-central1" \
+  --runtime python310 \
+  --trigger-http \
+  --entry-point validate_invite \
+  --source=validate_invite \
+  --allow-unauthenticated \
+  --timeout=60s \
+  --memory=256MB \
+  --env-vars-file .env.yaml
@@ -0,0 +1,20 @@
+#!/bin/bash
+
+# Optional: Set project (only if you need to switch projects)
+# gcloud config set project roundrobin-clean
+
+# Deploy every webhook as one function (main.py:router), served at
+# .../webhooks/<handler name>. .env.webhooks.yaml must also set
+# FUNCTIONS_BASE_URL to https://us-central1-roundrobin-clean.cloudfunctions.net/webhooks
+# so the callback URLs the handlers hand to Twilio point back at the router.
+gcloud functions deploy webhooks \
+  --project="roundrobin-clean" \
+  --region="us-central1" \
+  --runtime python310 \
+  --trigger-http \
+  --entry-point router \
+  --source=. \
+  --allow-unauthenticated \
+  --timeout=60s \
+  --memory=512MB \
+  --env-vars-file .env.webhooks.yaml
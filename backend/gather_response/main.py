@@ -1,48 +1,41 @@
 from flask import Response, request
-from twilio.twiml.voice_response import VoiceResponse, Gather
-import logging
-
-logging.basicConfig(level=logging.INFO)
+from common import call_token, log, metrics, twiml
 
 MAX_RETRIES = 2  # You can increase this if needed
 
+@metrics.instrumented("gather_response")
 def gather_response(request):
-    room = request.args.get("room", "").strip()
-    user_id = request.args.get("user_id", "").strip()
-    account_id = request.args.get("account_id", "").strip()
+    ctx = request.args.get("ctx", "").strip()
     retry_count = int(request.args.get("retry", 0))
 
-    logging.info(f"[GATHER] room: {room}")
-    logging.info(f"[GATHER] user_id: {user_id}")
-    logging.info(f"[GATHER] account_id: {account_id}")
-    logging.info(f"[GATHER] retry: {retry_count}")
-
-    response = VoiceResponse()
+    # 🔏 A signed call context replaces the plain room/user/account parameters
+    if ctx:
+        context = call_token.verify(ctx)
+        if context is None:
+            log.warning("GATHER", "Invalid or expired call context. Ending call.")
+            return Response(twiml.say("This call can no longer be accepted. Goodbye."), mimetype="application/xml")
+        room, user_id, account_id = context["room"], context["user_id"], context["account_id"]
+        params = {"ctx": ctx}
+    else:
+        room = request.args.get("room", "").strip()
+        user_id = request.args.get("user_id", "").strip()
+        account_id = request.args.get("account_id", "").strip()
+        params = {"room": room, "user_id": user_id, "account_id": account_id}
+
+    metrics.annotate(account_id=account_id)
+    log.info("GATHER", "Prompting callee", room=room, user_id=user_id, retry=retry_count)
 
     if not all([room, user_id, account_id]):
-        logging.warning("[GATHER] Missing parameters. Ending call.")
-        response.say("Missing required information. Goodbye.")
-        return Response(str(response), mimetype="application/xml")
+        log.warning("GATHER", "Missing parameters. Ending call.")
+        return Response(twiml.say("Missing required information. Goodbye."), mimetype="application/xml")
 
     if retry_count >= MAX_RETRIES:
-        logging.info("[GATHER] Max retries reached. Ending call.")
-        response.say("Too many failed attempts. Goodbye.")
-        return Response(str(response), mimetype="application/xml")
+        log.info("GATHER", "Max retries reached. Ending call.")
+        return Response(twiml.say("Too many failed attempts. Goodbye."), mimetype="application/xml")
 
     next_retry = retry_count + 1
-    retry_url = (
-        f"https://us-central1-roundrobin-clean.cloudfunctions.net/gather_response"
-        f"?room={room}&user_id={user_id}&account_id={account_id}&retry={next_retry}"
+    retry_url = twiml.function_url("gather_response", **params, retry=next_retry)
+    action_url = twiml.function_url(
+        "process_response", **params, retry=retry_count  # 👈 carry over current retry
     )
-
-    gather = Gather(
-        num_digits=1,
-        action=f"https://us-central1-roundrobin-clean.cloudfunctions.net/process_response"
-               f"?room={room}&user_id={user_id}&account_id={account_id}&retry={retry_count}",  # 👈 carry over current retry
-        method="POST"
-    )
-    gather.say("Press 1 to accept the call.")
-    response.append(gather)
-
-    response.redirect(retry_url)
-    return Response(str(response), mimetype="application/xml")
+    return Response(twiml.gather_accept(action_url, retry_url), mimetype="application/xml")
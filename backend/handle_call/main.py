@@ -1,148 +1,222 @@
 from flask import jsonify, request
-from twilio.rest import Client
-from twilio.twiml.voice_response import VoiceResponse, Say
 from google.cloud import firestore
-import os
+from common import accounts, analytics, call_queue, history, log, metrics, outbound, round_robin, routing, store, twilio_gateway, user_stats
+from common import roster as rosters
+from common.clients import db, twilio as client
 import time
 
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-db = firestore.Client()
-
 WAIT_FOR_CALLER_TIMEOUT = 20  # Seconds to wait for caller to join
+LEG_STATUS_GRACE = 2  # Extra seconds for Twilio's no-answer callback after the ring timeout
 
+@metrics.instrumented("handle_call")
 def handle_call(request):
+    started = time.monotonic()
     try:
         data = request.form
         call_sid = data.get("CallSid")
         twilio_number = data.get("To")
+        chunk = int(data.get("Chunk", 0))  # > 0 when resuming from a checkpoint
+        wave = data.get("Wave")  # "round:index" of an event-mode wave to check on
 
         if not call_sid or not twilio_number:
             return jsonify({"error": "Missing CallSid or To"}), 400
 
         room_name = f"conf-{call_sid}"
-        print(f"[HANDLE CALL] Starting call {call_sid}, room: {room_name}")
+        log.info("HANDLE CALL", "Starting call", room=room_name, chunk=chunk)
 
-        accounts = db.collection("accounts").where("twilio_number", "==", twilio_number).get()
-        if not accounts:
-            print("[HANDLE CALL] No account found for number:", twilio_number)
+        with metrics.phase("account_lookup"):
+            account_doc = accounts.get_by_number(db, twilio_number)
+        if account_doc is None:
+            log.error("HANDLE CALL", "No account found for number", twilio_number=twilio_number)
             return jsonify({"error": "Account not found"}), 404
 
-        account_doc = accounts[0]
         account_ref = account_doc.reference
         account_id = account_ref.id
+        metrics.annotate(account_id=account_id)
         account_twilio_number = account_doc.get("twilio_number")
 
+        if wave:
+            # ⏰ An event-mode wave's legs should all be over by now (round_robin.watch_wave)
+            rr_round, rr_index = (int(part) for part in wave.split(":"))
+            with metrics.phase("check_wave"):
+                stalled = round_robin.check_wave(
+                    db, client, account_ref, call_sid, rr_round, rr_index, started + round_robin.CHUNK_DEADLINE
+                )
+            return jsonify({"message": "Wave moved on" if stalled else "Wave already over"}), 200
+
         max_retries = account_doc.to_dict().get("max_retries", 3)  # 🔁 Firestore-controlled retries
-        print(f"[HANDLE CALL] max_retries: {max_retries}")
+        group_size = round_robin.get_group_size(account_doc.to_dict())  # 🔔 users rung at once
+        log.debug("HANDLE CALL", "Account settings", max_retries=max_retries, group_size=group_size)
 
         if not account_twilio_number:
-            print("[HANDLE CALL] Twilio number missing in account.")
+            log.error("HANDLE CALL", "Twilio number missing in account")
             return jsonify({"error": "Twilio number not configured for account"}), 500
 
         call_ref = account_ref.collection("calls").document(call_sid)
-        if not call_ref.get().exists:
-            call_ref.set({
-                "status": "waiting",
-                "timestamp": firestore.SERVER_TIMESTAMP,
-                "callee_joined": False
-            })
-            print(f"[HANDLE CALL] Created call document with status 'waiting'")
-        else:
-            print(f"[HANDLE CALL] Call document already exists, not overwriting")
-
-        print("[WAIT] Waiting for caller to join...")
-        for _ in range(WAIT_FOR_CALLER_TIMEOUT):
-            call_doc = call_ref.get()
-            if call_doc.exists and call_doc.to_dict().get("status") == "connected":
-                print("[JOINED] Caller is connected. Starting round robin.")
-                break
-            time.sleep(1)
-        else:
-            print("[TIMEOUT] Caller did not join conference.")
-            return jsonify({"message": "Caller did not join"}), 200
-
-        users_ref = account_ref.collection("users").order_by("order").stream()
-        users = [{"id": doc.id, **doc.to_dict()} for doc in users_ref]
-        if not users:
-            print("[HANDLE CALL] No users found for account:", account_id)
+        created = store.create_if_missing(call_ref, {
+            "status": "waiting",
+            "timestamp": firestore.SERVER_TIMESTAMP,
+            "expire_at": history.expire_at(),
+            "callee_joined": False
+        })
+        log.debug("HANDLE CALL", "Call document created" if created else "Call document already exists, not overwriting")
+
+        # 🧭 Dialing order for this call, from the account's routing strategy
+        with metrics.phase("roster_load"):
+            roster = rosters.get(account_ref)
+            user_ids = [user["id"] for user in routing.order_users(roster.users(), account_doc.to_dict())]
+        if not user_ids:
+            log.error("HANDLE CALL", "No users found for account")
             return jsonify({"error": "No users found"}), 404
 
-        for attempt in range(max_retries):
-            print(f"[ROUND {attempt + 1}] Starting user call attempts...")
-            for user in users:
-                user_id = user["id"]
-                number = user["phone_number"]
-
-                call_doc = call_ref.get()
-                call_data = call_doc.to_dict() if call_doc.exists else {}
-
-                if call_data.get("status") == "caller_left":
-                    print("[STOP] Caller already left. Canceling all pending outbound calls.")
-                    for doc in call_ref.collection("outbound").stream():
-                        try:
-                            client.calls(doc.id).update(status="canceled")
-                        except Exception as ce:
-                            print(f"[HANDLE CALL] Failed to cancel {doc.id}: {ce}")
-                    return jsonify({"message": "Caller ended"}), 200
-
-                if call_data.get("callee_joined"):
-                    print("[STOP] A user has joined. Ending round robin.")
-                    return jsonify({"message": "User joined"}), 200
-
-                if user.get("status") == "in_conference":
-                    print(f"[SKIP] {number} is already in a conference")
-                    continue
-
-                print(f"[CALLING] Trying {number}")
-                try:
-                    call = client.calls.create(
-                        to=number,
-                        from_=account_twilio_number,
-                        url=f"https://us-central1-roundrobin-clean.cloudfunctions.net/gather_response?room={room_name}&user_id={user_id}&account_id={account_id}",
-                        status_callback=f"https://us-central1-roundrobin-clean.cloudfunctions.net/caller_status_callback?user_id={user_id}&account_id={account_id}&call_sid={call_sid}",
-                        status_callback_event=["initiated", "ringing", "answered", "completed"],
-                        status_callback_method="POST"
-                    )
-                    call_ref.collection("outbound").document(call.sid).set({
-                        "to": number,
-                        "user_id": user_id,
-                        "status": "initiated"
-                    })
-                except Exception as call_error:
-                    print(f"[ERROR] Failed to call {number}: {call_error}")
-                    continue
-
-                for _ in range(10):
+        if call_queue.is_queue_mode(account_doc.to_dict()):
+            # 📥 ACD: join the account's caller queue; free users are offered to callers in arrival order
+            with metrics.phase("queue"):
+                call_queue.enqueue(db, account_ref, call_sid, account_twilio_number)
+                call_queue.assign(db, client, account_ref, account_doc.to_dict())
+            return jsonify({"message": "Caller queued"}), 200
+
+        if round_robin.get_mode(account_doc.to_dict()) == round_robin.EVENT_MODE:
+            log.debug("WAIT", "Waiting for caller to join (listener)")
+            with metrics.phase("wait_for_caller"):
+                connected = round_robin.wait_for_call(
+                    call_ref,
+                    lambda data: data.get("status") == "connected",
+                    WAIT_FOR_CALLER_TIMEOUT
+                )
+            if not connected:
+                log.warning("TIMEOUT", "Caller did not join conference")
+                return jsonify({"message": "Caller did not join"}), 200
+
+            # ⚡ Dial the first wave and return; caller_status_callback advances the cursor
+            with metrics.phase("dial"):
+                round_robin.start(
+                    db, client, account_ref, call_sid, account_twilio_number, max_retries, group_size, user_ids,
+                    started + round_robin.CHUNK_DEADLINE
+                )
+            return jsonify({"message": "Round robin started"}), 200
+
+        if chunk == 0:
+            log.debug("WAIT", "Waiting for caller to join")
+            with metrics.phase("wait_for_caller"):
+                for _ in range(WAIT_FOR_CALLER_TIMEOUT):
+                    call_doc = call_ref.get()
+                    metrics.count("firestore_reads")
+                    if call_doc.exists and call_doc.to_dict().get("status") == "connected":
+                        log.info("JOINED", "Caller is connected. Starting round robin.")
+                        break
+                    time.sleep(1)
+                else:
+                    log.warning("TIMEOUT", "Caller did not join conference")
+                    return jsonify({"message": "Caller did not join"}), 200
+
+        # 📌 Claim this chunk of the round robin; the cursor on the call doc is the checkpoint
+        cursor = round_robin.claim_chunk(
+            db, call_ref, chunk, account_twilio_number, max_retries, group_size, user_ids
+        )
+        if cursor is None:
+            log.info("HANDLE CALL", "Chunk already claimed or round robin finished", chunk=chunk)
+            return jsonify({"message": "Round robin already running"}), 200
+        max_retries = cursor["max_retries"]
+        rr_round, rr_index = cursor["round"], cursor["index"]
+        redials = cursor.get("redials", 0)
+        log.info("HANDLE CALL", "Chunk resuming", chunk=chunk, rr_round=rr_round, rr_index=rr_index)
+
+        users = round_robin.call_users(roster, cursor)
+
+        while True:
+            wave = round_robin.next_wave(
+                users, rr_round, rr_index, max_retries, roster.can_dial, cursor.get("group_size", 1)
+            )
+            if not wave:
+                break
+
+            # ⏱️ Hand the rest of the roster to a fresh invocation before we hit the function timeout
+            wave_wait = max(user_stats.ring_timeout(users[index]) for _, index in wave) + LEG_STATUS_GRACE
+            if time.monotonic() - started + wave_wait > round_robin.CHUNK_BUDGET:
+                log.info("HANDLE CALL", "Chunk budget spent. Continuing in the next chunk.", chunk=chunk + 1)
+                round_robin.dispatch_chunk(call_sid, twilio_number, chunk + 1)
+                return jsonify({"message": "Round robin continued"}), 200
+
+            call_doc = call_ref.get()
+            metrics.count("firestore_reads")
+            call_data = call_doc.to_dict() if call_doc.exists else {}
+
+            if call_data.get("status") == "caller_left":
+                log.info("STOP", "Caller already left. Canceling all pending outbound calls.")
+                outbound.cancel_legs(client, call_ref)
+                return jsonify({"message": "Caller ended"}), 200
+
+            if call_data.get("callee_joined") or call_data.get("answered_by"):
+                log.info("STOP", "A user has joined. Ending round robin.")
+                return jsonify({"message": "User joined"}), 200
+
+            # 📞 Ring every user in the wave at once (a wave of one is the classic round robin)
+            dialed = []
+            dialed_users = []
+            # Creates must leave room for the ring wait before the function timeout
+            dial_deadline = started + round_robin.CHUNK_DEADLINE - wave_wait
+            with metrics.phase("dial"), store.Batch(db) as batch:
+                for position in wave:
+                    user = users[position[1]]
+                    number = user["phone_number"]
+                    log.info("CALLING", "Trying user", user_id=user["id"], rr_round=position[0], rr_index=position[1])
+                    try:
+                        call = round_robin.dial_user(
+                            client, account_id, call_sid, account_twilio_number, user,
+                            ring_group=cursor.get("group_size", 1) > 1, deadline=dial_deadline
+                        )
+                    except Exception as call_error:
+                        if twilio_gateway.is_transient(call_error) and redials < round_robin.MAX_REDIALS:
+                            # No call was placed (throttled, Twilio unavailable, out of time): this user leads the next wave
+                            redials += 1
+                            log.warning("RETRY", "Could not call user yet", user_id=user["id"], redials=redials, error=str(call_error))
+                            break
+                        log.error("CALLING", "Failed to call user", user_id=user["id"], error=str(call_error))
+                    else:
+                        batch.set(call_ref.collection("outbound").document(call.sid), {
+                            "to": number,
+                            "user_id": user["id"],
+                            "status": "initiated",
+                            "expire_at": history.expire_at()
+                        }, merge=True)
+                        dialed.append(call.sid)
+                        dialed_users.append(user["id"])
+                    rr_round, rr_index = position
+                    redials = 0
+                # Outbound legs, the cursor checkpoint and the analytics counters commit together
+                round_robin.checkpoint(call_ref, rr_round, rr_index, dialed, batch, redials)
+                analytics.record(db, account_ref, analytics.dial_counters(dialed_users), batch)
+            if not dialed:
+                continue
+
+            with metrics.phase("wait"):
+                for _ in range(wave_wait):
                     call_doc = call_ref.get()
+                    metrics.count("firestore_reads")
                     call_data = call_doc.to_dict() if call_doc.exists else {}
+                    finished = set((call_data.get("cursor") or {}).get("finished_sids", []))
+                    if finished.issuperset(dialed):
+                        log.debug("NEXT", "Every leg in the wave reached a final status. Moving on.")
+                        break
                     if call_data.get("status") == "caller_left":
-                        print("[STOP] Caller left during wait. Canceling remaining calls.")
-                        for doc in call_ref.collection("outbound").stream():
-                            try:
-                                client.calls(doc.id).update(status="canceled")
-                            except Exception as ce:
-                                print(f"[HANDLE CALL] Failed to cancel {doc.id}: {ce}")
+                        log.info("STOP", "Caller left during wait. Canceling remaining calls.")
+                        outbound.cancel_legs(client, call_ref)
                         return jsonify({"message": "Caller ended during wait"}), 200
-                    if call_data.get("callee_joined"):
-                        print("[STOP] Conference joined during wait. Stopping further attempts.")
+                    if call_data.get("callee_joined") or call_data.get("answered_by"):
+                        log.info("STOP", "Conference joined during wait. Stopping further attempts.")
                         return jsonify({"message": "User joined"}), 200
                     time.sleep(1)
 
-        print("[COMPLETE] No users connected after max retries.")
+        log.info("COMPLETE", "No users connected after max retries")
+        call_ref.update({"cursor.done": True})
+        metrics.count("firestore_writes")
+        analytics.record(db, account_ref, {"exhausted": 1})
         # 🗣️ Final message to the caller before disconnecting
-        try:
-            twiml = VoiceResponse()
-            twiml.say("Sorry, no one was available to take your call. Goodbye.")
-            client.calls(call_sid).update(twiml=str(twiml))
-            print("[HANDLE CALL] Sent goodbye message to caller.")
-        except Exception as final_err:
-            print(f"[HANDLE CALL] Failed to update caller TwiML: {final_err}")
+        round_robin.say_goodbye(client, call_sid)
 
         return jsonify({"message": "No users connected"}), 200
 
     except Exception as e:
-        print(f"[ERROR] handle_call: {e}")
+        log.error("HANDLE CALL", "handle_call failed", exc_info=e)
         return jsonify({"error": str(e)}), 500
@@ -1,11 +1,10 @@
 from flask import request, Response
 from twilio.twiml.voice_response import VoiceResponse, Dial
 from google.cloud import firestore
-import logging
-
-db = firestore.Client()
-logging.basicConfig(level=logging.INFO)
+from common import accounts, history, log, metrics, twiml
+from common.clients import db
 
+@metrics.instrumented("join_conference")
 def join_conference(request):
     try:
         call_sid = request.form.get("CallSid")
@@ -14,28 +13,31 @@ def join_conference(request):
         response = VoiceResponse()
 
         if not call_sid or not twilio_number:
-            logging.error("[JOIN] Missing CallSid or To")
+            log.warning("JOIN", "Missing CallSid or To")
             response.say("Missing required information. Goodbye.")
             return Response(str(response), mimetype="application/xml")
 
         room_name = f"conf-{call_sid}"
-        logging.info(f"[JOIN] Placing caller {call_sid} into conference room: {room_name}")
+        log.info("JOIN", "Placing caller into conference room", room=room_name)
 
         # 🔍 Lookup account based on Twilio number
-        account_query = db.collection("accounts").where("twilio_number", "==", twilio_number).get()
-        if not account_query:
-            logging.error(f"[JOIN] No account found for number: {twilio_number}")
+        with metrics.phase("account_lookup"):
+            account_doc = accounts.get_by_number(db, twilio_number)
+        if account_doc is None:
+            log.error("JOIN", "No account found for number", twilio_number=twilio_number)
             response.say("Account not found. Goodbye.")
             return Response(str(response), mimetype="application/xml")
 
-        account_id = account_query[0].id
+        account_id = account_doc.id
 
         # Pre-create call document so callbacks don't fail
         call_doc_ref = db.collection("accounts").document(account_id).collection("calls").document(call_sid)
         call_doc_ref.set({
             "status": "initiated",
-            "timestamp": firestore.SERVER_TIMESTAMP
+            "timestamp": firestore.SERVER_TIMESTAMP,
+            "expire_at": history.expire_at()
         })
+        metrics.count("firestore_writes")
 
 
         # ✅ Create <Dial><Conference> with proper statusCallbackEvent format
@@ -44,7 +46,7 @@ def join_conference(request):
             room_name,
             start_conference_on_enter=True,
             end_conference_on_exit=True,
-            status_callback=f"https://us-central1-roundrobin-clean.cloudfunctions.net/conference_callback?call_sid={call_sid}&account_id={account_id}",
+            status_callback=twiml.function_url("conference_callback", call_sid=call_sid, account_id=account_id),
             status_callback_event="start end join leave",  # ✅ CORRECT FORMAT
             status_callback_method="POST",
             wait_url="http://twimlets.com/holdmusic?Bucket=com.twilio.music.electronica"
@@ -55,7 +57,7 @@ def join_conference(request):
         return Response(str(response), mimetype="application/xml")
 
     except Exception as e:
-        logging.error(f"[ERROR] join_conference: {e}")
+        log.error("JOIN", "join_conference failed", exc_info=e)
         return Response("<Response><Say>Error. Goodbye.</Say></Response>", mimetype="application/xml")
 
 
@@ -0,0 +1,88 @@
+from flask import Response, jsonify, make_response, stream_with_context
+from common import admin_auth, live_state, log, metrics
+from common.clients import db
+import time
+
+# Live call and user state for the admin panel, as Server-Sent Events:
+#
+#   POST ?account_id=...   Authorization: Bearer <ID token>  -> {"ticket"}
+#   GET  ?account_id=...&ticket=...                          -> the stream
+#
+# EventSource cannot send headers, so the panel first trades its ID token for
+# a single-use ticket that expires in seconds (common/admin_auth.py), and only
+# that goes in the URL.
+#
+# The stream opens with a "snapshot" event ({users, calls, queue}) and then
+# carries "delta" events holding only the fields that changed, at most one
+# per LIVE_UPDATE_INTERVAL. Every dashboard on an instance shares the
+# account's listeners (common/live_state.py), so Firestore reads do not grow
+# with the number of dashboards. Deploy with high concurrency so they do
+# land on the same instance (deployLiveCalls.sh).
+#
+# Streams end after MAX_STREAM_SECONDS, before the function timeout. The
+# ticket is spent by then, so the browser's own reconnect is refused: on
+# "error" the panel asks for a new ticket and opens a new stream, which
+# starts with a fresh snapshot.
+
+HEARTBEAT = 25             # Seconds between keepalive comments on a quiet stream
+MAX_STREAM_SECONDS = 3300  # Below the 3600 s function timeout
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Authorization, Content-Type",
+    "Access-Control-Max-Age": "3600",
+}
+
+STREAM_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # Don't let a proxy hold events back
+}
+
+
+def _respond(body, status):
+    response = make_response(jsonify(body), status)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+def _stream(hub, client):
+    deadline = time.monotonic() + MAX_STREAM_SECONDS
+    try:
+        yield hub.snapshot_event()
+        while time.monotonic() < deadline:
+            event = client.next(HEARTBEAT)
+            yield event if event is not None else ": keepalive\n\n"
+    finally:
+        # Runs when the stream ends or the browser goes away (the next write fails)
+        hub.unsubscribe(client)
+
+
+@metrics.instrumented("live_calls")
+def live_calls(request):
+    if request.method == "OPTIONS":
+        return make_response("", 204, CORS_HEADERS)
+
+    account_id = request.args.get("account_id")
+    metrics.annotate(account_id=account_id)
+
+    if request.method == "POST":
+        uid = admin_auth.account_admin(request, db, account_id)
+        if uid is None:
+            return _respond({"error": "Not authorized for this account"}, 403)
+        return _respond({"ticket": admin_auth.issue_ticket(db, uid, account_id), "expires_in": admin_auth.TICKET_TTL}, 200)
+
+    if admin_auth.redeem_ticket(db, request.args.get("ticket"), account_id) is None:
+        return _respond({"error": "Missing, used or expired ticket"}, 403)
+
+    try:
+        hub, client = live_state.subscribe(db.collection("accounts").document(account_id))
+    except live_state.TooManyClients:
+        log.warning("LIVE", "Too many live clients", account_id=account_id)
+        return _respond({"error": "Too many live dashboards open for this account"}, 503)
+    except Exception as e:
+        log.error("LIVE", "live_calls failed", exc_info=e)
+        return _respond({"error": "Failed to open the live stream"}, 500)
+
+    return Response(stream_with_context(_stream(hub, client)), mimetype="text/event-stream", headers=STREAM_HEADERS)
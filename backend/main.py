@@ -0,0 +1,41 @@
+from flask import Response
+import importlib
+import threading
+
+# Single-function entry point. Deploy backend/ with --entry-point router and
+# every webhook is served as <router url>/<handler name>, so one warm
+# instance (and one set of shared clients) handles the whole call flow.
+# Handlers are imported on their first request, so a route only pays for
+# the libraries it actually uses. The per-function deployments keep working
+# unchanged.
+
+HANDLERS = (
+    "handle_call",
+    "join_conference",
+    "gather_response",
+    "process_response",
+    "caller_status_callback",
+    "conference_callback",
+    "validate_invite",
+)
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load_handler(name):
+    handler = _loaded.get(name)
+    if handler is None:
+        with _lock:
+            handler = _loaded.get(name)
+            if handler is None:
+                module = importlib.import_module(f"{name}.main")
+                handler = _loaded[name] = getattr(module, name)
+    return handler
+
+
+def router(request):
+    name = request.path.strip("/").split("/")[-1]
+    if name not in HANDLERS:
+        return Response(f"Unknown handler: {name}", status=404)
+    return load_handler(name)(request)
@@ -1,110 +1,123 @@
 from flask import request, Response
-from google.cloud import firestore
-from twilio.twiml.voice_response import VoiceResponse, Say, Dial
+from common import accounts, call_queue, call_token, log, metrics, outbound, round_robin, twiml
+from common import roster as rosters
+from common.clients import db, twilio as client
 
-db = firestore.Client()
 MAX_RETRIES = 2
 
 def normalize(number):
     return number.replace("+", "").replace("-", "").replace(" ", "")
 
+@metrics.instrumented("process_response")
 def process_response(request):
     try:
         digits = request.form.get("Digits")
         from_number = request.form.get("From")
         callee_sid = request.form.get("CallSid")  # ✅ Recipient’s unique SID
-        room = request.args.get("room")
-        user_id = request.args.get("user_id")
-        account_id = request.args.get("account_id")
+        ctx = request.args.get("ctx")
         retry_count = int(request.args.get("retry", 0))
 
-        call_sid = room.replace("conf-", "") if room else None
+        # 🔏 Signed call context from handle_call: account, user, room and expected number without reads
+        context = None
+        if ctx:
+            context = call_token.verify(ctx)
+            if context is None:
+                log.warning("PROCESS", "Invalid or expired call context")
+                return Response(twiml.say("This call can no longer be accepted. Goodbye."), mimetype="application/xml")
+            room, user_id, account_id = context["room"], context["user_id"], context["account_id"]
+            params = {"ctx": ctx}
+        else:
+            room = request.args.get("room")
+            user_id = request.args.get("user_id")
+            account_id = request.args.get("account_id")
+            params = {"room": room, "user_id": user_id, "account_id": account_id}
 
-        print(f"[PROCESS] Digits: {digits}")
-        print(f"[PROCESS] From: {from_number}")
-        print(f"[PROCESS] Room: {room}")
-        print(f"[PROCESS] User ID: {user_id}")
-        print(f"[PROCESS] Account ID: {account_id}")
-        print(f"[PROCESS] Retry: {retry_count}")
-        print(f"[PROCESS] Callee SID: {callee_sid}")
+        call_sid = room.replace("conf-", "") if room else None
 
-        response = VoiceResponse()
+        metrics.annotate(account_id=account_id)
+        log.info(
+            "PROCESS", "Key press",
+            digits=digits, room=room, user_id=user_id, retry=retry_count, signed=context is not None
+        )
 
         if not all([room, user_id, account_id]):
-            print("[PROCESS] Missing required parameters.")
-            response.say("Missing required information. Goodbye.")
-            return Response(str(response), mimetype="application/xml")
+            log.warning("PROCESS", "Missing required parameters")
+            return Response(twiml.say("Missing required information. Goodbye."), mimetype="application/xml")
+
+        account_ref = db.collection("accounts").document(account_id)
+        user_ref = account_ref.collection("users").document(user_id)
+        call_ref = account_ref.collection("calls").document(call_sid)
 
         if digits != "1":
-            print("[PROCESS] Incorrect digit pressed.")
+            log.info("PROCESS", "Incorrect digit pressed")
+            round_robin.mark_pressed(call_ref, callee_sid)
             if retry_count >= MAX_RETRIES:
-                response.say("Too many failed attempts. Goodbye.")
-                return Response(str(response), mimetype="application/xml")
+                return Response(twiml.say("Too many failed attempts. Goodbye."), mimetype="application/xml")
 
-            retry_url = (
-                f"https://us-central1-roundrobin-clean.cloudfunctions.net/gather_response"
-                f"?room={room}&user_id={user_id}&account_id={account_id}&retry={retry_count + 1}"
-            )
-            response.say("Invalid input.")
-            response.redirect(retry_url)
-            return Response(str(response), mimetype="application/xml")
+            retry_url = twiml.function_url("gather_response", **params, retry=retry_count + 1)
+            return Response(twiml.say_redirect("Invalid input.", retry_url), mimetype="application/xml")
 
-        account_ref = db.collection("accounts").document(account_id)
-        user_ref = account_ref.collection("users").document(user_id)
-        call_ref = account_ref.collection("calls").document(call_sid)
+        if context is not None:
+            expected_twilio_number = context["expected_number"]
+            ring_group = context["ring_group"]
+            queued = context["queued"]
+        else:
+            user_doc = user_ref.get()
+            metrics.count("firestore_reads")
+            with metrics.phase("account_lookup"):
+                account_doc = accounts.get_by_id(db, account_id)
 
-        user_doc = user_ref.get()
-        account_doc = account_ref.get()
-        call_doc = call_ref.get()
+            if not user_doc.exists or account_doc is None:
+                log.error("PROCESS", "Firestore documents missing")
+                return Response(twiml.say("System error occurred. Goodbye."), mimetype="application/xml")
 
-        if not user_doc.exists or not account_doc.exists or not call_doc.exists:
-            print("[PROCESS] Firestore documents missing.")
-            response.say("System error occurred. Goodbye.")
-            return Response(str(response), mimetype="application/xml")
+            expected_twilio_number = account_doc.to_dict().get("twilio_number")
+            ring_group = round_robin.get_group_size(account_doc.to_dict()) > 1
+            queued = call_queue.is_queue_mode(account_doc.to_dict())
 
-        expected_twilio_number = account_doc.to_dict().get("twilio_number")
         if normalize(from_number) != normalize(expected_twilio_number):
-            print(f"[PROCESS] Verification failed: {normalize(from_number)} != {normalize(expected_twilio_number)}")
+            log.warning("PROCESS", "Verification failed", from_number=normalize(from_number), expected=normalize(expected_twilio_number))
             if retry_count >= MAX_RETRIES:
-                response.say("Verification failed. Goodbye.")
-                return Response(str(response), mimetype="application/xml")
-
-            retry_url = (
-                f"https://us-central1-roundrobin-clean.cloudfunctions.net/gather_response"
-                f"?room={room}&user_id={user_id}&account_id={account_id}&retry={retry_count + 1}"
-            )
-            response.say("Verification failed.")
-            response.redirect(retry_url)
-            return Response(str(response), mimetype="application/xml")
-
-        if call_doc.to_dict().get("status") == "caller_left":
-            print("[PROCESS] Caller has already left. Do not join.")
-            response.say("The caller has already left. Goodbye.")
-            return Response(str(response), mimetype="application/xml")
+                return Response(twiml.say("Verification failed. Goodbye."), mimetype="application/xml")
+
+            retry_url = twiml.function_url("gather_response", **params, retry=retry_count + 1)
+            return Response(twiml.say_redirect("Verification failed.", retry_url), mimetype="application/xml")
+
+        # 🏁 First user to press 1 wins the call
+        with metrics.phase("claim"):
+            claim = round_robin.claim_answer(db, call_ref, user_id, callee_sid)
+        if claim == "missing":
+            log.error("PROCESS", "Call document missing")
+            return Response(twiml.say("System error occurred. Goodbye."), mimetype="application/xml")
+        if claim == "caller_left":
+            log.info("PROCESS", "Caller has already left. Do not join.")
+            return Response(twiml.say("The caller has already left. Goodbye."), mimetype="application/xml")
+        if claim == "taken":
+            log.info("PROCESS", "Another user already accepted the call")
+            return Response(twiml.say("Another user has already accepted the call. Goodbye."), mimetype="application/xml")
+
+        # 📥 Queue mode: the caller leaves the queue and this user stays busy until they hang up
+        if queued:
+            with metrics.phase("queue"):
+                call_queue.answered(db, account_ref, user_id, call_sid)
+
+        # 🔕 Ring group: stop the other legs that are still ringing
+        if ring_group:
+            with metrics.phase("cancel_legs"):
+                outbound.cancel_legs(client, call_ref, exclude={callee_sid})
 
         # ✅ Mark user as joined
         user_ref.update({"status": "in_conference"})
-
-        # ✅ Join conference with status callbacks and participant label
-        dial = Dial()
-        dial.conference(
-            room,
-            participant_label=user_id,  # ✅ Enables user_id tracking via webhook
-            start_conference_on_enter=True,
-            end_conference_on_exit=True,
-            status_callback=(
-                f"https://us-central1-roundrobin-clean.cloudfunctions.net/conference_callback"
-                f"?account_id={account_id}&call_sid={callee_sid}"
-            ),
-            status_callback_event="start end join leave",  # ✅ Proper format
-            status_callback_method="POST",
-            wait_url="http://twimlets.com/holdmusic?Bucket=com.twilio.music.ambient"
+        metrics.count("firestore_writes")
+        rosters.note_status(account_id, user_id, "in_conference")
+
+        # ✅ Join conference with status callbacks and participant label (user_id tracking via webhook)
+        status_callback = twiml.function_url("conference_callback", account_id=account_id, call_sid=callee_sid)
+        return Response(
+            twiml.join_conference("Connecting you now.", room, user_id, status_callback),
+            mimetype="application/xml"
         )
 
-        response.say("Connecting you now.")
-        response.append(dial)
-        return Response(str(response), mimetype="application/xml")
-
     except Exception as e:
-        print(f"[ERROR] process_response: {e}")
+        log.error("PROCESS", "process_response failed", exc_info=e)
         return Response("<Response><Say>Error occurred. Goodbye.</Say></Response>", mimetype="application/xml")
@@ -0,0 +1,321 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+import heapq
+import itertools
+import os
+import random
+import statistics
+import threading
+import time
+
+# Runs the real handlers end to end against sim.firestore and sim.twilio,
+# with no network. Each simulated caller walks the production sequence:
+#
+#   join_conference -> conference_callback (caller joins) -> handle_call
+#   (dispatched through a LocalDispatcher) -> outbound legs ->
+#   caller_status_callback (initiated / ringing / final) -> gather_response
+#   -> process_response -> conference_callback (callee joins / leaves,
+#   conference end) -> caller_status_callback (caller hangs up)
+#
+# Twilio-side delays (ringing, answering, talking) are multiplied by scale;
+# the handlers' own waits run in real time. The simulation is one warm
+# instance: the account cache, rosters and the Twilio gateway are shared by
+# every call, as they would be on one Cloud Functions instance.
+
+
+class Timer:
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """Runs fn(*args) after a delay on a worker pool."""
+
+    def __init__(self, workers):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sim-webhook")
+        self._pending = 0
+        self._idle = threading.Condition()
+        threading.Thread(target=self._loop, name="sim-scheduler", daemon=True).start()
+
+    def at(self, delay, fn, *args):
+        timer = Timer()
+        with self._idle:
+            self._pending += 1
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), timer, fn, args))
+            self._cond.notify()
+        return timer
+
+    def drain(self, timeout):
+        """Wait until nothing is scheduled or running. False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, timer, fn, args = heapq.heappop(self._heap)
+            self._pool.submit(self._run, timer, fn, args)
+
+    def _run(self, timer, fn, args):
+        try:
+            if not timer.cancelled:
+                fn(*args)
+        except Exception as e:
+            print(f"[SIM] Scheduled {getattr(fn, '__name__', fn)} failed: {e!r}")
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+
+class Call:
+    """One simulated inbound caller."""
+
+    def __init__(self, sid, account):
+        self.sid = sid
+        self.account = account
+        self.room = f"conf-{sid}"
+        self.conference_callback = None
+        self.joined = None
+        self.answered = None
+        self.answered_by = None
+        self.answered_leg = None
+        self.outcome = None
+        self.sequence = itertools.count(1)
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+
+class Simulation:
+    def __init__(
+        self, accounts=20, users=8, mode="polling", group_size=1, max_retries=2,
+        routing_strategy="static", scale=0.1, patience=300, talk_time=(5, 20),
+        duplicate_rate=0.0, api_latency=0.02, webhook_workers=256, seed=7
+    ):
+        # Settings the handlers read at import or first use; the simulator is one instance
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        os.environ.setdefault("TWILIO_CALLS_PER_SECOND", "1000")
+        os.environ.setdefault("CALL_TOKEN_SECRET", "simulator")
+        os.environ["DISPATCH_BACKEND"] = "local"
+
+        import flask
+        import main
+        from common import clients, dispatch, metrics, twilio_gateway
+        from sim import firestore, twilio
+
+        self._flask = flask
+        self._router = main.router
+        self._metrics = metrics
+        self.app = flask.Flask("simulator")
+        self.rng = random.Random(seed)
+        self.scale = scale
+        self.patience = patience
+        self.talk_time = talk_time
+        self.duplicate_rate = duplicate_rate
+        self.scheduler = Scheduler(webhook_workers)
+
+        self.db = firestore.Client()
+        self.twilio = twilio.FakeTwilio(self, api_latency=api_latency)
+        clients.db.set(self.db)
+        clients.twilio.set(twilio_gateway.Gateway("ACsimulator", "simulator", client=self.twilio))
+
+        self.dispatcher = dispatch.LocalDispatcher(workers=webhook_workers, time_scale=scale)
+        self.dispatcher.register("handle_call", lambda payload: self.post(self._url("handle_call"), payload))
+        dispatch.set_backend(self.dispatcher)
+
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+        self._callees = {}
+        self.accounts = []
+        for a in range(accounts):
+            account_id = f"acct{a:03d}"
+            number = f"+1555{a:07d}"
+            self.db.collection("accounts").document(account_id).set({
+                "name": f"Account {a}",
+                "twilio_number": number,
+                "max_retries": max_retries,
+                "ring_group_size": group_size,
+                "round_robin_mode": mode,
+                "routing_strategy": routing_strategy,
+            })
+            for u in range(users):
+                phone = f"+1666{a:03d}{u:04d}"
+                self.db.collection("accounts").document(account_id).collection("users").document(f"user{u:02d}").set({
+                    "name": f"User {u}",
+                    "phone_number": phone,
+                    "order": u,
+                    "status": "available",
+                })
+                self._callees[phone] = twilio.random_callee(self.rng)
+            self.accounts.append((account_id, number))
+        self._never = twilio.NEVER
+        self._new_sid = twilio.new_sid
+        self.db.reset_ops()
+
+    # -- webhooks --
+
+    def _url(self, name, **params):
+        from common import twiml
+
+        return twiml.function_url(name, **params)
+
+    def post(self, url, form):
+        """Deliver a webhook to the handler the URL names and return the response body."""
+        parts = urlsplit(url)
+        name = parts.path.rstrip("/").split("/")[-1]
+        with self.app.test_request_context(f"/{name}", query_string=parts.query, method="POST", data=form):
+            response = self._router(self._flask.request)
+        if isinstance(response, tuple):
+            response = response[0]
+        return response.get_data(as_text=True) if hasattr(response, "get_data") else str(response)
+
+    def post_status(self, url, form):
+        """A status callback; Twilio sometimes delivers one twice."""
+        if not url:
+            return
+        self.post(url, form)
+        if self.duplicate_rate and self.rng.random() < self.duplicate_rate:
+            self.post(url, form)
+
+    def callee(self, number):
+        return self._callees.get(number, self._never)
+
+    # -- the inbound caller --
+
+    def place_call(self, index):
+        account_id, number = self.accounts[index % len(self.accounts)]
+        call = Call(self._new_sid(), account_id)
+        with self._calls_lock:
+            self.calls[call.sid] = call
+            self.calls[call.room] = call
+
+        body = self.post(self._url("join_conference"), {"CallSid": call.sid, "To": number, "From": f"+1777{index:07d}"})
+        conference = ElementTree.fromstring(body).find("Dial/Conference")
+        call.conference_callback = conference.get("statusCallback")
+        call.joined = time.monotonic()
+        self._conference_event(call, call.conference_callback, "participant-join", call.sid)
+
+        if not call.done.wait(self.patience * self.scale):
+            self.hang_up(call, "abandoned")
+        call.done.wait()
+        return call
+
+    def _conference_event(self, call, url, event, call_sid, label=None):
+        form = {
+            "StatusCallbackEvent": event,
+            "FriendlyName": call.room,
+            "ConferenceSid": "CF" + call.sid[2:],
+            "CallSid": call_sid,
+            "SequenceNumber": str(next(call.sequence)),
+        }
+        if label:
+            form["ParticipantLabel"] = label
+        self.post_status(url, form)
+
+    def bridged(self, leg, room, label, status_callback):
+        """A callee's TwiML put them in the caller's conference."""
+        call = self.calls.get(room)
+        if call is None:
+            return
+        with call.lock:
+            first = call.answered is None and call.outcome is None
+            if first:
+                call.answered = time.monotonic()
+                call.answered_by = label
+                call.answered_leg = (leg, status_callback)
+        if not first:
+            self.twilio._finish(leg, "completed")
+            return
+        self._conference_event(call, status_callback, "participant-join", leg.sid, label)
+        self.scheduler.at(self.rng.uniform(*self.talk_time) * self.scale, self.hang_up, call, "answered")
+
+    def caller_redirected(self, call_sid, twiml):
+        """handle_call's goodbye: the caller hears it and the call ends."""
+        call = self.calls.get(call_sid)
+        if call is not None:
+            self.scheduler.at(0.5 * self.scale, self.hang_up, call, "no_answer")
+
+    def hang_up(self, call, outcome):
+        with call.lock:
+            if call.outcome is not None:
+                return
+            call.outcome = "answered" if call.answered else outcome
+            answered_leg = call.answered_leg
+        if answered_leg:
+            leg, status_callback = answered_leg
+            self._conference_event(call, status_callback, "participant-leave", leg.sid, call.answered_by)
+            self.twilio._finish(leg, "completed")
+        self._conference_event(call, call.conference_callback, "conference-end", call.sid)
+        self.post_status(
+            self._url("caller_status_callback", account_id=call.account),
+            {"CallSid": call.sid, "CallStatus": "completed"}
+        )
+        call.done.set()
+
+    # -- running --
+
+    def run(self, callers, concurrency):
+        self._metrics.reset()
+        self.db.reset_ops()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="sim-caller") as pool:
+            calls = list(pool.map(self.place_call, range(callers)))
+        self.dispatcher.join()
+        self.scheduler.drain(timeout=60)
+        return Report(calls, time.monotonic() - started, self)
+
+
+class Report:
+    def __init__(self, calls, elapsed, sim):
+        self.elapsed = elapsed
+        self.callers = len(calls)
+        self.outcomes = {}
+        for call in calls:
+            self.outcomes[call.outcome] = self.outcomes.get(call.outcome, 0) + 1
+        self.time_to_answer = sorted(call.answered - call.joined for call in calls if call.answered)
+        self.firestore = dict(sim.db.ops)
+        self.twilio = dict(sim.twilio.requests)
+        self.handlers = sim._metrics.totals()
+        self.scale = sim.scale
+
+    def percentile(self, p):
+        if not self.time_to_answer:
+            return None
+        index = min(len(self.time_to_answer) - 1, int(round(p / 100 * (len(self.time_to_answer) - 1))))
+        return self.time_to_answer[index]
+
+    def summary(self):
+        calls = max(self.callers, 1)
+        return {
+            "callers": self.callers,
+            "elapsed_s": round(self.elapsed, 2),
+            "outcomes": self.outcomes,
+            "answer_rate": round(self.outcomes.get("answered", 0) / calls, 3),
+            "tta_s": {
+                f"p{p}": round(self.percentile(p), 3) if self.time_to_answer else None
+                for p in (50, 90, 95, 99)
+            },
+            "tta_mean_s": round(statistics.mean(self.time_to_answer), 3) if self.time_to_answer else None,
+            "firestore_reads_per_call": round(self.firestore["reads"] / calls, 2),
+            "firestore_writes_per_call": round(self.firestore["writes"] / calls, 2),
+            "firestore_queries_per_call": round(self.firestore["queries"] / calls, 2),
+            "firestore_listener_reads_per_call": round(self.firestore["listener_reads"] / calls, 2),
+            "twilio_requests_per_call": round(sum(self.twilio.values()) / calls, 2),
+            "twilio_creates_per_call": round(self.twilio["create"] / calls, 2),
+        }
@@ -0,0 +1,442 @@
+from collections import defaultdict
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+import copy
+import datetime
+import itertools
+import queue
+import threading
+import uuid
+
+# In-memory stand-in for google.cloud.firestore.Client, covering the API the
+# backend uses: documents and subcollections, get/set(merge)/update/create/
+# delete with dotted field paths and the SERVER_TIMESTAMP, DELETE_FIELD,
+# ArrayUnion, ArrayRemove and Increment transforms, where/order_by/limit
+# queries, get_all, batches, snapshot listeners, and transactions that work
+# with the real @firestore.transactional (optimistic: a commit whose reads
+# changed raises Aborted and is retried). Every billed operation is counted
+# in ops.
+
+
+class Client:
+    def __init__(self):
+        self._docs = {}                      # path tuple -> (data, version)
+        self._children = defaultdict(set)    # collection path -> doc ids
+        self._lock = threading.RLock()
+        self._versions = itertools.count(1)
+        self._doc_watches = defaultdict(list)   # doc path -> [Watch]
+        self._query_watches = []                # [Watch] on queries
+        self._events = queue.Queue()
+        self._ops_lock = threading.Lock()
+        self.ops = {"reads": 0, "writes": 0, "queries": 0, "listener_reads": 0}
+        threading.Thread(target=self._notify, name="fake-firestore-listeners", daemon=True).start()
+
+    # -- public API --
+
+    def collection(self, name):
+        return CollectionReference(self, (name,))
+
+    def document(self, path):
+        return DocumentReference(self, tuple(path.split("/")))
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        for ref in references:
+            yield ref.get(transaction=transaction)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return Transaction(self, max_attempts, read_only)
+
+    def count(self, op, n=1):
+        with self._ops_lock:
+            self.ops[op] += n
+
+    def reset_ops(self):
+        with self._ops_lock:
+            for op in self.ops:
+                self.ops[op] = 0
+
+    # -- storage --
+
+    def _snapshot(self, path):
+        entry = self._docs.get(path)
+        data, version = entry if entry else (None, 0)
+        return DocumentSnapshot(DocumentReference(self, path), copy.deepcopy(data), version)
+
+    def _read(self, path):
+        with self._lock:
+            self.count("reads")
+            return self._snapshot(path)
+
+    def _check(self, kind, path):
+        exists = path in self._docs
+        if kind == "create" and exists:
+            raise exceptions.Conflict(f"Document already exists: {'/'.join(path)}")
+        if kind == "update" and not exists:
+            raise exceptions.NotFound(f"No document to update: {'/'.join(path)}")
+
+    def _apply(self, writes):
+        """Apply [(kind, path, data, merge)] atomically and queue listener events."""
+        with self._lock:
+            for kind, path, _, _ in writes:
+                self._check(kind, path)
+            changed = []
+            for kind, path, data, merge in writes:
+                before = self._docs.get(path)
+                if kind == "delete":
+                    if before is None:
+                        continue
+                    del self._docs[path]
+                    self._children[path[:-1]].discard(path[-1])
+                else:
+                    current = copy.deepcopy(before[0]) if before and (kind == "update" or merge) else {}
+                    if kind == "update":
+                        for field, value in data.items():
+                            _set_field(current, field.split("."), value)
+                    else:
+                        _merge(current, data)
+                    self._docs[path] = (current, next(self._versions))
+                    self._children[path[:-1]].add(path[-1])
+                changed.append((path, before is None))
+            self.count("writes", len(writes))
+            if changed:
+                self._events.put([(path, created, self._snapshot(path)) for path, created in changed])
+
+    def _list(self, collection_path):
+        return [collection_path + (doc_id,) for doc_id in sorted(self._children.get(collection_path, ()))]
+
+    # -- listeners --
+
+    def _watch_doc(self, path, callback):
+        watch = Watch(self)
+        with self._lock:
+            self._doc_watches[path].append((watch, callback))
+            snapshot = self._snapshot(path)
+        self.count("listener_reads")
+        callback([snapshot], [], _now())
+        return watch
+
+    def _watch_query(self, query, callback):
+        watch = Watch(self)
+        with self._lock:
+            docs = query._run()
+            self._query_watches.append((watch, query, callback))
+        self.count("listener_reads", max(len(docs), 1))
+        callback(docs, [DocumentChange("ADDED", doc) for doc in docs], _now())
+        return watch
+
+    def _unwatch(self, watch):
+        with self._lock:
+            for path, watches in list(self._doc_watches.items()):
+                self._doc_watches[path] = [w for w in watches if w[0] is not watch]
+            self._query_watches = [w for w in self._query_watches if w[0] is not watch]
+
+    def _notify(self):
+        while True:
+            changes = self._events.get()
+            for path, created, snapshot in changes:
+                with self._lock:
+                    doc_watches = list(self._doc_watches.get(path, ()))
+                    query_watches = [w for w in self._query_watches if w[1]._covers(path)]
+                for watch, callback in doc_watches:
+                    self.count("listener_reads")
+                    _safe(callback, [snapshot], [], _now())
+                for watch, query, callback in query_watches:
+                    with self._lock:
+                        docs = query._run()
+                    kind = "REMOVED" if not snapshot.exists else "ADDED" if created else "MODIFIED"
+                    self.count("listener_reads")
+                    _safe(callback, docs, [DocumentChange(kind, snapshot)], _now())
+
+
+class Watch:
+    def __init__(self, client):
+        self._client = client
+
+    def unsubscribe(self):
+        self._client._unwatch(self)
+
+
+class DocumentChange:
+    class _Type:
+        def __init__(self, name):
+            self.name = name
+
+    def __init__(self, kind, document):
+        self.type = self._Type(kind)
+        self.document = document
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self._path = path
+
+    @property
+    def id(self):
+        return self._path[-1]
+
+    @property
+    def path(self):
+        return "/".join(self._path)
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._path[:-1])
+
+    def collection(self, name):
+        return CollectionReference(self._client, self._path + (name,))
+
+    def get(self, field_paths=None, transaction=None):
+        if transaction is not None:
+            return transaction._read(self._path)
+        return self._client._read(self._path)
+
+    def set(self, data, merge=False):
+        self._client._apply([("set", self._path, data, merge)])
+
+    def update(self, data):
+        self._client._apply([("update", self._path, data, False)])
+
+    def create(self, data):
+        self._client._apply([("create", self._path, data, False)])
+
+    def delete(self):
+        self._client._apply([("delete", self._path, None, False)])
+
+    def on_snapshot(self, callback):
+        return self._client._watch_doc(self._path, callback)
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other._path == self._path
+
+    def __hash__(self):
+        return hash(self._path)
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, version):
+        self.reference = reference
+        self._data = data
+        self._version = version
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        value = self._data or {}
+        for part in field.split("."):
+            if not isinstance(value, dict) or part not in value:
+                raise KeyError(field)
+            value = value[part]
+        return copy.deepcopy(value)
+
+
+class Query:
+    OPERATORS = {
+        "==": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a is not None and a < b,
+        "<=": lambda a, b: a is not None and a <= b,
+        ">": lambda a, b: a is not None and a > b,
+        ">=": lambda a, b: a is not None and a >= b,
+        "in": lambda a, b: a in b,
+        "array_contains": lambda a, b: isinstance(a, list) and b in a,
+    }
+
+    def __init__(self, client, collection_path, filters=(), orders=(), limit_to=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_to
+
+    def where(self, field, op, value):
+        return Query(self._client, self._collection_path, self._filters + ((field, op, value),), self._orders, self._limit)
+
+    def order_by(self, field, direction="ASCENDING"):
+        return Query(self._client, self._collection_path, self._filters, self._orders + ((field, direction),), self._limit)
+
+    def limit(self, count):
+        return Query(self._client, self._collection_path, self._filters, self._orders, count)
+
+    def stream(self, transaction=None):
+        with self._client._lock:
+            docs = self._run()
+        self._client.count("queries")
+        self._client.count("reads", max(len(docs), 1))  # An empty result is billed as one read
+        return iter(docs)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction))
+
+    def on_snapshot(self, callback):
+        return self._client._watch_query(self, callback)
+
+    def _covers(self, path):
+        return path[:-1] == self._collection_path
+
+    def _run(self):
+        docs = [self._client._snapshot(path) for path in self._client._list(self._collection_path)]
+        for field, op, value in self._filters:
+            docs = [doc for doc in docs if self.OPERATORS[op](_field(doc._data, field), value)]
+        for field, direction in reversed(self._orders):
+            docs = [doc for doc in docs if _field(doc._data, field) is not None]
+            docs.sort(key=lambda doc: _field(doc._data, field), reverse=str(direction).upper().startswith("DESC"))
+        return docs[:self._limit] if self._limit is not None else docs
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._collection_path[-1]
+
+    @property
+    def parent(self):
+        if len(self._collection_path) == 1:
+            return None
+        return DocumentReference(self._client, self._collection_path[:-1])
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self._collection_path + (document_id or uuid.uuid4().hex[:20],))
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(("set", ref._path, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append(("update", ref._path, data, False))
+
+    def create(self, ref, data):
+        self._writes.append(("create", ref._path, data, False))
+
+    def delete(self, ref):
+        self._writes.append(("delete", ref._path, None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        if writes:
+            self._client._apply(writes)
+
+
+class Transaction(WriteBatch):
+    """Implements the hooks google.cloud.firestore.transactional drives."""
+
+    def __init__(self, client, max_attempts, read_only):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._read_versions = {}
+
+    def _clean_up(self):
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().bytes
+
+    def _read(self, path):
+        snapshot = self._client._read(path)
+        self._read_versions[path] = snapshot._version
+        return snapshot
+
+    def _commit(self):
+        with self._client._lock:
+            for path, version in self._read_versions.items():
+                entry = self._client._docs.get(path)
+                if (entry[1] if entry else 0) != version:
+                    self._clean_up()
+                    raise exceptions.Aborted("Transaction contention; retrying")
+            writes = self._writes
+            self._clean_up()
+            if writes:
+                self._client._apply(writes)
+        return []
+
+    def _rollback(self):
+        self._clean_up()
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _safe(callback, *args):
+    try:
+        callback(*args)
+    except Exception as e:
+        print(f"[FAKE FIRESTORE] Listener callback failed: {e}")
+
+
+def _field(data, field):
+    value = data or {}
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _resolve(existing, value):
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.ArrayUnion):
+        current = list(existing) if isinstance(existing, list) else []
+        return current + [v for v in value.values if v not in current]
+    if isinstance(value, transforms.ArrayRemove):
+        return [v for v in (existing if isinstance(existing, list) else []) if v not in value.values]
+    if isinstance(value, transforms.Increment):
+        return (existing if isinstance(existing, (int, float)) else 0) + value.value
+    if isinstance(value, transforms.Maximum):
+        return max(existing, value.value) if isinstance(existing, (int, float)) else value.value
+    if isinstance(value, transforms.Minimum):
+        return min(existing, value.value) if isinstance(existing, (int, float)) else value.value
+    if isinstance(value, dict):
+        resolved = {}
+        for key, inner in value.items():
+            if inner is not transforms.DELETE_FIELD:
+                resolved[key] = _resolve(None, inner)
+        return resolved
+    return copy.deepcopy(value)
+
+
+def _set_field(data, parts, value):
+    for part in parts[:-1]:
+        child = data.get(part)
+        if not isinstance(child, dict):
+            child = data[part] = {}
+        data = child
+    if value is transforms.DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = _resolve(data.get(parts[-1]), value)
+
+
+def _merge(data, incoming):
+    for key, value in incoming.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge(data[key], value)
+        elif value is transforms.DELETE_FIELD:
+            data.pop(key, None)
+        else:
+            data[key] = _resolve(data.get(key), value)
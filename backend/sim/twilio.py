@@ -0,0 +1,190 @@
+from xml.etree import ElementTree
+import threading
+import time
+import uuid
+
+# Fake Twilio: the REST surface common.twilio_gateway drives (calls.create,
+# calls(sid).update) plus the behaviour of every outbound leg it places. A
+# leg reports initiated and ringing, then either times out (no-answer) or is
+# answered by the simulated callee, who fetches the prompt TwiML, presses 1
+# and follows whatever TwiML process_response returns. Webhooks are posted
+# through the Simulation (sim/driver.py), so the real handlers run.
+
+FINAL = {"completed", "no-answer", "busy", "failed", "canceled"}
+
+
+def new_sid():
+    return "CA" + uuid.uuid4().hex
+
+
+class Leg:
+    def __init__(self, sid, params):
+        self.sid = sid
+        self.to = params["to"]
+        self.from_ = params["from_"]
+        self.url = params["url"]
+        self.status_callback = params.get("status_callback")
+        self.timeout = params.get("timeout", 60)
+        self.state = "queued"
+        self.created = time.monotonic()
+        self.answered = None
+        self.timers = []
+        self.lock = threading.Lock()
+
+
+class _Calls:
+    def __init__(self, twilio):
+        self._twilio = twilio
+
+    def create(self, **params):
+        return self._twilio.create(**params)
+
+    def __call__(self, sid):
+        return _CallContext(self._twilio, sid)
+
+
+class _CallContext:
+    def __init__(self, twilio, sid):
+        self._twilio = twilio
+        self._sid = sid
+
+    def update(self, **params):
+        return self._twilio.update(self._sid, **params)
+
+
+class FakeTwilio:
+    """Stands in for twilio.rest.Client inside a common.twilio_gateway.Gateway."""
+
+    def __init__(self, sim, api_latency=0.02):
+        self.sim = sim
+        self.api_latency = api_latency
+        self.calls = _Calls(self)
+        self.legs = {}
+        self.requests = {"create": 0, "update": 0}
+        self._lock = threading.Lock()
+
+    # -- REST --
+
+    def create(self, **params):
+        self._request("create")
+        leg = Leg(new_sid(), params)
+        with self._lock:
+            self.legs[leg.sid] = leg
+        scale = self.sim.scale
+        callee = self.sim.callee(leg.to)
+        self._later(leg, 0.1 * scale, self._status, leg, "initiated", "queued")
+        self._later(leg, 0.3 * scale, self._status, leg, "ringing", "initiated")
+        answer_after = callee.answer_after(self.sim.rng)
+        if answer_after is not None and answer_after < leg.timeout:
+            self._later(leg, answer_after * scale, self._answer, leg)
+        else:
+            self._later(leg, leg.timeout * scale, self._finish, leg, "no-answer")
+        return leg
+
+    def update(self, sid, status=None, twiml=None, **params):
+        self._request("update")
+        leg = self.legs.get(sid)
+        if leg is None:
+            # Not one of ours: the inbound caller leg, e.g. the goodbye message
+            if twiml is not None:
+                self.sim.caller_redirected(sid, twiml)
+            return None
+        if status == "canceled":
+            with leg.lock:
+                cancel = leg.state in ("queued", "initiated", "ringing")
+            if cancel:
+                self._finish(leg, "canceled")
+        elif status == "completed":
+            self._finish(leg, "completed")
+        return leg
+
+    def _request(self, operation):
+        with self._lock:
+            self.requests[operation] += 1
+        if self.api_latency:
+            time.sleep(self.api_latency)
+
+    # -- leg behaviour --
+
+    def _later(self, leg, delay, fn, *args):
+        leg.timers.append(self.sim.scheduler.at(delay, fn, *args))
+
+    def _form(self, leg, **extra):
+        return {"CallSid": leg.sid, "From": leg.from_, "To": leg.to, "AccountSid": "ACsimulator", **extra}
+
+    def _status(self, leg, status, expected):
+        with leg.lock:
+            if leg.state != expected:
+                return
+            leg.state = status
+        self.sim.post_status(leg.status_callback, self._form(leg, CallStatus=status))
+
+    def _answer(self, leg):
+        with leg.lock:
+            if leg.state not in ("initiated", "ringing"):
+                return
+            leg.state = "in-progress"
+            leg.answered = time.monotonic()
+        self._follow(leg, self.sim.post(leg.url, self._form(leg, CallStatus="in-progress")))
+
+    def _follow(self, leg, body):
+        """Act on the TwiML a webhook returned for this leg."""
+        try:
+            root = ElementTree.fromstring(body)
+        except ElementTree.ParseError:
+            self._finish(leg, "completed")
+            return
+        gather = root.find("Gather")
+        conference = root.find("Dial/Conference")
+        redirect = root.find("Redirect")
+        if gather is not None:
+            delay = self.sim.callee(leg.to).press_after(self.sim.rng) * self.sim.scale
+            self.sim.scheduler.at(delay, self._press, leg, gather.get("action"))
+        elif conference is not None:
+            self.sim.bridged(leg, conference.text, conference.get("participantLabel"), conference.get("statusCallback"))
+        elif redirect is not None:
+            self._follow(leg, self.sim.post(redirect.text, self._form(leg, CallStatus="in-progress")))
+        else:
+            self._finish(leg, "completed")
+
+    def _press(self, leg, action):
+        with leg.lock:
+            if leg.state != "in-progress":
+                return
+        self._follow(leg, self.sim.post(action, self._form(leg, Digits="1", CallStatus="in-progress")))
+
+    def _finish(self, leg, status):
+        with leg.lock:
+            if leg.state in FINAL:
+                return
+            leg.state = status
+            timers, leg.timers = leg.timers, []
+        for timer in timers:
+            timer.cancel()
+        duration = int(time.monotonic() - leg.answered) if leg.answered else 0
+        self.sim.post_status(leg.status_callback, self._form(leg, CallStatus=status, CallDuration=str(duration)))
+
+
+class Callee:
+    """How one simulated user picks up. Times are in unscaled seconds."""
+
+    def __init__(self, answer_rate, answer_delay=(2, 8), press_delay=(0.5, 2)):
+        self.answer_rate = answer_rate
+        self.answer_delay = answer_delay
+        self.press_delay = press_delay
+
+    def answer_after(self, rng):
+        if rng.random() >= self.answer_rate:
+            return None
+        return rng.uniform(*self.answer_delay)
+
+    def press_after(self, rng):
+        return rng.uniform(*self.press_delay)
+
+
+NEVER = Callee(0.0)
+
+
+def random_callee(rng):
+    return Callee(rng.uniform(0.2, 0.9))
+
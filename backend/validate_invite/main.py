@@ -1,64 +1,119 @@
 import functions_framework
+from collections import OrderedDict
+from datetime import datetime, timezone
 from firebase_admin import firestore, initialize_app
 from flask import make_response, jsonify
+from common import metrics
+import hashlib
+import threading
+import time
 
 # Initialize Firebase Admin
 initialize_app()
 db = firestore.client()
 
+# Invites are resolved with one get on invite_tokens/{sha256(token)}, which
+# generateInviteToken (frontend/functions) writes with the account name
+# already filled in. Answers are cached per instance for a short while, so
+# an invite campaign or a page being refreshed does not reach Firestore
+# on every request; a used invite may keep validating for up to
+# POSITIVE_TTL seconds.
+POSITIVE_TTL = 30
+NEGATIVE_TTL = 60
+CACHE_SIZE = 4096
+PREFLIGHT_MAX_AGE = 86400  # Browsers cap this (Chrome at 2 hours) but will reuse the preflight that long
+
+_cache = OrderedDict()  # token hash -> (status, body, expires)
+_lock = threading.Lock()
+
+
+def _cached(key):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            del _cache[key]
+            return None
+        return entry
+
+
+def _remember(key, status, body, ttl):
+    with _lock:
+        _cache[key] = (status, body, time.monotonic() + ttl)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _respond(status, body):
+    response = make_response(jsonify(body) if isinstance(body, dict) else body, status)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+def _lookup(token_hash, token):
+    """Invite details for a token, or None."""
+    token_doc = db.collection('invite_tokens').document(token_hash).get()
+    metrics.count("firestore_reads")
+    if token_doc.exists:
+        invite = token_doc.to_dict()
+        invite['id'] = invite.pop('inviteId', None)
+        return invite
+
+    # Invites created before invite_tokens existed (they expire after 7 days)
+    metrics.count("firestore_queries")
+    docs = list(db.collection('invites').where('token', '==', token).limit(1).stream())
+    metrics.count("firestore_reads")  # The match, or the minimum charge for an empty result
+    for doc in docs:
+        invite = doc.to_dict()
+        invite['id'] = doc.id
+        if not invite.get('accountName'):
+            account_doc = db.collection('accounts').document(invite['accountId']).get()
+            metrics.count("firestore_reads")
+            invite['accountName'] = account_doc.to_dict().get('name', 'Unknown Account') if account_doc.exists else 'Unknown Account'
+        return invite
+    return None
+
+
 @functions_framework.http
+@metrics.instrumented("validate_invite")
 def validate_invite(request):
     if request.method == "OPTIONS":
-        # Handle preflight CORS request
+        # Handle preflight CORS request; the browser may reuse it for PREFLIGHT_MAX_AGE
         response = make_response("", 204)
         response.headers["Access-Control-Allow-Origin"] = "*"
         response.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
         response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+        response.headers["Access-Control-Max-Age"] = str(PREFLIGHT_MAX_AGE)
         return response
 
     try:
         request_json = request.get_json(silent=True)
         token = request_json.get('token') if request_json else None
 
-        if not token:
-            response = make_response("Missing token.", 400)
-            response.headers["Access-Control-Allow-Origin"] = "*"
-            return response
+        if not token or not isinstance(token, str):
+            return _respond(400, "Missing token.")
 
-        # Query the invites collection for the token
-        invites_ref = db.collection('invites')
-        query = invites_ref.where('token', '==', token).limit(1)
-        results = query.stream()
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        cached = _cached(token_hash)
+        if cached is not None:
+            return _respond(cached[0], cached[1])
 
-        invite = None
-        for doc in results:
-            invite = doc.to_dict()
-            invite['id'] = doc.id
+        invite = _lookup(token_hash, token)
+        expires_at = invite.get('expiresAt') if invite else None
 
-        if not invite:
-            response = make_response("Invalid or expired token.", 404)
-            response.headers["Access-Control-Allow-Origin"] = "*"
-            return response
+        if not invite or (expires_at and expires_at <= datetime.now(timezone.utc)):
+            _remember(token_hash, 404, "Invalid or expired token.", NEGATIVE_TTL)
+            return _respond(404, "Invalid or expired token.")
 
         if invite.get('used', False):
-            response = make_response("This invite has already been used.", 400)
-            response.headers["Access-Control-Allow-Origin"] = "*"
-            return response
-
-        # Fetch accountName using accountId
-        account_ref = db.collection('accounts').document(invite['accountId'])
-        account_doc = account_ref.get()
-        if account_doc.exists:
-            invite['accountName'] = account_doc.to_dict().get('name', 'Unknown Account')
-        else:
-            invite['accountName'] = 'Unknown Account'
+            _remember(token_hash, 400, "This invite has already been used.", NEGATIVE_TTL)
+            return _respond(400, "This invite has already been used.")
 
         # Return invite details
-        response = make_response(jsonify(invite), 200)
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        return response
+        _remember(token_hash, 200, invite, POSITIVE_TTL)
+        return _respond(200, invite)
 
     except Exception as e:
-        response = make_response(str(e), 500)
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        return response
\ No newline at end of file
+        return _respond(500, str(e))
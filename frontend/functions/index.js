@@ -1,11 +1,16 @@
-const {onDocumentCreated} = require("firebase-functions/v2/firestore");
+const {onDocumentCreated, onDocumentUpdated} = require("firebase-functions/v2/firestore");
 const {initializeApp} = require("firebase-admin/app");
 const {getFirestore, Timestamp} = require("firebase-admin/firestore");
 const {v4: uuidv4} = require("uuid");
+const {createHash} = require("crypto");
 
 initializeApp();
 const db = getFirestore();
 
+// invite_tokens/{sha256(token)} is what validate_invite reads: one get per
+// token instead of a query over invites plus an account read.
+const tokenHash = (token) => createHash("sha256").update(token).digest("hex");
+
 exports.generateInviteToken = onDocumentCreated("invites/{inviteId}", async (event) => {
   const snap = event.data;
   const inviteRef = db.doc(snap.ref.path);
@@ -14,11 +19,41 @@ exports.generateInviteToken = onDocumentCreated("invites/{inviteId}", async (eve
   if (!inviteData || inviteData.token) return;
 
   const token = uuidv4();
+  const hash = tokenHash(token);
   const expiresAt = Timestamp.fromDate(new Date(Date.now() + 7 * 24 * 60 * 60 * 1000)); // 7 days
 
-  await inviteRef.update({
+  // Denormalize the account name so the invite page needs no account read
+  let accountName = inviteData.accountName;
+  if (!accountName && inviteData.accountId) {
+    const accountDoc = await db.doc(`accounts/${inviteData.accountId}`).get();
+    accountName = accountDoc.exists ? accountDoc.get("name") : null;
+  }
+
+  const batch = db.batch();
+  batch.update(inviteRef, {
     token,
+    tokenHash: hash,
+    accountName: accountName || "Unknown Account",
+    expiresAt,
+    used: false,
+  });
+  batch.set(db.doc(`invite_tokens/${hash}`), {
+    inviteId: snap.id,
+    email: inviteData.email || null,
+    accountId: inviteData.accountId || null,
+    accountName: accountName || "Unknown Account",
     expiresAt,
     used: false,
   });
+  await batch.commit();
+});
+
+// Keep the token document's used flag in step with the invite
+exports.syncInviteToken = onDocumentUpdated("invites/{inviteId}", async (event) => {
+  const before = event.data.before.data();
+  const after = event.data.after.data();
+
+  if (!after || !after.tokenHash || before.used === after.used) return;
+
+  await db.doc(`invite_tokens/${after.tokenHash}`).set({used: !!after.used}, {merge: true});
 });
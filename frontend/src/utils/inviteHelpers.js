@@ -1,11 +1,18 @@
-import { collection, addDoc, serverTimestamp } from "firebase/firestore";
+import { collection, addDoc, doc, getDoc, serverTimestamp } from "firebase/firestore";
 import { db } from "../firebaseConfig";
 
-export const sendUserInvite = async ({ email, accountId }) => {
+export const sendUserInvite = async ({ email, accountId, accountName }) => {
+  // Store the account name on the invite so validating it needs no account read
+  if (!accountName) {
+    const accountSnap = await getDoc(doc(db, "accounts", accountId));
+    accountName = accountSnap.exists() ? accountSnap.data().name : undefined;
+  }
+
   const inviteRef = collection(db, "invites");
   await addDoc(inviteRef, {
     email,
     accountId,
+    ...(accountName ? { accountName } : {}),
     createdAt: serverTimestamp(),
     used: false,
   });